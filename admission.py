@@ -0,0 +1,175 @@
+import os
+import time
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+
+from flask import g
+from werkzeug.exceptions import ServiceUnavailable
+from werkzeug.wsgi import ClosingIterator
+
+import db
+from paths import DB_PATH
+from settings import get_settings
+
+# ------------------------
+# 設定
+# ------------------------
+MB = 1024 * 1024
+# ワーカー間の空き確認間隔（秒）
+GLOBAL_POLL_INTERVAL = 0.2
+# この時間を超えて残っている転送中スロットは異常終了の残骸とみなして削除する
+STALE_SLOT_HOURS = 6
+
+# プロセス内の使用状況（pool -> [件数, バイト数]）
+_usage = {}
+_cond = threading.Condition()
+
+# ------------------------
+# 転送スロット
+# ------------------------
+class TransferSlot:
+
+    def __init__(self, pool, size):
+        self.pool = pool
+        self.size = size
+        self.slot_id = None
+        self._released = False
+
+    def release(self):
+        with _cond:
+            if self._released:
+                return
+            self._released = True
+            usage = _usage[self.pool]
+            usage[0] -= 1
+            usage[1] -= self.size
+            _cond.notify_all()
+
+        if self.slot_id is not None:
+            _release_global(self.slot_id)
+
+def _fits(count, used, size, max_count, max_bytes):
+    if max_count and count >= max_count:
+        return False
+    # 上限を超える大きさのファイルでも、他に転送がなければ通す
+    if max_bytes and count > 0 and used + size > max_bytes:
+        return False
+    return True
+
+def _unavailable(settings):
+    return ServiceUnavailable(
+        "混み合っています。しばらくしてから再度お試しください",
+        retry_after=settings.retry_after,
+    )
+
+# ------------------------
+# 転送開始（空きがなければ queue_timeout 秒待ち、それでも空かなければ 503）
+# ------------------------
+def acquire(pool, size):
+    """
+    pool: "download" / "zip"
+    size: 転送するファイルサイズ（バイト）
+
+    取得したスロットはレスポンス送信完了時に自動で解放される。
+    """
+    settings = get_settings().transfer
+    max_count = getattr(settings, f"{pool}_max_count")
+    max_bytes = getattr(settings, f"{pool}_max_mb") * MB
+    deadline = time.monotonic() + settings.queue_timeout
+    size = size or 0
+
+    # プロセス内の上限
+    with _cond:
+        usage = _usage.setdefault(pool, [0, 0])
+        while not _fits(usage[0], usage[1], size, max_count, max_bytes):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise _unavailable(settings)
+            _cond.wait(remaining)
+        usage[0] += 1
+        usage[1] += size
+
+    slot = TransferSlot(pool, size)
+
+    # ワーカー間の上限
+    global_max_count = getattr(settings, f"global_{pool}_max_count")
+    global_max_bytes = getattr(settings, f"global_{pool}_max_mb") * MB
+    if global_max_count or global_max_bytes:
+        try:
+            slot.slot_id = _acquire_global(pool, size, global_max_count, global_max_bytes, deadline)
+        except Exception:
+            slot.release()
+            raise
+        if slot.slot_id is None:
+            slot.release()
+            raise _unavailable(settings)
+
+    g.setdefault("transfer_slots", []).append(slot)
+    return slot
+
+# ------------------------
+# ワーカー間スロット（transfer_slots テーブル）
+# ------------------------
+def _acquire_global(pool, size, max_count, max_bytes, deadline):
+    purged = False
+    while True:
+        slot_id = db.crud.acquire_transfer_slot(pool, os.getpid(), size, max_count, max_bytes)
+        if slot_id is not None:
+            return slot_id
+
+        if not purged:
+            _purge_stale()
+            purged = True
+            continue
+
+        if time.monotonic() + GLOBAL_POLL_INTERVAL > deadline:
+            return None
+        time.sleep(GLOBAL_POLL_INTERVAL)
+
+def _release_global(slot_id):
+    # レスポンス送信完了後（リクエスト外）に呼ばれるため専用の接続で削除する
+    conn = sqlite3.connect(DB_PATH, timeout=get_settings().db.busy_timeout)
+    try:
+        conn.execute("DELETE FROM transfer_slots WHERE id = ?", (slot_id,))
+        conn.commit()
+    finally:
+        conn.close()
+
+def _purge_stale():
+    stale_before = datetime.now() - timedelta(hours=STALE_SLOT_HOURS)
+
+    # 終了したワーカーのスロット（同一ホストのプロセスIDで確認できる POSIX のみ）
+    dead_pids = []
+    if os.name == "posix":
+        for pid in db.crud.list_transfer_slot_pids():
+            try:
+                os.kill(pid, 0)
+            except ProcessLookupError:
+                dead_pids.append(pid)
+            except PermissionError:
+                pass
+
+    db.crud.purge_transfer_slots(stale_before, dead_pids)
+
+# ------------------------
+# Flask 連携
+# ------------------------
+def init_app(app):
+
+    @app.after_request
+    def release_transfer_slots_on_close(response):
+        # 送信完了（レスポンスのクローズ）時に解放
+        for slot in g.pop("transfer_slots", []):
+            if response.direct_passthrough:
+                # send_file などはレスポンスの close が呼ばれないため、送信データ側で解放する
+                response.response = ClosingIterator(response.response, slot.release)
+            else:
+                response.call_on_close(slot.release)
+        return response
+
+    @app.teardown_request
+    def release_transfer_slots(exc):
+        # 例外などでレスポンスに渡せなかったスロットを解放
+        for slot in g.pop("transfer_slots", []):
+            slot.release()
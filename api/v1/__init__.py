@@ -0,0 +1,400 @@
+# ------------------------
+# REST API v1（業務システムからの自動連携用）
+# ------------------------
+# 認証は Authorization: Bearer <APIトークン>。セッション・CSRFトークンは使わない。
+# トークンは flask --app app api-token create <ログインID> で発行する。
+import os
+import uuid
+from datetime import date, timedelta
+from functools import wraps
+from typing import Annotated
+
+import click
+import msgspec
+from flask import Blueprint, request, g, abort, url_for, send_file, current_app
+from werkzeug.exceptions import HTTPException
+
+import db
+import admission
+import storage
+import upload_stream
+from paths import UPLOAD_DIR
+from settings import get_settings
+from views import schemas
+from views.internal import is_expired
+
+api_v1_bp = Blueprint("api_v1", __name__, url_prefix="/api/v1", cli_group="api-token")
+
+# ------------------------
+# 設定
+# ------------------------
+MB = 1024 * 1024
+# 一覧の件数（既定・上限）
+PAGE_SIZE = 100
+PAGE_SIZE_MAX = 1000
+# 一括作成の上限件数
+BULK_MAX_BOXES = 500
+# ファイルボックスの既定の有効日数
+DEFAULT_EXPIRE_DAYS = 30
+
+# ------------------------
+# モデル
+# ------------------------
+class Box(msgspec.Struct, omit_defaults=True):
+    id: str
+    title: str | None
+    upload_token: str
+    upload_url: str
+    expires_at: str | None
+    max_files: int | None
+    max_total_size: int | None          # MB
+    created_at: str | None
+    cursor: int | None = None
+
+class File(msgspec.Struct, omit_defaults=True):
+    id: str
+    name: str
+    size: int                           # バイト
+    uploaded_at: str
+    download_url: str
+    cursor: int | None = None
+
+class CreateBox(msgspec.Struct):
+    title: Annotated[str, msgspec.Meta(min_length=1)]
+    max_files: Annotated[int, msgspec.Meta(ge=1)]
+    max_total_size: Annotated[int, msgspec.Meta(ge=1)]  # MB
+    expires_at: date | None = None
+
+class Error(msgspec.Struct):
+    error: str
+
+def box_model(row):
+    return Box(
+        id=row["id"],
+        title=row["title"],
+        upload_token=row["upload_token"],
+        upload_url=url_for("guest.guest_upload", token=row["upload_token"], _external=True),
+        expires_at=row["expires_at"],
+        max_files=row["max_files"],
+        max_total_size=row["max_total_size"],
+        created_at=row["created_at"],
+    )
+
+def file_model(row):
+    return File(
+        id=row["file_id"],
+        name=row["original_name"],
+        size=row["file_size"],
+        uploaded_at=row["uploaded_at"],
+        download_url=url_for(
+            "api_v1.download_file",
+            box_id=row["upload_request_id"],
+            file_id=row["file_id"],
+            _external=True,
+        ),
+    )
+
+# ------------------------
+# エラー（JSONで返す）
+# ------------------------
+@api_v1_bp.errorhandler(HTTPException)
+def handle_http_exception(e):
+    response = schemas.json_response(Error(error=e.description or e.name), e.code)
+    for name, value in e.get_headers():
+        if name.lower() != "content-type":
+            response.headers[name] = value
+    if e.code == 401:
+        response.headers["WWW-Authenticate"] = "Bearer"
+    return response
+
+# ------------------------
+# トークン認証
+# ------------------------
+def token_required(view):
+    @wraps(view)
+    def wrapped(*args, **kwargs):
+        scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+        if scheme.lower() != "bearer" or not token.strip():
+            abort(401, description="APIトークンを指定してください")
+
+        user = db.crud.get_api_token_user(token.strip())
+        if user is None:
+            abort(401, description="APIトークンが正しくありません")
+        g.api_user = user
+
+        # アクセスログ
+        if hasattr(g, "access_log"):
+            g.access_log.update({
+                "user_id": user["login_id"],
+            })
+
+        return view(*args, **kwargs)
+    return wrapped
+
+def get_box(box_id):
+    # 作成者本人（管理者はすべて）のファイルボックスのみ操作できる
+    box = db.crud.get_upload_request(box_id)
+    if box is None:
+        abort(404, description="ファイルボックスが見つかりません")
+    if box["created_by"] != g.api_user["login_id"] and not g.api_user["admin_flag"]:
+        abort(404, description="ファイルボックスが見つかりません")
+    return box
+
+def page_args():
+    cursor = request.args.get("cursor", type=int)
+    limit = request.args.get("limit", PAGE_SIZE, type=int)
+    return cursor, max(1, min(limit, PAGE_SIZE_MAX))
+
+def page_response(items, limit):
+    # 1件多く取得して次ページの有無を判定する
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_cursor = items[-1].cursor
+    return schemas.json_response(schemas.Page(items=items, next_cursor=next_cursor))
+
+# ------------------------
+# ファイルボックス一覧
+# ------------------------
+@api_v1_bp.route("/boxes", methods=["GET"])
+@token_required
+def list_boxes():
+    cursor, limit = page_args()
+    rows = db.crud.list_upload_requests_page(g.api_user["login_id"], cursor, limit + 1)
+
+    items = []
+    for row in rows:
+        box = box_model(row)
+        box.cursor = row["seq"]
+        items.append(box)
+    return page_response(items, limit)
+
+# ------------------------
+# ファイルボックス作成（配列を渡すと一括作成、1トランザクション）
+# ------------------------
+@api_v1_bp.route("/boxes", methods=["POST"])
+@token_required
+def create_boxes():
+    payload = schemas.decode_request(request.get_data(), CreateBox | list[CreateBox])
+    bulk = isinstance(payload, list)
+    boxes = payload if bulk else [payload]
+    if not boxes or len(boxes) > BULK_MAX_BOXES:
+        abort(400, description=f"一度に作成できるファイルボックスは1～{BULK_MAX_BOXES}件です")
+
+    default_expires_at = date.today() + timedelta(days=DEFAULT_EXPIRE_DAYS)
+    created = []
+    for box in boxes:
+        box_id = db.crud.create_upload_request(
+            box.title,
+            (box.expires_at or default_expires_at).isoformat(),
+            box.max_files,
+            box.max_total_size,
+            g.api_user["login_id"],
+        )
+        created.append(box_model(db.crud.get_upload_request(box_id)))
+
+    # アクセスログ
+    if hasattr(g, "access_log"):
+        g.access_log.update({
+            "action": "API ファイルボックス作成",
+            "upload_request_id": created[0].id if len(created) == 1 else None,
+        })
+
+    return schemas.json_response(created if bulk else created[0], 201)
+
+# ------------------------
+# ファイルボックス取得
+# ------------------------
+@api_v1_bp.route("/boxes/<box_id>", methods=["GET"])
+@token_required
+def get_box_detail(box_id):
+    return schemas.json_response(box_model(get_box(box_id)))
+
+# ------------------------
+# ファイル一覧
+# ------------------------
+@api_v1_bp.route("/boxes/<box_id>/files", methods=["GET"])
+@token_required
+def list_files(box_id):
+    get_box(box_id)
+    cursor, limit = page_args()
+    rows = db.crud.list_files_page(box_id, cursor, limit + 1)
+
+    items = []
+    for row in rows:
+        item = file_model(row)
+        item.cursor = row["id"]
+        items.append(item)
+    return page_response(items, limit)
+
+# ------------------------
+# ファイルアップロード（リクエストボディがファイルの内容、?name=ファイル名）
+# ------------------------
+@api_v1_bp.route("/boxes/<box_id>/files", methods=["POST"])
+@token_required
+def upload_file(box_id):
+    box = get_box(box_id)
+
+    # 期限切れのファイルボックスには本文を受信せずに拒否する（画面からのアップロードと同じ）
+    if is_expired(box):
+        abort(403, description="このファイルボックスは期限切れです")
+
+    name = os.path.basename((request.args.get("name") or "").replace("\\", "/"))
+    if not name:
+        abort(400, description="ファイル名（name）を指定してください")
+
+    # サイズは Content-Length で事前に確認する（本文はマルチパートにせずそのまま送る）
+    size = request.content_length
+    if size is None:
+        abort(411, description="Content-Length を指定してください")
+    if size > get_settings().upload.max_file_size_mb * MB:
+        abort(413, description="ファイルサイズの上限を超えています")
+    check_quota(box, name, size)
+
+    # アクセスログ
+    if hasattr(g, "access_log"):
+        g.access_log.update({
+            "action": "API ファイルアップロード",
+            "upload_request_id": box_id,
+        })
+
+    # 受信しながら暗号化して保存（ロックの外で行う）
+    upload_dir = os.path.join(UPLOAD_DIR, box_id)
+    os.makedirs(upload_dir, exist_ok=True)
+    file_id = str(uuid.uuid4())
+    save_path = os.path.join(upload_dir, file_id)
+    file_size, codec = storage.save_encrypted(
+        current_app.fernet, request.stream, save_path, compress=get_settings().upload.compress
+    )
+
+    with upload_stream.upload_lock:
+        # 受信中に他のアップロードが登録されている場合があるため確認し直す
+        try:
+            existing_file = check_quota(box, name, file_size)
+        except HTTPException:
+            os.remove(save_path)
+            raise
+
+        if existing_file:
+            # 同名ファイルは置き換え
+            old_path = os.path.join(upload_dir, existing_file["file_id"])
+            if os.path.exists(old_path):
+                os.remove(old_path)
+            db.crud.delete_file(existing_file["file_id"])
+
+        db.crud.create_file(box_id, file_id, name, file_size, codec)
+        # 他のアップロードが確認できるよう即時コミット
+        db.crud.commit(immediate=True)
+
+    # アクセスログ
+    if hasattr(g, "access_log"):
+        g.access_log.update({
+            "file_id": file_id,
+        })
+
+    return schemas.json_response(file_model(db.crud.get_file(file_id)), 201)
+
+def check_quota(box, name, size):
+    """ファイル数・合計サイズを確認する。戻り値: 置き換え対象の同名ファイル"""
+    files = db.crud.list_files(box["id"])
+    existing_file = next((f for f in files if f["original_name"] == name), None)
+    if existing_file:
+        files = [f for f in files if f["file_id"] != existing_file["file_id"]]
+
+    if box["max_files"] <= len(files):
+        abort(403, description="最大ファイル数に達しています")
+    if sum(f["file_size"] for f in files) + size > box["max_total_size"] * MB:
+        abort(413, description="合計ファイルサイズの上限に達しています")
+
+    return existing_file
+
+# ------------------------
+# ファイルダウンロード（復号しながら送信）
+# ------------------------
+@api_v1_bp.route("/boxes/<box_id>/files/<file_id>", methods=["GET"])
+@token_required
+def download_file(box_id, file_id):
+    get_box(box_id)
+
+    file_row = db.crud.get_file(file_id)
+    if file_row is None or file_row["upload_request_id"] != box_id:
+        abort(404, description="ファイルが見つかりません")
+
+    file_path = os.path.join(UPLOAD_DIR, box_id, file_id)
+    if not os.path.exists(file_path):
+        abort(404, description="ファイルが見つかりません")
+
+    # 同時転送数・転送量の制限（上限時は 503）
+    admission.acquire("download", file_row["file_size"])
+
+    # アクセスログ
+    if hasattr(g, "access_log"):
+        g.access_log.update({
+            "action": "API ファイルダウンロード",
+            "upload_request_id": box_id,
+            "file_id": file_id,
+        })
+
+    response = send_file(
+        storage.DecryptedReader(current_app.fernet, file_path),
+        as_attachment=True,
+        download_name=file_row["original_name"]
+    )
+    response.content_length = file_row["file_size"]
+    return response
+
+# ------------------------
+# ファイル削除
+# ------------------------
+@api_v1_bp.route("/boxes/<box_id>/files/<file_id>", methods=["DELETE"])
+@token_required
+def delete_file(box_id, file_id):
+    get_box(box_id)
+
+    file_row = db.crud.get_file(file_id)
+    if file_row is None or file_row["upload_request_id"] != box_id:
+        abort(404, description="ファイルが見つかりません")
+
+    file_path = os.path.join(UPLOAD_DIR, box_id, file_id)
+    if os.path.exists(file_path):
+        os.remove(file_path)
+    db.crud.delete_file(file_id)
+
+    # アクセスログ
+    if hasattr(g, "access_log"):
+        g.access_log.update({
+            "action": "API ファイル削除",
+            "upload_request_id": box_id,
+            "file_id": file_id,
+        })
+
+    return "", 204
+
+# ------------------------
+# APIトークン管理（flask --app app api-token ...）
+# ------------------------
+@api_v1_bp.cli.command("create")
+@click.argument("login_id")
+@click.option("--name", help="用途（例: 基幹システム連携）")
+def create_token_command(login_id, name):
+    """APIトークンを発行する（トークンは発行時にのみ表示）"""
+    if db.crud.get_user(login_id) is None:
+        raise click.ClickException(f"ユーザーが見つかりません: {login_id}")
+    token = db.crud.create_api_token(login_id, name)
+    click.echo(token)
+
+@api_v1_bp.cli.command("list")
+@click.option("--user", "login_id", help="ログインIDで絞り込み")
+def list_tokens_command(login_id):
+    """APIトークンの一覧を表示する"""
+    for t in db.crud.list_api_tokens(login_id):
+        status = "revoked" if t["revoked"] else "active"
+        click.echo(f'{t["id"]}\t{t["user_id"]}\t{t["name"] or ""}\t{status}\t{t["last_used_at"] or "-"}')
+
+@api_v1_bp.cli.command("revoke")
+@click.argument("token_id", type=int)
+def revoke_token_command(token_id):
+    """APIトークンを失効させる"""
+    if not db.crud.revoke_api_token(token_id):
+        raise click.ClickException(f"トークンが見つかりません: {token_id}")
+    click.echo("revoked")
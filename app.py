@@ -10,11 +10,23 @@ from flask_seasurf import SeaSurf
 from cryptography.fernet import Fernet
 
 import db
+import mailer
+import file_cleanup
+import zip_cache
+import upload_stream
+import settings
+import admission
+import assets
+import log_events
+import report_snapshot
+from compression import CompressionMiddleware
 from paths import CONFIG_PATH, UPLOAD_DIR, DB_PATH
+from session_store import SqliteSessionInterface
 from views.filters import format_datetime, format_filesize, format_mask_email
 from views.internal import internal_bp
 from views.admin import admin_bp
 from views.guest import guest_bp
+from api.v1 import api_v1_bp
 
 # ------------------------
 # envファイル読込
@@ -26,17 +38,27 @@ load_dotenv()
 # ------------------------
 app = Flask(__name__)
 
+# アップロードファイルは受信しながら暗号化して保存する
+upload_stream.init_app(app)
+
 # ----------------------------
 # Apache リバースプロキシ配下で動かすため、
 # X-Forwarded-* ヘッダを信頼して URL/redirect を補正する
+# （X-Forwarded-For は接続元IPアドレス。レート制限・アクセスログはプロキシではなく利用者単位になる）
 # ----------------------------
 app.wsgi_app = ProxyFix(
     app.wsgi_app,
+    x_for=settings.get_settings().security.trusted_proxies,
     x_proto=1,
     x_host=1,
     x_prefix=1
 )
 
+# ----------------------------
+# レスポンス圧縮（HTML・JSON・CSV。ファイルダウンロード・ZIPは対象外）
+# ----------------------------
+app.wsgi_app = CompressionMiddleware(app.wsgi_app)
+
 # ----------------------------
 # 署名用キー（Cookieの安全性に必須）
 # ----------------------------
@@ -59,6 +81,8 @@ app.fernet = Fernet(fernet_key)
 # ------------------------
 # 起動時処理
 # ------------------------
+# 設定ファイル（config/app.ini）は更新時・SIGHUP受信時に再読込
+settings.install_reload_signal()
 # DB初期化
 db.init_db()
 # ディレクトリ作成
@@ -77,7 +101,16 @@ app.config.update(
     SESSION_COOKIE_SECURE=os.getenv("FLASK_ENV") != "development",  # HTTPS時のみ送信
     SESSION_COOKIE_SAMESITE="Lax",                    # クロスサイト送信制限
 )
-Session(app)
+
+# セッション保存先
+#   sqlite    : DBのsessionsテーブル（既定）
+#   cookie    : 署名付きCookie（サーバ側に保存しない）
+#   filesystem: Flask-Session のファイル保存（従来方式）
+session_backend = os.environ.get("SESSION_BACKEND") or "sqlite"
+if session_backend == "sqlite":
+    app.session_interface = SqliteSessionInterface()
+elif session_backend == "filesystem":
+    Session(app)
 
 # ----------------------------
 # Blueprint登録
@@ -85,25 +118,59 @@ Session(app)
 app.register_blueprint(internal_bp)
 app.register_blueprint(admin_bp)
 app.register_blueprint(guest_bp)
+app.register_blueprint(api_v1_bp)
 
 app.teardown_appcontext(db.close_db)
 
+# メール送信スレッド
+mailer.init_app(app)
+
+# 一括削除したファイル実体の削除スレッド
+file_cleanup.init_app(app)
+
+# 一括ダウンロードZIPの作成スレッド
+zip_cache.init_app(app)
+
+# レポート用スナップショットの作成スレッド
+report_snapshot.init_app(app)
+
+# 転送系ルートの同時実行制御
+admission.init_app(app)
+
+# 静的ファイル（フィンガープリント付きURL・事前圧縮）
+assets.init_app(app)
+
 app.template_filter("datetime")(format_datetime)
 app.template_filter("filesize")(format_filesize)
 app.template_filter("mask_email")(format_mask_email)
 
+@app.context_processor
+def inject_settings():
+    # Dropzone の設定値など、画面側で使う設定
+    return dict(upload_settings=settings.get_settings().upload)
+
 # ----------------------------
 # CSRF対策
 # ----------------------------
 env = os.environ.get("FLASK_ENV") or "development"
 if env == "production":
     csrf = SeaSurf(app)
+    # REST API はトークン認証のため対象外
+    for endpoint, view in app.view_functions.items():
+        if endpoint.startswith(f"{api_v1_bp.name}."):
+            csrf.exempt(view)
 else:
     csrf = None
     @app.context_processor
     def inject_csrf_token():
         return dict(csrf_token=lambda: "")
 
+# ------------------------
+# リクエスト単位トランザクション
+# ------------------------
+# リクエスト中の書き込みはアクセスログと合わせて1回でコミットする
+app.before_request(db.begin_request_transaction)
+
 # ------------------------
 # アクセスログ取得用
 # ------------------------
@@ -122,27 +189,42 @@ def before_request_logging():
 
 @app.after_request
 def after_request_logging(response):
+    # 500系（ビューで例外が発生した場合を含む）は業務データをロールバックし、アクセスログのみコミットする
+    if response.status_code >= 500:
+        db.end_request_transaction(success=False)
+
     log = getattr(g, "access_log", None)
-    if not log:
-        return response
+    if log:
+        log["http_status"] = response.status_code
+        log["result"] = "success" if response.status_code < 400 else "error"
 
-    log["http_status"] = response.status_code
-    log["result"] = "success" if response.status_code < 400 else "error"
+        if log["action"] or log["result"] == "error":
+            db.crud.save_access_log(log)
+            del g.access_log
+        else:
+            log = None
+
+    # 業務データとアクセスログをまとめてコミット
+    db.end_request_transaction()
 
-    if log["action"] or log["result"] == "error":
-        db.crud.save_access_log(log)
-        del g.access_log
+    # ログ更新待ち（ロングポーリング）を起こす
+    if log and log["upload_request_id"]:
+        log_events.notify()
 
     return response
 
 @app.teardown_request
 def teardown_request_logging(exc):
     if exc:
+        # 業務データはロールバック
+        db.end_request_transaction(success=False)
+
         log = getattr(g, "access_log", None)
         if log:
             log["http_status"] = 500
             log["result"] = "error"
-            db.crud.save_access_log(log)
+            # ログのみ即時コミット
+            db.crud.save_access_log(log, immediate=True)
             del g.access_log
 
 # ------------------------
@@ -0,0 +1,246 @@
+import io
+import os
+import sys
+import asyncio
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.wsgi import FileWrapper
+
+import assets
+from app import app
+
+# ------------------------
+# 設定
+# ------------------------
+# Flask の処理を実行するスレッド数（待ち合わせ中の転送はスレッドを使わない）
+ASGI_THREADS = int(os.environ.get("ASGI_THREADS") or 32)
+# アプリが読み込む前のリクエストボディをメモリに保持する上限（超えたら受信を待たせる）
+BODY_BUFFER_SIZE = 1024 * 1024
+# レスポンス送信時の読み込み単位
+SEND_CHUNK_SIZE = 64 * 1024
+
+_END = object()
+
+def _file_wrapper(file, buffer_size=8192):
+    return FileWrapper(file, max(buffer_size, SEND_CHUNK_SIZE))
+
+# ------------------------
+# リクエストボディ（wsgi.input）
+# ------------------------
+class _RequestBody(io.RawIOBase):
+    """
+    イベントループ側で受信したボディを、アプリ（スレッドプール側）が読み込んだ分だけ渡す。
+    ボディ全体を受信・保存してからアプリを呼ぶと、アップロードの上限確認（Content-Length・受信中の中断）
+    が受信後になるため、受信しながら渡す。保持するのは BODY_BUFFER_SIZE までで、超えたら受信を待たせる。
+    """
+
+    def __init__(self, loop):
+        self._loop = loop
+        self._chunks = deque()
+        self._buffered = 0
+        self._eof = False
+        self._cond = threading.Condition()
+        self._space = asyncio.Event()
+
+    def readable(self):
+        return True
+
+    # イベントループ側
+    async def feed(self, data):
+        with self._cond:
+            if data:
+                self._chunks.append(data)
+                self._buffered += len(data)
+            self._cond.notify()
+        while True:
+            with self._cond:
+                if self._buffered <= BODY_BUFFER_SIZE:
+                    return
+                self._space.clear()
+            await self._space.wait()
+
+    def end(self):
+        # 受信完了・切断（切断の場合、Content-Length に満たないボディは Werkzeug が ClientDisconnected にする）
+        with self._cond:
+            self._eof = True
+            self._cond.notify()
+
+    # スレッドプール側
+    def readinto(self, b):
+        with self._cond:
+            while not self._chunks and not self._eof:
+                self._cond.wait()
+            if not self._chunks:
+                return 0
+
+            data = self._chunks[0]
+            n = min(len(b), len(data))
+            b[:n] = data[:n]
+            if n < len(data):
+                self._chunks[0] = data[n:]
+            else:
+                self._chunks.popleft()
+            self._buffered -= n
+            if self._buffered <= BODY_BUFFER_SIZE:
+                self._loop.call_soon_threadsafe(self._space.set)
+            return n
+
+# ------------------------
+# ASGI → WSGI 変換
+# ------------------------
+class AsyncWsgiBridge:
+    """
+    ASGI サーバ（uvicorn 等）から WSGI アプリを呼び出す。
+
+    - リクエストボディはイベントループ側で受信しながらアプリに渡す（全体を保存してから呼び出さない）
+    - アプリの呼び出しとレスポンスの読み出し（復号）はスレッドプールで行い、
+      クライアントへの送信待ちはイベントループ側で行う
+    これにより低速なクライアントとの転送中もスレッドを占有しない。
+    """
+
+    def __init__(self, wsgi_app, threads=ASGI_THREADS):
+        self.wsgi_app = wsgi_app
+        self.executor = ThreadPoolExecutor(threads, thread_name_prefix="asgi-wsgi")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+        elif scope["type"] == "http":
+            await self._http(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self.executor.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _http(self, scope, receive, send):
+        loop = asyncio.get_running_loop()
+
+        # 同じリクエストの処理は同じコンテキストで実行する
+        # （stream_with_context などがスレッドをまたいでコンテキストを扱えるように）
+        context = contextvars.copy_context()
+
+        def run(func, *args):
+            return loop.run_in_executor(self.executor, context.run, func, *args)
+
+        body = _RequestBody(loop)
+        disconnected = asyncio.Event()
+        watcher = asyncio.ensure_future(self._receive(receive, body, disconnected))
+
+        response_start = {}
+
+        def start_response(status, headers, exc_info=None):
+            response_start["status"] = int(status.split(" ", 1)[0])
+            response_start["headers"] = [
+                (name.lower().encode("latin-1"), value.encode("latin-1"))
+                for name, value in headers
+            ]
+            return lambda data: None
+
+        try:
+            iterable = await run(self.wsgi_app, self._environ(scope, body), start_response)
+            try:
+                iterator = iter(iterable)
+                chunk = await run(next, iterator, _END)
+
+                await send({
+                    "type": "http.response.start",
+                    "status": response_start["status"],
+                    "headers": response_start["headers"],
+                })
+
+                while chunk is not _END:
+                    if disconnected.is_set():
+                        return
+                    if chunk:
+                        await send({
+                            "type": "http.response.body",
+                            "body": chunk,
+                            "more_body": True,
+                        })
+                    chunk = await run(next, iterator, _END)
+
+                await send({"type": "http.response.body", "body": b""})
+            finally:
+                # 転送スロットの解放などはレスポンスのクローズで行われる
+                if hasattr(iterable, "close"):
+                    await run(iterable.close)
+        finally:
+            # アプリが読み込まなかった残りのボディは受信しない
+            watcher.cancel()
+            body.end()
+
+    async def _receive(self, receive, body, disconnected):
+        # ボディを受信し終えた後も切断を監視する
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                body.end()
+                disconnected.set()
+                return
+            if message["type"] == "http.request":
+                await body.feed(message.get("body", b""))
+                if not message.get("more_body", False):
+                    body.end()
+
+    def _environ(self, scope, body):
+        # WSGI の文字列は latin-1（PEP 3333）
+        root_path = scope.get("root_path", "")
+        path = scope["path"]
+        if root_path and path.startswith(root_path):
+            path = path[len(root_path):]
+
+        server = scope.get("server") or ("localhost", 80)
+        client = scope.get("client")
+
+        environ = {
+            "REQUEST_METHOD": scope["method"],
+            "SCRIPT_NAME": root_path.encode("utf-8").decode("latin-1"),
+            "PATH_INFO": path.encode("utf-8").decode("latin-1"),
+            "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+            "SERVER_NAME": server[0],
+            "SERVER_PORT": str(server[1]),
+            "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+            "REMOTE_ADDR": client[0] if client else "",
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": scope.get("scheme", "http"),
+            "wsgi.input": body,
+            "wsgi.errors": sys.stderr,
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": True,
+            "wsgi.run_once": False,
+            "wsgi.file_wrapper": _file_wrapper,
+        }
+
+        for name, value in scope.get("headers", []):
+            name = name.decode("latin-1").upper().replace("-", "_")
+            value = value.decode("latin-1")
+            if name == "CONTENT_TYPE" or name == "CONTENT_LENGTH":
+                key = name
+            else:
+                key = f"HTTP_{name}"
+            if key in environ:
+                separator = "; " if key == "HTTP_COOKIE" else ","
+                value = f"{environ[key]}{separator}{value}"
+            environ[key] = value
+
+        # Content-Length がない（chunked）場合は終端まで読ませる
+        # （ある場合は Werkzeug が Content-Length 分だけ読み、途中で切断されたら ClientDisconnected にする）
+        if "CONTENT_LENGTH" not in environ:
+            environ["wsgi.input_terminated"] = True
+
+        return environ
+
+# 同梱ライブラリ（static/vendor）が未取得の場合は起動しない
+assets.require_vendor_assets(app)
+
+# 起動例: uvicorn asgi:application --workers 2
+application = AsyncWsgiBridge(app)
@@ -0,0 +1,272 @@
+import os
+import gzip
+import base64
+import hashlib
+import mimetypes
+import threading
+import urllib.request
+
+import click
+from flask import current_app, request, send_file, redirect, url_for, abort
+from werkzeug.security import safe_join
+
+# ------------------------
+# 設定
+# ------------------------
+# 同梱するライブラリ（static 配下のパス → 取得元）
+# 開発時（flask run）は未取得の場合に取得元をそのまま参照する。
+# wsgi.py / asgi.py から起動する場合は未取得だと起動しない（ASSETS_CDN_FALLBACK=1 で取得元の参照を許可）
+VENDOR_ASSETS = {
+    "vendor/bootstrap/bootstrap.min.css": "https://cdn.jsdelivr.net/npm/bootstrap@5.3.3/dist/css/bootstrap.min.css",
+    "vendor/bootstrap/bootstrap.bundle.min.js": "https://cdn.jsdelivr.net/npm/bootstrap@5.3.3/dist/js/bootstrap.bundle.min.js",
+    "vendor/dropzone/dropzone.min.css": "https://unpkg.com/dropzone@5.9.3/dist/min/dropzone.min.css",
+    "vendor/dropzone/dropzone.min.js": "https://unpkg.com/dropzone@5.9.3/dist/min/dropzone.min.js",
+    "vendor/vue/vue.global.prod.js": "https://unpkg.com/vue@3.5.13/dist/vue.global.prod.js",
+}
+# 同梱ライブラリの内容のハッシュ（SRI 形式）。取得時（build-assets）と本番起動時に照合し、一致しないファイルは使わない
+# 未登録（None）のライブラリは保存せず、取得した内容のハッシュを表示する。
+# 登録・更新（バージョンを上げる場合）は取得元の公開値、または内容を確認したファイルのハッシュを使う
+VENDOR_INTEGRITY = {
+    "vendor/bootstrap/bootstrap.min.css": "sha384-QWTKZyjpPEjISv5WaRU9OFeRpok6YctnYmDr5pNlyT2bRjXh0JMhjY6hW+ALEwIH",
+    "vendor/bootstrap/bootstrap.bundle.min.js": "sha384-YvpcrYf0tY3lHB60NNkmXc5s9fDVZLESaAA55NDzOxhy9GkcIdslK1eN7N6jIeHz",
+    "vendor/dropzone/dropzone.min.css": None,
+    "vendor/dropzone/dropzone.min.js": None,
+    "vendor/vue/vue.global.prod.js": None,
+}
+# 事前圧縮する拡張子
+COMPRESSIBLE_EXTENSIONS = {".css", ".js", ".svg", ".json", ".txt", ".html"}
+# フィンガープリント付きURLのキャッシュ期間（1年）
+ASSET_MAX_AGE = 365 * 24 * 60 * 60
+# フィンガープリントの長さ（16進）
+FINGERPRINT_LENGTH = 12
+
+# static 配下のパス → (更新日時, サイズ, フィンガープリント)
+_fingerprints = {}
+_lock = threading.Lock()
+
+def _static_path(filename):
+    path = safe_join(current_app.static_folder, filename)
+    if path is None:
+        abort(404)
+    return path
+
+# ------------------------
+# フィンガープリント（内容のハッシュ）
+# ------------------------
+def fingerprint(filename):
+    """static 配下のファイルの内容ハッシュを返す（ファイルがなければ None）"""
+    path = _static_path(filename)
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+
+    cached = _fingerprints.get(filename)
+    if cached and cached[0] == stat.st_mtime and cached[1] == stat.st_size:
+        return cached[2]
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b""):
+            digest.update(chunk)
+    value = digest.hexdigest()[:FINGERPRINT_LENGTH]
+
+    with _lock:
+        _fingerprints[filename] = (stat.st_mtime, stat.st_size, value)
+    return value
+
+def _fingerprinted_name(filename, digest):
+    root, ext = os.path.splitext(filename)
+    return f"{root}.{digest}{ext}"
+
+def _split_fingerprint(name):
+    # "js/dropzone.0123456789ab.js" → ("js/dropzone.js", "0123456789ab")
+    root, ext = os.path.splitext(name)
+    root, _, digest = root.rpartition(".")
+    if not root or len(digest) != FINGERPRINT_LENGTH:
+        return None, None
+    return f"{root}{ext}", digest
+
+# ------------------------
+# URL生成（url_for 互換）
+# ------------------------
+def asset_url(endpoint, filename=None, **values):
+    """
+    url_for と同じ引数で呼び出せる。
+    endpoint が "static" の場合はフィンガープリント付きのURLを返す。
+    同梱ライブラリが未取得の場合は取得元（CDN）のURLを返す。
+    """
+    if endpoint != "static" or filename is None:
+        if filename is not None:
+            values["filename"] = filename
+        return url_for(endpoint, **values)
+
+    digest = fingerprint(filename)
+    if digest is None:
+        if filename in VENDOR_ASSETS and current_app.config["ASSETS_CDN_FALLBACK"]:
+            return VENDOR_ASSETS[filename]
+        return url_for("static", filename=filename, **values)
+
+    return url_for("assets", filename=_fingerprinted_name(filename, digest), **values)
+
+# ------------------------
+# 事前圧縮
+# ------------------------
+def _compressed_path(path):
+    gz_path = f"{path}.gz"
+    try:
+        if os.path.getmtime(gz_path) >= os.path.getmtime(path):
+            return gz_path
+    except FileNotFoundError:
+        pass
+
+    # build-assets を実行していない場合は初回アクセス時に作成する
+    try:
+        compress_file(path)
+    except OSError:
+        current_app.logger.warning("failed to precompress %s", path)
+        return None
+    return gz_path
+
+def compress_file(path):
+    tmp_path = f"{path}.gz.{os.getpid()}.tmp"
+    with open(path, "rb") as src, open(tmp_path, "wb") as raw:
+        with gzip.GzipFile(filename="", mode="wb", fileobj=raw, compresslevel=9, mtime=0) as dst:
+            for chunk in iter(lambda: src.read(64 * 1024), b""):
+                dst.write(chunk)
+    os.replace(tmp_path, f"{path}.gz")
+
+# ------------------------
+# 配信（/assets/<フィンガープリント付きパス>）
+# ------------------------
+def serve_asset(filename):
+    original, digest = _split_fingerprint(filename)
+    if original is None:
+        abort(404)
+
+    current = fingerprint(original)
+    if current is None:
+        abort(404)
+    if current != digest:
+        # 古いページから参照された場合は現在の内容へ
+        return redirect(asset_url("static", filename=original))
+
+    path = _static_path(original)
+    mimetype = mimetypes.guess_type(original)[0] or "application/octet-stream"
+
+    gz_path = None
+    if os.path.splitext(original)[1] in COMPRESSIBLE_EXTENSIONS and "gzip" in request.accept_encodings:
+        gz_path = _compressed_path(path)
+
+    if gz_path:
+        response = send_file(gz_path, mimetype=mimetype, conditional=False, etag=False)
+        response.content_encoding = "gzip"
+        response.set_etag(f"{digest}-gz")
+    else:
+        response = send_file(path, mimetype=mimetype, conditional=False, etag=False)
+        response.set_etag(digest)
+
+    # 内容が変わればURLも変わるため、無期限にキャッシュさせる
+    response.vary.add("Accept-Encoding")
+    response.cache_control.no_cache = None
+    response.cache_control.public = True
+    response.cache_control.max_age = ASSET_MAX_AGE
+    response.cache_control.immutable = True
+    response.make_conditional(request)
+    return response
+
+# ------------------------
+# 同梱ライブラリの取得・事前圧縮（flask build-assets）
+# ------------------------
+@click.command("build-assets")
+def build_assets_command():
+    """同梱ライブラリを取得・照合し、静的ファイルを事前圧縮する"""
+    static_folder = current_app.static_folder
+
+    errors = []
+    for filename, source in VENDOR_ASSETS.items():
+        path = os.path.join(static_folder, filename)
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                error = check_integrity(filename, f.read())
+            if error:
+                errors.append(error)
+            continue
+
+        click.echo(f"download {source}")
+        with urllib.request.urlopen(source, timeout=30) as response:
+            data = response.read()
+        # ハッシュが一致しないファイルは保存しない
+        error = check_integrity(filename, data)
+        if error:
+            errors.append(error)
+            continue
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+
+    for root, _, files in os.walk(static_folder):
+        for name in files:
+            if os.path.splitext(name)[1] in COMPRESSIBLE_EXTENSIONS:
+                compress_file(os.path.join(root, name))
+                click.echo(f"compress {os.path.relpath(os.path.join(root, name), static_folder)}")
+
+    if errors:
+        raise click.ClickException("\n".join(errors))
+
+# ------------------------
+# 同梱ライブラリの確認（本番起動時）
+# ------------------------
+def integrity(data, algorithm="sha384"):
+    """SRI 形式のハッシュ（例: sha384-<Base64>）"""
+    return f"{algorithm}-" + base64.b64encode(hashlib.new(algorithm, data).digest()).decode("ascii")
+
+def check_integrity(filename, data):
+    """VENDOR_INTEGRITY と照合する。戻り値: エラーメッセージ（一致する場合は None）"""
+    expected = VENDOR_INTEGRITY.get(filename)
+    if expected is None:
+        return f"{filename}: integrity is not pinned (review the file and pin {integrity(data)})"
+    actual = integrity(data, expected.split("-", 1)[0])
+    if actual != expected:
+        return f"{filename}: integrity mismatch (expected {expected}, got {actual})"
+    return None
+
+def vendor_asset_errors(app):
+    """未取得・ハッシュ不一致の同梱ライブラリ"""
+    errors = []
+    for filename in VENDOR_ASSETS:
+        try:
+            with open(os.path.join(app.static_folder, filename), "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            errors.append(f"{filename}: missing")
+            continue
+        error = check_integrity(filename, data)
+        if error:
+            errors.append(error)
+    return errors
+
+def require_vendor_assets(app):
+    """
+    同梱ライブラリが揃っていない（ハッシュが一致しない）場合は起動を中止する（CDN を黙って参照しない）。
+    ASSETS_CDN_FALLBACK=1 の場合のみ、未取得のライブラリは取得元を参照して起動する。
+    """
+    if os.environ.get("ASSETS_CDN_FALLBACK") == "1":
+        app.config["ASSETS_CDN_FALLBACK"] = True
+        return
+
+    errors = vendor_asset_errors(app)
+    if errors:
+        raise RuntimeError(
+            "static files are not ready (run 'flask --app app build-assets'): " + "; ".join(errors)
+        )
+    app.config["ASSETS_CDN_FALLBACK"] = False
+
+# ------------------------
+# Flask 連携
+# ------------------------
+def init_app(app):
+    app.config.setdefault("ASSETS_CDN_FALLBACK", True)
+    app.add_url_rule("/assets/<path:filename>", "assets", serve_asset)
+    app.add_template_global(asset_url)
+    app.cli.add_command(build_assets_command)
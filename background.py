@@ -0,0 +1,56 @@
+import os
+import threading
+
+# ------------------------
+# バックグラウンド処理スレッド
+# ------------------------
+class BackgroundWorker:
+    """
+    アプリケーションコンテキスト内で task を定期実行するデーモンスレッド。
+
+    - gunicorn の fork 後に各ワーカーで起動できるよう、start() は
+      プロセスごとに1回だけスレッドを起動する（初回リクエスト時に呼ぶ）
+    - wake() で待機を中断して即時実行させる
+    - task は処理件数を返す。1件以上処理した場合は待たずに続けて実行する
+    """
+
+    def __init__(self, name, task, interval):
+        self.name = name
+        self.task = task
+        self.interval = interval
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def start(self, app):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            thread = threading.Thread(
+                target=self._run,
+                args=(app,),
+                name=self.name,
+                daemon=True,
+            )
+            thread.start()
+
+    def wake(self):
+        self._event.set()
+
+    def _run(self, app):
+        while True:
+            processed = 0
+            try:
+                with app.app_context():
+                    processed = self.task()
+            except Exception:
+                app.logger.exception("background task %s failed", self.name)
+
+            if processed:
+                continue
+
+            self._event.wait(self.interval)
+            self._event.clear()
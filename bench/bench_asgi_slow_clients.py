@@ -0,0 +1,116 @@
+"""
+低速なクライアントが同時にダウンロードする場合の、スレッド数あたりの同時転送能力を測る。
+
+    python bench/bench_asgi_slow_clients.py
+    python bench/bench_asgi_slow_clients.py --clients 200 --threads 32 --size-kb 2048 --rate-kb 256
+
+同じスレッド数で次の2通りを比べる（クライアントの回線速度は送信ごとの待ち時間で模擬する）。
+  wsgi : 従来の WSGI サーバ（送信完了までリクエストのスレッドを占有する）
+  asgi : asgi.AsyncWsgiBridge（送信待ちはイベントループ側で行い、スレッドを占有しない）
+全クライアントの転送が終わるまでの時間と、1クライアントの転送時間（size / rate）に対する倍率を表示する。
+"""
+import os
+import sys
+import time
+import types
+import asyncio
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+
+# asgi.py は import 時に app.py（DB初期化など）を読み込むため、測定用のアプリに差し替える
+# （同梱ライブラリの確認も行わない）
+sys.modules.setdefault("app", types.SimpleNamespace(app=Flask(__name__)))
+os.environ["ASSETS_CDN_FALLBACK"] = "1"
+
+import asgi
+
+KB = 1024
+
+# ------------------------
+# 測定用 WSGI アプリ（size バイトを SEND_CHUNK_SIZE ずつ返す）
+# ------------------------
+def make_app(size):
+    chunk = b"x" * asgi.SEND_CHUNK_SIZE
+
+    def app(environ, start_response):
+        start_response("200 OK", [("Content-Type", "application/octet-stream"), ("Content-Length", str(size))])
+        remaining = size
+        while remaining > 0:
+            yield chunk[:remaining]
+            remaining -= len(chunk)
+
+    return app
+
+# ------------------------
+# 従来の WSGI サーバ（1リクエスト1スレッド）
+# ------------------------
+def run_wsgi(app, clients, threads, rate):
+    def handle(_):
+        for data in app({}, lambda status, headers: None):
+            # ソケットへの書き込みがクライアントの受信に合わせて待たされる
+            time.sleep(len(data) / rate)
+
+    with ThreadPoolExecutor(threads) as executor:
+        list(executor.map(handle, range(clients)))
+
+# ------------------------
+# AsyncWsgiBridge
+# ------------------------
+async def _asgi_client(bridge, rate):
+    done = asyncio.Event()
+    requested = False
+
+    async def receive():
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await done.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.body":
+            await asyncio.sleep(len(message.get("body", b"")) / rate)
+            if not message.get("more_body", False):
+                done.set()
+
+    scope = {"type": "http", "method": "GET", "path": "/", "query_string": b"", "headers": []}
+    await bridge(scope, receive, send)
+
+def run_asgi(app, clients, threads, rate):
+    bridge = asgi.AsyncWsgiBridge(app, threads=threads)
+
+    async def main():
+        await asyncio.gather(*[_asgi_client(bridge, rate) for _ in range(clients)])
+
+    try:
+        asyncio.run(main())
+    finally:
+        bridge.executor.shutdown()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=100, help="同時に接続するクライアント数")
+    parser.add_argument("--threads", type=int, default=asgi.ASGI_THREADS, help="スレッド数（WSGI・ASGI 共通）")
+    parser.add_argument("--size-kb", type=int, default=1024, help="1クライアントのダウンロードサイズ（KB）")
+    parser.add_argument("--rate-kb", type=int, default=512, help="クライアントの回線速度（KB/s）")
+    args = parser.parse_args()
+
+    app = make_app(args.size_kb * KB)
+    rate = args.rate_kb * KB
+    ideal = args.size_kb / args.rate_kb
+
+    print(f"clients={args.clients} threads={args.threads} 1クライアントの転送時間={ideal:.2f}s")
+    print(f"{'server':>6} {'total(s)':>9} {'x ideal':>8}")
+    for name, run in (("wsgi", run_wsgi), ("asgi", run_asgi)):
+        start = time.perf_counter()
+        run(app, args.clients, args.threads, rate)
+        elapsed = time.perf_counter() - start
+        print(f"{name:>6} {elapsed:>9.2f} {elapsed / ideal:>8.2f}", flush=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+暗号化保存（storage.save_encrypted）の並列数ごとのスループットを測る。
+
+    python bench/bench_encrypt.py                      # 100MB / 1GB / 5GB、並列数 1,2,4,…,CPU数
+    python bench/bench_encrypt.py --sizes 64 256 --workers 1 4
+
+結果は MB/s（平文）。保存先は一時ディレクトリで、測定後に削除する。
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import dataclasses
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cryptography.fernet import Fernet
+
+import storage
+import settings
+
+MB = 1024 * 1024
+
+# ------------------------
+# 入力データ（乱数ブロックを繰り返して返す。全体はメモリに持たない）
+# ------------------------
+class RandomSource:
+
+    def __init__(self, size, block=16 * MB):
+        self._remaining = size
+        self._block = os.urandom(block)
+        self._pos = 0
+
+    def read(self, size):
+        size = min(size, self._remaining)
+        if size <= 0:
+            return b""
+        if self._pos + size > len(self._block):
+            self._pos = 0
+        data = self._block[self._pos:self._pos + size]
+        self._pos += size
+        self._remaining -= size
+        return data
+
+def _use_workers(workers):
+    base = settings.get_settings()
+    patched = dataclasses.replace(base, upload=dataclasses.replace(base.upload, encrypt_workers=workers))
+    storage.get_settings = lambda: patched
+
+def run(size_mb, workers, fernet, directory):
+    _use_workers(workers)
+    path = os.path.join(directory, "bench.enc")
+    start = time.perf_counter()
+    storage.save_encrypted(fernet, RandomSource(size_mb * MB), path)
+    elapsed = time.perf_counter() - start
+    os.remove(path)
+    return size_mb / elapsed
+
+def main():
+    cpus = os.cpu_count() or 1
+    default_workers = sorted({1, *[n for n in (2, 4, 8, 16, 32) if n <= cpus], cpus})
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1024, 5120], help="ファイルサイズ（MB）")
+    parser.add_argument("--workers", type=int, nargs="+", default=default_workers, help="暗号化の並列数")
+    parser.add_argument("--dir", default=None, help="保存先（既定: 一時ディレクトリ）")
+    args = parser.parse_args()
+
+    fernet = Fernet(Fernet.generate_key())
+    print(f"cpu_count={cpus}")
+    print(f"{'size(MB)':>9} {'workers':>8} {'MB/s':>9} {'speedup':>8}")
+    with tempfile.TemporaryDirectory(dir=args.dir) as directory:
+        for size_mb in args.sizes:
+            baseline = None
+            for workers in args.workers:
+                rate = run(size_mb, workers, fernet, directory)
+                baseline = baseline or rate
+                print(f"{size_mb:>9} {workers:>8} {rate:>9.1f} {rate / baseline:>7.2f}x", flush=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+パスワードハッシュ方式（[security] password_hash_method）ごとのログイン処理能力を測る。
+
+    python bench/bench_password_hash.py
+    python bench/bench_password_hash.py --methods scrypt:32768:8:1 pbkdf2:sha256:600000 --threads 4
+
+1回の照合（check_password_hash）にかかる時間と、1コアあたり・--threads 並列での1秒あたりのログイン数を表示する。
+scrypt はメモリも使う（n=32768, r=8 で約32MB/回）ため、並列数を増やした場合の伸びも確認する。
+"""
+import os
+import sys
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+from settings import get_settings
+
+DEFAULT_METHODS = [
+    "scrypt:32768:8:1",
+    "scrypt:16384:8:1",
+    "pbkdf2:sha256:600000",
+    "pbkdf2:sha256:260000",
+]
+
+PASSWORD = "correct horse battery staple"
+
+def measure(hashed, n, threads):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as executor:
+        for ok in executor.map(lambda _: check_password_hash(hashed, PASSWORD), range(n)):
+            assert ok
+    return time.perf_counter() - start
+
+def main():
+    configured = get_settings().security.password_hash_method
+    methods = list(dict.fromkeys([configured, *DEFAULT_METHODS]))
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--methods", nargs="+", default=methods, help="ハッシュ方式（werkzeug の method 形式）")
+    parser.add_argument("--logins", type=int, default=20, help="方式ごとの照合回数")
+    parser.add_argument("--threads", type=int, default=os.cpu_count() or 1, help="並列数")
+    args = parser.parse_args()
+
+    print(f"configured={configured} cpu_count={os.cpu_count()}")
+    print(f"{'method':>24} {'ms/login':>9} {'logins/s/core':>14} {f'logins/s x{args.threads}':>14}")
+    for method in args.methods:
+        hashed = generate_password_hash(PASSWORD, method=method)
+        single = measure(hashed, args.logins, 1)
+        parallel = measure(hashed, args.logins * args.threads, args.threads)
+        print(
+            f"{method:>24} {single / args.logins * 1000:>9.1f} {args.logins / single:>14.1f}"
+            f" {args.logins * args.threads / parallel:>14.1f}",
+            flush=True,
+        )
+
+if __name__ == "__main__":
+    main()
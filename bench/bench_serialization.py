@@ -0,0 +1,113 @@
+"""
+操作ログ一覧の JSON 変換（views.schemas の msgspec）と、従来の dict + json.dumps を比べる。
+
+    python bench/bench_serialization.py
+    python bench/bench_serialization.py --rows 50000 --repeat 20
+
+sqlite3.Row の行（access_logs の一覧と同じ列）から JSON のバイト列を作るまでの時間（最小値）を表示する。
+"""
+import os
+import sys
+import json
+import time
+import sqlite3
+import argparse
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from views import schemas
+from views.filters import format_datetime
+
+COLUMNS = (
+    "id", "accessed_at", "user_id", "action", "download_request", "download_request_id",
+    "file", "file_id", "result", "http_status", "ip_address", "user_agent",
+)
+
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36"
+
+# ------------------------
+# 測定用の行（sqlite3.Row）
+# ------------------------
+def make_rows(n):
+    conn = sqlite3.connect(":memory:")
+    conn.row_factory = sqlite3.Row
+    conn.execute(f"CREATE TABLE logs ({', '.join(COLUMNS)})")
+    start = datetime(2024, 4, 1, 9, 0)
+    conn.executemany(
+        f"INSERT INTO logs VALUES ({', '.join('?' * len(COLUMNS))})",
+        (
+            (
+                i,
+                (start + timedelta(seconds=i * 37)).isoformat(),
+                f"user{i % 50:03d}",
+                "ファイルダウンロード" if i % 3 else "ファイルアップロード",
+                f"取引先{i % 20}様 御中",
+                i % 500,
+                f"見積書_{i:05d}.pdf",
+                f"{i:032x}",
+                "success" if i % 10 else "error",
+                200 if i % 10 else 403,
+                f"192.0.2.{i % 250}",
+                USER_AGENT,
+            )
+            for i in range(n)
+        ),
+    )
+    return conn.execute("SELECT * FROM logs ORDER BY id").fetchall()
+
+# ------------------------
+# 従来（dict に変換して json.dumps）
+# ------------------------
+def log_json(l):
+    return {
+        "id": l["id"],
+        "accessed_at": format_datetime(l["accessed_at"]),
+        "user_id": l["user_id"],
+        "action": l["action"],
+        "download_request": l["download_request"],
+        "download_request_id": l["download_request_id"],
+        "file": l["file"],
+        "file_id": l["file_id"],
+        "result": l["result"],
+        "http_status": l["http_status"],
+        "ip_address": l["ip_address"],
+        "user_agent": l["user_agent"],
+    }
+
+def encode_json(rows):
+    return json.dumps([log_json(r) for r in rows]).encode("utf-8")
+
+def encode_msgspec(rows):
+    return schemas._encoder.encode([schemas.log_item(r) for r in rows])
+
+def measure(func, rows, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        body = func(rows)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, len(body)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10000, help="ログの件数")
+    parser.add_argument("--repeat", type=int, default=10, help="測定回数（最小値を表示）")
+    args = parser.parse_args()
+
+    rows = make_rows(args.rows)
+
+    # 変換結果が同じであること（json.dumps は非ASCII文字をエスケープするため値で比べる）
+    assert json.loads(encode_json(rows)) == json.loads(encode_msgspec(rows))
+
+    print(f"rows={args.rows}")
+    print(f"{'encoder':>16} {'ms':>8} {'bytes':>10}")
+    baseline = None
+    for name, func in (("dict+json.dumps", encode_json), ("msgspec", encode_msgspec)):
+        elapsed, size = measure(func, rows, args.repeat)
+        baseline = baseline or elapsed
+        print(f"{name:>16} {elapsed * 1000:>8.1f} {size:>10}  ({baseline / elapsed:.2f}x)", flush=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+セッション保存先（SESSION_BACKEND）ごとの1リクエストあたりの処理時間を測る。
+
+    python bench/bench_sessions.py                         # sqlite / cookie / filesystem
+    python bench/bench_sessions.py --requests 5000 --existing 20000
+
+ログイン済みのクライアントで次のリクエストを繰り返し、1リクエストあたりの時間（3回測定した最小値）を表示する。
+  read  : セッションを読むだけ（画面表示・ダウンロードなど大半のリクエスト）
+  write : セッションを書き換える（ログイン・設定変更など）
+--existing で他のユーザのセッションを事前に作っておく（保存済みセッションが多い場合の影響）。
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+from datetime import timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask, session
+from flask_session import Session
+
+import db
+import db.connection
+from session_store import SqliteSessionInterface
+
+BACKENDS = ("sqlite", "cookie", "filesystem")
+
+# ------------------------
+# 測定用アプリ（app.py と同じセッション設定）
+# ------------------------
+def create_app(backend, directory):
+    app = Flask(__name__)
+    app.config.update(
+        SECRET_KEY="bench",
+        SESSION_TYPE="filesystem",
+        SESSION_FILE_DIR=os.path.join(directory, "flask_session"),
+        SESSION_PERMANENT=True,
+        PERMANENT_SESSION_LIFETIME=timedelta(days=7),
+        SESSION_COOKIE_HTTPONLY=True,
+        SESSION_COOKIE_SECURE=False,
+        SESSION_COOKIE_SAMESITE="Lax",
+    )
+    app.teardown_appcontext(db.close_db)
+
+    if backend == "sqlite":
+        app.session_interface = SqliteSessionInterface()
+    elif backend == "filesystem":
+        Session(app)
+
+    @app.route("/login")
+    def login():
+        session.permanent = True
+        session["user_id"] = "bench"
+        session["role"] = "admin"
+        return ""
+
+    @app.route("/read")
+    def read():
+        return session.get("user_id", "")
+
+    @app.route("/write")
+    def write():
+        session["counter"] = session.get("counter", 0) + 1
+        return ""
+
+    return app
+
+def measure(client, path, n, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(n):
+            client.get(path)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best / n * 1e6
+
+def run(backend, args, directory):
+    db.connection.DB_PATH = os.path.join(directory, f"{backend}.db")
+    db.init_db()
+    app = create_app(backend, directory)
+
+    # 他のユーザのセッション
+    for _ in range(args.existing):
+        app.test_client().get("/login")
+
+    client = app.test_client()
+    client.get("/login")
+    # ウォームアップ
+    measure(client, "/read", 100, repeat=1)
+
+    return {
+        "read": measure(client, "/read", args.requests),
+        "write": measure(client, "/write", args.requests),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=list(BACKENDS))
+    parser.add_argument("--requests", type=int, default=2000, help="測定するリクエスト数")
+    parser.add_argument("--existing", type=int, default=1000, help="事前に作成する他のセッション数")
+    args = parser.parse_args()
+
+    print(f"{'backend':>10} {'read(us)':>9} {'write(us)':>10}")
+    with tempfile.TemporaryDirectory() as directory:
+        for backend in args.backends:
+            result = run(backend, args, directory)
+            print(f"{backend:>10} {result['read']:>9.1f} {result['write']:>10.1f}", flush=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+import zlib
+
+from werkzeug.http import parse_accept_header, parse_options_header
+from werkzeug.wsgi import ClosingIterator
+
+from settings import get_settings
+
+# ------------------------
+# 設定
+# ------------------------
+# 圧縮対象の Content-Type
+COMPRESSIBLE_TYPES = {
+    "text/html",
+    "text/plain",
+    "text/css",
+    "text/csv",
+    "text/javascript",
+    "application/javascript",
+    "application/json",
+    "application/xml",
+    "image/svg+xml",
+}
+
+# ------------------------
+# レスポンス圧縮（WSGIミドルウェア）
+# ------------------------
+class CompressionMiddleware:
+    """
+    テキスト系のレスポンス（HTML・JSON・CSV など）を gzip で圧縮する。
+
+    次のレスポンスは圧縮しない
+    - 添付ファイル（Content-Disposition: attachment）… ファイルダウンロード・ZIP
+    - Content-Type が圧縮対象外、または圧縮済み（Content-Encoding あり）
+    - Content-Length が min_size 未満
+    本文は受け取った順に圧縮して返す（全体をメモリに溜めない）。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    def __call__(self, environ, start_response):
+        settings = get_settings().compression
+        if not settings.enabled or not self._accepts_gzip(environ) or environ["REQUEST_METHOD"] == "HEAD":
+            return self.app(environ, start_response)
+
+        state = {"compress": False}
+
+        def compressing_start_response(status, headers, exc_info=None):
+            state["compress"] = self._should_compress(status, headers, settings.min_size)
+            if state["compress"]:
+                headers = self._compressed_headers(headers)
+            elif self._is_compressible_type(headers):
+                headers = headers + [("Vary", "Accept-Encoding")]
+            return start_response(status, headers, exc_info)
+
+        app_iter = self.app(environ, compressing_start_response)
+        close = getattr(app_iter, "close", None)
+        return ClosingIterator(self._compress(app_iter, state, settings.level), close)
+
+    def _compress(self, app_iter, state, level):
+        compressor = None
+        for chunk in app_iter:
+            if not state["compress"]:
+                yield chunk
+                continue
+            if compressor is None:
+                # wbits=31: gzip 形式
+                compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+
+        if compressor is not None:
+            yield compressor.flush()
+        elif state["compress"]:
+            # 本文が空
+            yield zlib.compress(b"", level, wbits=31)
+
+    def _accepts_gzip(self, environ):
+        accept = parse_accept_header(environ.get("HTTP_ACCEPT_ENCODING", ""))
+        return accept.quality("gzip") > 0
+
+    def _is_compressible_type(self, headers):
+        for name, value in headers:
+            if name.lower() == "content-type":
+                return parse_options_header(value)[0] in COMPRESSIBLE_TYPES
+        return False
+
+    def _should_compress(self, status, headers, min_size):
+        if int(status.split(" ", 1)[0]) in (204, 206, 304):
+            return False
+        if not self._is_compressible_type(headers):
+            return False
+
+        for name, value in headers:
+            name = name.lower()
+            if name == "content-encoding":
+                return False
+            if name == "content-disposition" and parse_options_header(value)[0] == "attachment":
+                return False
+            if name == "content-length" and int(value) < min_size:
+                return False
+        return True
+
+    def _compressed_headers(self, headers):
+        result = []
+        for name, value in headers:
+            lower = name.lower()
+            if lower == "content-length":
+                continue
+            if lower == "etag" and not value.startswith("W/"):
+                # 圧縮後は同一バイト列ではないため弱いETagにする
+                value = f"W/{value}"
+            result.append((name, value))
+        result.append(("Content-Encoding", "gzip"))
+        result.append(("Vary", "Accept-Encoding"))
+        return result
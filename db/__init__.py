@@ -1,9 +1,19 @@
-from .connection import get_db, close_db, init_db
+from .connection import (
+    get_db,
+    get_report_db,
+    close_db,
+    init_db,
+    begin_request_transaction,
+    end_request_transaction,
+)
 from . import crud
 
 __all__ = [
     "get_db",
+    "get_report_db",
     "close_db",
     "init_db",
+    "begin_request_transaction",
+    "end_request_transaction",
     "crud",
 ]
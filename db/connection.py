@@ -1,7 +1,13 @@
+import os
+import time
 import sqlite3
+import tempfile
+import threading
+from urllib.parse import quote
 from flask import g
 from werkzeug.security import generate_password_hash
-from paths import DB_PATH
+from paths import DB_PATH, REPORT_DB_PATH
+from settings import get_settings
 
 def init_db():
 
@@ -180,12 +186,227 @@ def init_db():
             ALTER TABLE access_logs ADD COLUMN file_name TEXT;
         """)
 
+    def migration_3(conn):
+        # ------------------------
+        # セッション
+        # ------------------------
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                id TEXT PRIMARY KEY,          -- セッションID
+                data TEXT NOT NULL,           -- セッション内容（JSON）
+                expires_at TEXT NOT NULL      -- 有効期限
+            )
+        """)
+        conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_sessions_expires_at
+                ON sessions(expires_at)
+        """)
+
+    def migration_4(conn):
+        # ワンタイムパスワード：試行回数・検索用インデックス
+        conn.execute("""
+            ALTER TABLE otps ADD COLUMN attempts INTEGER DEFAULT 0;
+        """)
+        conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_otps_lookup
+                ON otps(token, email, verified, created_at)
+        """)
+
+    def migration_5(conn):
+        # ------------------------
+        # メール送信キュー
+        # ------------------------
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS mail_queue (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                to_address TEXT NOT NULL,
+                subject TEXT NOT NULL,
+                body TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',  -- pending / sending / sent / failed
+                attempts INTEGER DEFAULT 0,              -- 送信試行回数
+                next_attempt_at TEXT NOT NULL,           -- 次回送信可能日時（sending中は処理期限）
+                last_error TEXT,
+                created_at TEXT NOT NULL,
+                sent_at TEXT
+            )
+        """)
+        conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_mail_queue_status
+                ON mail_queue(status, next_attempt_at)
+        """)
+
+    def migration_6(conn):
+        # ------------------------
+        # 転送中スロット（ワーカー間の同時転送数制御）
+        # ------------------------
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS transfer_slots (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                pool TEXT NOT NULL,            -- download / zip
+                pid INTEGER NOT NULL,          -- ワーカープロセスID
+                bytes INTEGER NOT NULL,        -- 転送サイズ
+                acquired_at TEXT NOT NULL
+            )
+        """)
+        conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_transfer_slots_pool
+                ON transfer_slots(pool)
+        """)
+
+    def migration_7(conn):
+        # ------------------------
+        # 認証レート制限（トークンバケット・失敗回数）
+        # ------------------------
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS rate_limits (
+                key TEXT PRIMARY KEY,             -- ip:<IP> / login:<ログインID> / guest:<トークン>
+                tokens REAL NOT NULL,             -- 残りトークン数
+                updated_at REAL NOT NULL,         -- トークン更新時刻（UNIX時間）
+                failures INTEGER DEFAULT 0,       -- 認証失敗回数
+                failure_started_at REAL DEFAULT 0,-- 失敗回数の計測開始時刻
+                locked_until REAL DEFAULT 0       -- ロック解除時刻
+            )
+        """)
+
+    def migration_8(conn):
+        # ------------------------
+        # アップロード依頼単位の一覧取得（ページング）用インデックス
+        # ------------------------
+        conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_files_upload_request
+            ON files (upload_request_id, id)
+        """)
+        conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_download_requests_upload_request
+            ON download_requests (upload_request_id, id)
+        """)
+        conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_access_logs_upload_request
+            ON access_logs (upload_request_id, id)
+        """)
+
+    def migration_9(conn):
+        # ------------------------
+        # APIトークン（REST API v1）
+        # ------------------------
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS api_tokens (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                token_hash TEXT UNIQUE NOT NULL,  -- トークンのSHA-256（平文は保存しない）
+                user_id TEXT NOT NULL,            -- 実行ユーザー（users.login_id）
+                name TEXT,                        -- 用途
+                created_at TEXT NOT NULL,
+                last_used_at TEXT,
+                revoked INTEGER DEFAULT 0
+            )
+        """)
+        # ユーザー別のファイルボックス一覧（rowid 順）
+        conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_upload_requests_created_by
+            ON upload_requests (created_by)
+        """)
+
+    def migration_10(conn):
+        # ------------------------
+        # ファイル削除キュー（一括削除したファイル実体をバックグラウンドで削除する）
+        # ------------------------
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS file_deletions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                upload_request_id TEXT NOT NULL,  -- 保存フォルダ
+                file_id TEXT,                     -- NULL の場合はフォルダごと削除
+                created_at TEXT NOT NULL
+            )
+        """)
+
+    def migration_11(conn):
+        # ------------------------
+        # 一括ダウンロードZIPのキャッシュ
+        # ------------------------
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS zip_cache (
+                upload_request_id TEXT NOT NULL,
+                version TEXT NOT NULL,            -- ファイル構成のハッシュ
+                size INTEGER NOT NULL,            -- ZIPのサイズ（暗号化前）
+                stored_bytes INTEGER NOT NULL,    -- 保存サイズ（暗号化後）
+                created_at TEXT NOT NULL,
+                last_used_at TEXT NOT NULL,
+                PRIMARY KEY (upload_request_id, version)
+            )
+        """)
+        conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_zip_cache_last_used
+            ON zip_cache (last_used_at)
+        """)
+
+        # ------------------------
+        # ZIP作成待ち（ファイル構成が変わったアップロード依頼）
+        # ------------------------
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS zip_builds (
+                upload_request_id TEXT PRIMARY KEY,
+                requested_at TEXT NOT NULL
+            )
+        """)
+
+    def migration_12(conn):
+        # 保存時の圧縮方式（NULL=圧縮なし、zlib=圧縮してから暗号化）
+        conn.execute("""
+            ALTER TABLE files ADD COLUMN codec TEXT;
+        """)
+
+    def migration_13(conn):
+        # 送信済み・送信失敗（再送しない）メールの本文を消す（ワンタイムパスワードを残さない）
+        conn.execute("""
+            UPDATE mail_queue SET body = '' WHERE status IN ('sent', 'failed')
+        """)
+
+    def migration_14(conn):
+        # ZIP作成依頼の状態（pending=作成待ち、building=作成中）
+        # 作成中の依頼は削除せずに残し、同じZIPを複数ワーカーで作成しないようにする
+        conn.execute("""
+            ALTER TABLE zip_builds ADD COLUMN status TEXT NOT NULL DEFAULT 'pending'
+        """)
+        conn.execute("""
+            ALTER TABLE zip_builds ADD COLUMN claimed_at TEXT
+        """)
+
+    def migration_15(conn):
+        # ファイル削除キューの再試行（削除できないファイルが後続の削除を妨げないよう、失敗したものは後回しにする）
+        # next_attempt_at が NULL の場合はすぐに削除する
+        conn.execute("""
+            ALTER TABLE file_deletions ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0
+        """)
+        conn.execute("""
+            ALTER TABLE file_deletions ADD COLUMN next_attempt_at TEXT
+        """)
+
     migrations = {
         1: migration_1,
         2: migration_2,
+        3: migration_3,
+        4: migration_4,
+        5: migration_5,
+        6: migration_6,
+        7: migration_7,
+        8: migration_8,
+        9: migration_9,
+        10: migration_10,
+        11: migration_11,
+        12: migration_12,
+        13: migration_13,
+        14: migration_14,
+        15: migration_15,
     }
     migrate_database(migrations)
 
+    # WALモード（参照系の読み取りが書き込みをブロックしないようにする）
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        conn.execute("PRAGMA journal_mode = WAL")
+    finally:
+        conn.close()
+
 def migrate_database(migrations):
     """
     migrations: dict[int, callable]
@@ -227,14 +448,108 @@ def migrate_database(migrations):
 
 def get_db():
     if "db" not in g:
-        conn = sqlite3.connect(DB_PATH)
+        conn = sqlite3.connect(DB_PATH, timeout=get_settings().db.busy_timeout)
         conn.row_factory = sqlite3.Row
         conn.execute("PRAGMA foreign_keys = ON")
         g.db = conn
     return g.db
 
+# ------------------------
+# リクエスト単位トランザクション
+# ------------------------
+def begin_request_transaction():
+    """
+    リクエスト中の crud の書き込みをまとめて1回でコミットする。
+    コミット／ロールバックは end_request_transaction で行う。
+    """
+    g.db_request_transaction = True
+
+def end_request_transaction(success=True):
+    g.pop("db_request_transaction", None)
+
+    db = g.get("db")
+    if db is None:
+        return
+
+    if success:
+        db.commit()
+    else:
+        db.rollback()
+
+def commit(immediate=False):
+    """
+    crud 用コミット。
+    リクエスト単位トランザクション中はリクエスト終了までコミットを遅らせる。
+    immediate=True の場合はトランザクション中でも即時コミットする。
+    """
+    if g.get("db_request_transaction") and not immediate:
+        return
+    get_db().commit()
+
+# ------------------------
+# レポート用（読み取り専用）接続
+# ------------------------
+def get_report_db():
+    """
+    管理画面・ログ参照など重い参照クエリ用の読み取り専用接続。
+    設定 [db] report_snapshot_interval（秒）を指定した場合は、
+    バックアップAPIで定期的に作成したスナップショットを参照する
+    （参照結果は最大で設定秒数だけ遅れる。作成は report_snapshot の作成スレッドで行い、
+    まだ作成されていない場合は DB を直接参照する）。
+    """
+    if "report_db" not in g:
+        settings = get_settings().db
+        path = DB_PATH
+        if settings.report_snapshot_interval > 0 and os.path.exists(REPORT_DB_PATH):
+            path = REPORT_DB_PATH
+
+        conn = sqlite3.connect(f"file:{quote(path)}?mode=ro", uri=True)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA query_only = ON")
+        conn.execute(f"PRAGMA cache_size = -{int(settings.report_cache_size_kb)}")
+        g.report_db = conn
+    return g.report_db
+
+_report_snapshot_lock = threading.Lock()
+
+def refresh_report_snapshot(interval):
+    """
+    スナップショットが interval 秒より古ければ作り直す。
+    戻り値: 作り直したか
+    """
+    with _report_snapshot_lock:
+        try:
+            if time.time() - os.path.getmtime(REPORT_DB_PATH) < interval:
+                return False
+        except FileNotFoundError:
+            pass
+
+        # 一意な別名で作成してから置き換える（参照中の接続・他ワーカーの作成に影響させない）
+        fd, tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(REPORT_DB_PATH), prefix=f"{os.path.basename(REPORT_DB_PATH)}.", suffix=".tmp"
+        )
+        os.close(fd)
+        try:
+            src = sqlite3.connect(f"file:{quote(DB_PATH)}?mode=ro", uri=True)
+            dst = sqlite3.connect(tmp_path)
+            try:
+                src.backup(dst)
+                dst.execute("PRAGMA journal_mode = DELETE")
+            finally:
+                dst.close()
+                src.close()
+            os.replace(tmp_path, REPORT_DB_PATH)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        return True
+
 def close_db(e=None):
     db = g.pop("db", None)
     if db is not None:
         db.close()
 
+    report_db = g.pop("report_db", None)
+    if report_db is not None:
+        report_db.close()
+
@@ -1,8 +1,32 @@
 import sqlite3
 import uuid
+import hmac
+import hashlib
+import secrets
 from datetime import datetime, timedelta
+from functools import lru_cache
+from flask import current_app
+from settings import get_settings
 from werkzeug.security import generate_password_hash, check_password_hash
-from .connection import get_db
+from .connection import get_db, get_report_db, commit
+
+# ------------------------
+# パスワードハッシュ
+# ------------------------
+def hash_password(password):
+    return generate_password_hash(password, method=_password_hash_method())
+
+def password_needs_rehash(hashed_password):
+    # 保存済みハッシュのパラメータが現在の設定と異なるか
+    return hashed_password.split("$", 1)[0] != _password_hash_prefix(_password_hash_method())
+
+def _password_hash_method():
+    return get_settings().security.password_hash_method or "scrypt"
+
+@lru_cache(maxsize=8)
+def _password_hash_prefix(method):
+    # "scrypt" → "scrypt:32768:8:1" のように省略値を補完した形式を得る
+    return generate_password_hash("", method=method).split("$", 1)[0]
 
 # ------------------------
 # ユーザリスト取得
@@ -36,7 +60,7 @@ def save_login_user(login_id, name, mail, external='', admin_flag=None, disabled
 
     # パスワードが設定されていればハッシュ化
     if password:
-        password = generate_password_hash(password)
+        password = hash_password(password)
 
     if row is None:
         # 存在しなければINSERT
@@ -71,7 +95,7 @@ def save_login_user(login_id, name, mail, external='', admin_flag=None, disabled
         sql = f"UPDATE users SET {', '.join(fields)} WHERE login_id = ?"
         cur.execute(sql, params)
 
-    db.commit()
+    commit()
     return True
 
 # ------------------------
@@ -93,7 +117,18 @@ def confirm_password(login_id, password):
     hashed_password = row[0]
 
     # パスワード検証
-    return check_password_hash(hashed_password, password)
+    if not check_password_hash(hashed_password, password):
+        return False
+
+    # ハッシュ設定が変わっていれば現在の設定で保存し直す
+    if password_needs_rehash(hashed_password):
+        cur.execute(
+            "UPDATE users SET password = ? WHERE login_id = ?",
+            (hash_password(password), login_id)
+        )
+        commit()
+
+    return True
 
 # ------------------------
 # 管理者ユーザチェック
@@ -124,7 +159,7 @@ def delete_user(id):
     """, (
         id,
     ))
-    db.commit()
+    commit()
 
 # ------------------------
 # アップロード依頼生成
@@ -157,7 +192,7 @@ def create_upload_request(title, expires_at, max_files, max_total_size, user_id)
         user_id,
         created_at
     ))
-    db.commit()
+    commit()
 
     return upload_request_id
 
@@ -209,8 +244,9 @@ def get_upload_request_by_token(token):
 # ------------------------
 # アップロード依頼リスト取得
 # ------------------------
-def list_upload_requests(per_page=None, offset=0, user_id=None):
-    db = get_db()
+def list_upload_requests(per_page=None, offset=0, user_id=None, report=False):
+    # report=True：管理画面用（読み取り専用接続を使う）
+    db = get_report_db() if report else get_db()
     cur = db.cursor()
 
     where = []
@@ -271,12 +307,12 @@ def delete_upload_request(upload_id):
     """, (
         upload_id,
     ))
-    db.commit()
+    commit()
 
 # ------------------------
 # ファイル生成
 # ------------------------
-def create_file(upload_request_id, file_id, original_name, file_size):
+def create_file(upload_request_id, file_id, original_name, file_size, codec=None):
 
     uploaded_at = datetime.now().isoformat()
 
@@ -287,16 +323,20 @@ def create_file(upload_request_id, file_id, original_name, file_size):
             file_id,
             original_name,
             file_size,
-            uploaded_at
-        ) VALUES (?, ?, ?, ?, ?)
+            uploaded_at,
+            codec
+        ) VALUES (?, ?, ?, ?, ?, ?)
     """, (
         upload_request_id,
         file_id,
         original_name,
         file_size,
-        uploaded_at
+        uploaded_at,
+        codec
     ))
-    db.commit()
+    # ファイル構成が変わったので一括ダウンロードZIPを作り直す
+    request_zip_build(upload_request_id)
+    commit()
 
 # ------------------------
 # ファイル取得
@@ -329,17 +369,41 @@ def list_files(upload_id):
     ))
     return cur.fetchall()
 
+# ------------------------
+# ファイルリスト取得（ページング、cursor より後を古い順）
+# ------------------------
+def list_files_page(upload_id, cursor=None, limit=50):
+    db = get_db()
+    cur = db.execute("""
+        SELECT
+            *
+        FROM files
+        WHERE upload_request_id = ?
+          AND id > ?
+        ORDER BY id
+        LIMIT ?
+    """, (
+        upload_id,
+        cursor or 0,
+        limit,
+    ))
+    return cur.fetchall()
+
 # ------------------------
 # ファイル削除
 # ------------------------
 def delete_file(file_id):
     db = get_db()
-    db.execute("""
+    row = db.execute("""
         DELETE FROM files WHERE file_id = ?
+        RETURNING upload_request_id
     """, (
         file_id,
-    ))
-    db.commit()
+    )).fetchone()
+    # ファイル構成が変わったので一括ダウンロードZIPを作り直す
+    if row:
+        request_zip_build(row["upload_request_id"])
+    commit()
 
 # ------------------------
 # ダウンロード依頼生成
@@ -374,7 +438,7 @@ def create_download_request(upload_request_id, expire_days, max_downloads, auth_
     ))
 
     inserted_id = cur.lastrowid
-    db.commit()
+    commit()
 
     return inserted_id
 
@@ -408,7 +472,7 @@ def update_download_expires(download_token):
         WHERE id = ?
     """, (expires_at, row["id"]))
 
-    db.commit()
+    commit()
 
 # ------------------------
 # ダウンロード依頼情報取得
@@ -456,6 +520,29 @@ def list_download_requests(upload_id):
     ))
     return cur.fetchall()
 
+# ------------------------
+# ダウンロード依頼リスト取得（ページング、cursor より前を新しい順）
+# ------------------------
+def list_download_requests_page(upload_id, cursor=None, limit=50):
+    db = get_db()
+
+    sql = """
+        SELECT
+            *
+        FROM download_requests
+        WHERE upload_request_id = ?
+    """
+    params = [upload_id]
+
+    if cursor:
+        sql += " AND id < ?"
+        params.append(cursor)
+
+    sql += " ORDER BY id DESC LIMIT ?"
+    params.append(limit)
+
+    return db.execute(sql, params).fetchall()
+
 # ------------------------
 # ダウンロード依頼削除
 # ------------------------
@@ -466,7 +553,7 @@ def delete_download_request(download_id):
     """, (
         download_id,
     ))
-    db.commit()
+    commit()
 
 # ------------------------
 # ゲスト認証情報取得
@@ -508,13 +595,25 @@ def find_guest_auth(token):
 
     return cur.fetchone()
 
+# ------------------------
+# ワンタイムパスワード
+# ------------------------
+# 1つのワンタイムパスワードに対する入力試行回数の上限
+OTP_MAX_ATTEMPTS = 5
+
+def _otp_digest(token, email, otp_code):
+    # 有効期限が短く桁数も少ないため、低コストな鍵付きHMACで保存する
+    key = hmac.new(current_app.secret_key.encode("utf-8"), b"otp", hashlib.sha256).digest()
+    message = f"{token}\0{email}\0{otp_code}".encode("utf-8")
+    return hmac.new(key, message, hashlib.sha256).hexdigest()
+
 # ------------------------
 # ワンタイムパスワード挿入
 # ------------------------
 def create_otp(token, email, otp_code, expire_min = 10):
 
     # ワンタイムパスワードハッシュ化
-    otp_code = generate_password_hash(otp_code)
+    otp_code = _otp_digest(token, email, otp_code)
 
     # 現在時刻
     created_at = datetime.now()
@@ -541,7 +640,7 @@ def create_otp(token, email, otp_code, expire_min = 10):
         expires_at,
         created_at
     ))
-    db.commit()
+    commit()
 
     return db.execute("SELECT last_insert_rowid()").fetchone()[0]
 
@@ -552,7 +651,7 @@ def confirm_otp(token, email, otp_code):
 
     db = get_db()
     row = db.execute("""
-        SELECT id, otp_code, expires_at
+        SELECT id, otp_code, expires_at, attempts
         FROM otps
         WHERE token = ?
           AND email = ?
@@ -569,17 +668,25 @@ def confirm_otp(token, email, otp_code):
             "UPDATE otps SET verified = 1 WHERE id = ?",
             (row["id"],)
         )
-        db.commit()
+        commit()
         return False
 
-    if not check_password_hash(row["otp_code"], otp_code):
+    if not hmac.compare_digest(row["otp_code"], _otp_digest(token, email, otp_code)):
+        # 試行回数が上限に達したら無効化
+        db.execute("""
+            UPDATE otps
+            SET attempts = attempts + 1,
+                verified = CASE WHEN attempts + 1 >= ? THEN 1 ELSE verified END
+            WHERE id = ?
+        """, (OTP_MAX_ATTEMPTS, row["id"]))
+        commit()
         return False
 
     db.execute(
         "UPDATE otps SET verified = 1 WHERE id = ?",
         (row["id"],)
     )
-    db.commit()
+    commit()
 
     return True
 
@@ -601,31 +708,47 @@ def get_file_download_count(download_request_id, file_id):
     return row["download_count"] if row else 0
 
 # ------------------------
-# ダウンロード回数インクリメント
+# ダウンロード回数インクリメント（上限チェック付き）
 # ------------------------
-def increment_file_download_count(download_request_id, file_id):
+def increment_file_download_count(download_request_id, file_id, max_downloads):
+    """
+    上限未満の場合のみダウンロード回数を加算する。
+    チェックと加算を1文で行うため、同時リクエストでも上限を超えない。
 
+    戻り値: 加算後の回数（上限に達している場合は None）
+    """
     db = get_db()
-    db.execute(
+    row = db.execute(
         """
         INSERT INTO download_counts (
             download_request_id,
             file_id,
             download_count
         )
-        VALUES (?, ?, 1)
+        SELECT ?, ?, 1
+        WHERE ? > 0
         ON CONFLICT(download_request_id, file_id)
         DO UPDATE SET
             download_count = download_count + 1
+        WHERE download_count < ?
+        RETURNING download_count
         """,
-        (download_request_id, file_id)
-    )
-    db.commit()
+        (download_request_id, file_id, max_downloads, max_downloads)
+    ).fetchone()
+
+    # 回数は即時確定させる（ロックを保持したままファイルを復号しないため）
+    commit(immediate=True)
+
+    return row["download_count"] if row else None
 
 # ------------------------
 # アクセスログ保存
 # ------------------------
-def save_access_log(log: dict):
+def save_access_log(log: dict, immediate=False):
+    """
+    immediate=True の場合はリクエスト単位トランザクションに含めず即時コミットする。
+    （業務処理をロールバックした後でもログを残す場合に使用）
+    """
     try:
         db = get_db()
         db.execute(
@@ -657,7 +780,7 @@ def save_access_log(log: dict):
             ),
         )
 
-        db.commit()
+        commit(immediate=immediate)
     except Exception:
         # ログ失敗は業務処理に影響させない
         pass
@@ -666,7 +789,7 @@ def save_access_log(log: dict):
 # アクセスログ取得
 # ------------------------
 def list_access_logs(per_page=None, offset=0, upload_request_id=None):
-    db = get_db()
+    db = get_report_db()
     cur = db.cursor()
 
     sql = """
@@ -707,3 +830,919 @@ def list_access_logs(per_page=None, offset=0, upload_request_id=None):
 
     cur.execute(sql, params)
     return cur.fetchall()
+
+# ------------------------
+# アクセスログ取得（アップロード依頼単位のページング、cursor より前を新しい順）
+# ------------------------
+def list_access_logs_page(upload_request_id, cursor=None, limit=50):
+    db = get_report_db()
+
+    sql = """
+        SELECT
+            al.*,
+
+            (
+                SELECT dr.auth_type
+                FROM download_requests dr
+                WHERE dr.id = al.download_request_id
+            ) AS download_request,
+
+            (
+                SELECT f.original_name
+                FROM files f
+                WHERE f.file_id = al.file_id
+            ) AS file
+        FROM access_logs al
+        WHERE al.upload_request_id = ?
+    """
+    params = [upload_request_id]
+
+    if cursor:
+        sql += " AND al.id < ?"
+        params.append(cursor)
+
+    sql += " ORDER BY al.id DESC LIMIT ?"
+    params.append(limit)
+
+    return db.execute(sql, params).fetchall()
+
+# ------------------------
+# アクセスログ取得（アップロード依頼単位の差分、since_id より後を古い順）
+# ------------------------
+def list_access_logs_since(upload_request_id, since_id, limit=200):
+    # 追加分の検出に使うため、スナップショット（get_report_db）ではなく最新の状態を参照する
+    db = get_db()
+    cur = db.execute("""
+        SELECT
+            al.*,
+
+            (
+                SELECT dr.auth_type
+                FROM download_requests dr
+                WHERE dr.id = al.download_request_id
+            ) AS download_request,
+
+            (
+                SELECT f.original_name
+                FROM files f
+                WHERE f.file_id = al.file_id
+            ) AS file
+        FROM access_logs al
+        WHERE al.upload_request_id = ?
+          AND al.id > ?
+        ORDER BY al.id
+        LIMIT ?
+    """, (
+        upload_request_id,
+        since_id,
+        limit,
+    ))
+    return cur.fetchall()
+
+# ------------------------
+# アクセスログ件数取得
+# ------------------------
+def count_access_logs(upload_request_id=None):
+    db = get_report_db()
+
+    sql = "SELECT COUNT(*) FROM access_logs"
+    params = []
+
+    if upload_request_id:
+        sql += " WHERE upload_request_id = ?"
+        params.append(upload_request_id)
+
+    return db.execute(sql, params).fetchone()[0]
+
+# ------------------------
+# セッション取得
+# ------------------------
+def get_session(session_id):
+    db = get_db()
+    cur = db.execute("""
+        SELECT data, expires_at
+        FROM sessions
+        WHERE id = ?
+          AND expires_at > ?
+    """, (
+        session_id,
+        datetime.now().isoformat(),
+    ))
+    return cur.fetchone()
+
+# ------------------------
+# セッション保存
+# ------------------------
+def save_session(session_id, data, expires_at):
+    db = get_db()
+    db.execute("""
+        INSERT INTO sessions (id, data, expires_at)
+        VALUES (?, ?, ?)
+        ON CONFLICT(id) DO UPDATE SET
+            data = excluded.data,
+            expires_at = excluded.expires_at
+    """, (
+        session_id,
+        data,
+        expires_at.isoformat(),
+    ))
+    commit()
+
+# ------------------------
+# セッション削除
+# ------------------------
+def delete_session(session_id):
+    db = get_db()
+    db.execute("""
+        DELETE FROM sessions WHERE id = ?
+    """, (
+        session_id,
+    ))
+    commit()
+
+# ------------------------
+# 期限切れセッション削除
+# ------------------------
+def purge_expired_sessions(limit=500):
+    db = get_db()
+    cur = db.execute("""
+        DELETE FROM sessions
+        WHERE id IN (
+            SELECT id
+            FROM sessions
+            WHERE expires_at <= ?
+            LIMIT ?
+        )
+    """, (
+        datetime.now().isoformat(),
+        limit,
+    ))
+    commit()
+
+    return cur.rowcount
+
+# ------------------------
+# メール送信キュー登録
+# ------------------------
+def enqueue_mail(to_address, subject, body):
+    now = datetime.now().isoformat()
+
+    db = get_db()
+    cur = db.execute("""
+        INSERT INTO mail_queue (
+            to_address,
+            subject,
+            body,
+            next_attempt_at,
+            created_at
+        ) VALUES (?, ?, ?, ?, ?)
+    """, (
+        to_address,
+        subject,
+        body,
+        now,
+        now,
+    ))
+    commit()
+
+    return cur.lastrowid
+
+# ------------------------
+# 送信対象メール取得（取得したものは送信中にする）
+# ------------------------
+def claim_mails(limit=20, lease_min=10):
+    """
+    送信待ちのメールを取得して送信中にする。
+    複数ワーカーで同じメールを二重送信しないよう、取得と更新を1文で行う。
+    lease_min 分以内に結果が記録されなかった送信中メールは再取得対象にする。
+    """
+    now = datetime.now()
+
+    db = get_db()
+    rows = db.execute("""
+        UPDATE mail_queue
+        SET status = 'sending',
+            attempts = attempts + 1,
+            next_attempt_at = ?
+        WHERE id IN (
+            SELECT id
+            FROM mail_queue
+            WHERE status IN ('pending', 'sending')
+              AND next_attempt_at <= ?
+            ORDER BY id
+            LIMIT ?
+        )
+        RETURNING *
+    """, (
+        (now + timedelta(minutes=lease_min)).isoformat(),
+        now.isoformat(),
+        limit,
+    )).fetchall()
+    commit()
+
+    return sorted(rows, key=lambda r: r["id"])
+
+# ------------------------
+# メール送信完了（本文にはワンタイムパスワードなどが含まれるため消す）
+# ------------------------
+def mark_mail_sent(mail_id):
+    db = get_db()
+    db.execute("""
+        UPDATE mail_queue
+        SET status = 'sent',
+            sent_at = ?,
+            body = '',
+            last_error = NULL
+        WHERE id = ?
+    """, (
+        datetime.now().isoformat(),
+        mail_id,
+    ))
+    commit()
+
+# ------------------------
+# メール送信失敗（retry_at が None の場合は再送しない。その場合は本文を消す）
+# ------------------------
+def mark_mail_failed(mail_id, error, retry_at=None):
+    db = get_db()
+    db.execute("""
+        UPDATE mail_queue
+        SET status = ?,
+            next_attempt_at = COALESCE(?, next_attempt_at),
+            body = CASE WHEN ? IS NULL THEN '' ELSE body END,
+            last_error = ?
+        WHERE id = ?
+    """, (
+        "pending" if retry_at else "failed",
+        retry_at.isoformat() if retry_at else None,
+        retry_at.isoformat() if retry_at else None,
+        error,
+        mail_id,
+    ))
+    commit()
+
+# ------------------------
+# 転送スロット取得（上限チェック付き）
+# ------------------------
+def acquire_transfer_slot(pool, pid, size, max_count, max_bytes):
+    """
+    全ワーカー合計の転送件数・サイズが上限内の場合のみスロットを登録する。
+    他に転送がない場合はサイズ上限を超えていても登録する。
+
+    戻り値: スロットID（上限に達している場合は None）
+    """
+    db = get_db()
+    row = db.execute("""
+        INSERT INTO transfer_slots (pool, pid, bytes, acquired_at)
+        SELECT ?, ?, ?, ?
+        WHERE (
+            SELECT COUNT(*) = 0
+                OR (
+                    (? = 0 OR COUNT(*) < ?)
+                    AND (? = 0 OR SUM(bytes) + ? <= ?)
+                )
+            FROM transfer_slots
+            WHERE pool = ?
+        )
+        RETURNING id
+    """, (
+        pool, pid, size, datetime.now().isoformat(),
+        max_count, max_count,
+        max_bytes, size, max_bytes,
+        pool,
+    )).fetchone()
+
+    # 他ワーカーから見えるよう即時確定させる
+    commit(immediate=True)
+
+    return row["id"] if row else None
+
+# ------------------------
+# 転送スロットリスト取得（プロセスID）
+# ------------------------
+def list_transfer_slot_pids():
+    db = get_db()
+    cur = db.execute("SELECT DISTINCT pid FROM transfer_slots")
+    return [row["pid"] for row in cur.fetchall()]
+
+# ------------------------
+# 転送スロット削除（異常終了したワーカー・古いもの）
+# ------------------------
+def purge_transfer_slots(stale_before, pids=()):
+    db = get_db()
+    db.execute(
+        "DELETE FROM transfer_slots WHERE acquired_at < ?",
+        (stale_before.isoformat(),)
+    )
+    db.executemany(
+        "DELETE FROM transfer_slots WHERE pid = ?",
+        [(pid,) for pid in pids]
+    )
+    commit(immediate=True)
+
+# ------------------------
+# レート制限：トークン消費
+# ------------------------
+def consume_rate_limit(key, capacity, rate, now):
+    """
+    トークンバケットから1つ消費する（rate: 1秒あたりの補充数）。
+    ロック中またはトークン不足の場合は消費しない。
+
+    戻り値: 0（許可）／再試行まで待つべき秒数（拒否）
+    """
+    db = get_db()
+    row = db.execute("""
+        INSERT INTO rate_limits (key, tokens, updated_at)
+        VALUES (?, ? - 1, ?)
+        ON CONFLICT(key) DO UPDATE SET
+            tokens = MIN(?, tokens + (excluded.updated_at - updated_at) * ?) - 1,
+            updated_at = excluded.updated_at
+        WHERE locked_until <= excluded.updated_at
+          AND MIN(?, tokens + (excluded.updated_at - updated_at) * ?) >= 1
+        RETURNING tokens
+    """, (
+        key, capacity, now,
+        capacity, rate,
+        capacity, rate,
+    )).fetchone()
+
+    # 他ワーカーから見えるよう即時確定させる
+    commit(immediate=True)
+
+    if row is not None:
+        return 0
+
+    row = db.execute("""
+        SELECT tokens, updated_at, locked_until
+        FROM rate_limits
+        WHERE key = ?
+    """, (key,)).fetchone()
+    tokens = min(capacity, row["tokens"] + (now - row["updated_at"]) * rate)
+    wait_tokens = (1 - tokens) / rate if tokens < 1 else 0
+    return max(row["locked_until"] - now, wait_tokens, 1)
+
+# ------------------------
+# レート制限：認証失敗記録
+# ------------------------
+def record_rate_limit_failure(key, capacity, now, max_failures, window, lockout):
+    """
+    認証失敗回数を加算し、window 秒以内に max_failures 回に達したら lockout 秒ロックする。
+
+    戻り値: ロックした場合 True
+    """
+    window_start = now - window
+
+    db = get_db()
+    row = db.execute("""
+        INSERT INTO rate_limits (key, tokens, updated_at, failures, failure_started_at)
+        VALUES (?, ?, ?, 1, ?)
+        ON CONFLICT(key) DO UPDATE SET
+            failures = CASE
+                WHEN failure_started_at < ? THEN 1
+                ELSE failures + 1
+            END,
+            failure_started_at = CASE
+                WHEN failure_started_at < ? THEN excluded.failure_started_at
+                ELSE failure_started_at
+            END,
+            locked_until = CASE
+                WHEN failure_started_at >= ? AND failures + 1 >= ? THEN ?
+                ELSE locked_until
+            END
+        RETURNING locked_until
+    """, (
+        key, capacity, now, now,
+        window_start,
+        window_start,
+        window_start, max_failures, now + lockout,
+    )).fetchone()
+    commit(immediate=True)
+
+    return row["locked_until"] > now
+
+# ------------------------
+# レート制限：認証失敗回数リセット
+# ------------------------
+def reset_rate_limit_failures(key):
+    db = get_db()
+    db.execute("""
+        UPDATE rate_limits
+        SET failures = 0,
+            failure_started_at = 0
+        WHERE key = ?
+    """, (key,))
+    commit()
+
+# ------------------------
+# レート制限：不要データ削除
+# ------------------------
+def purge_rate_limits(before):
+    db = get_db()
+    db.execute("""
+        DELETE FROM rate_limits
+        WHERE updated_at < ?
+          AND locked_until < ?
+          AND failure_started_at < ?
+    """, (before, before, before))
+    commit()
+
+# ------------------------
+# APIトークン発行（戻り値: 平文トークン。保存するのはハッシュのみ）
+# ------------------------
+def _api_token_hash(token):
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+def create_api_token(user_id, name=None):
+    token = secrets.token_urlsafe(32)
+
+    db = get_db()
+    db.execute("""
+        INSERT INTO api_tokens (
+            token_hash,
+            user_id,
+            name,
+            created_at
+        ) VALUES (?, ?, ?, ?)
+    """, (
+        _api_token_hash(token),
+        user_id,
+        name,
+        datetime.now().isoformat(),
+    ))
+    commit()
+
+    return token
+
+# ------------------------
+# APIトークン認証（無効・失効・利用停止ユーザーは None）
+# ------------------------
+def get_api_token_user(token):
+    db = get_db()
+    row = db.execute("""
+        SELECT
+            t.id AS token_id,
+            u.login_id,
+            u.name,
+            u.admin_flag
+        FROM api_tokens t
+        JOIN users u ON u.login_id = t.user_id
+        WHERE t.token_hash = ?
+          AND t.revoked = 0
+          AND u.disabled_flag = 0
+    """, (
+        _api_token_hash(token),
+    )).fetchone()
+
+    if row is not None:
+        # 最終利用日時（書き込みを減らすため1分以上経過した場合のみ更新）
+        now = datetime.now()
+        db.execute("""
+            UPDATE api_tokens
+            SET last_used_at = ?
+            WHERE id = ?
+              AND (last_used_at IS NULL OR last_used_at < ?)
+        """, (
+            now.isoformat(),
+            row["token_id"],
+            (now - timedelta(minutes=1)).isoformat(),
+        ))
+        # リクエスト単位トランザクションに含めると、続くアップロードの受信中も書き込みロックを
+        # 保持し続けるため即時コミットする
+        commit(immediate=True)
+
+    return row
+
+# ------------------------
+# APIトークン一覧
+# ------------------------
+def list_api_tokens(user_id=None):
+    db = get_db()
+
+    sql = """
+        SELECT id, user_id, name, created_at, last_used_at, revoked
+        FROM api_tokens
+    """
+    params = []
+
+    if user_id:
+        sql += " WHERE user_id = ?"
+        params.append(user_id)
+
+    sql += " ORDER BY id"
+
+    return db.execute(sql, params).fetchall()
+
+# ------------------------
+# APIトークン失効
+# ------------------------
+def revoke_api_token(token_id):
+    db = get_db()
+    cur = db.execute("""
+        UPDATE api_tokens SET revoked = 1 WHERE id = ?
+    """, (
+        token_id,
+    ))
+    commit()
+    return cur.rowcount > 0
+
+# ------------------------
+# アップロード依頼リスト取得（ページング、cursor より前を新しい順）
+# ------------------------
+def list_upload_requests_page(user_id=None, cursor=None, limit=50):
+    """cursor は rowid（戻り値の seq 列）"""
+    db = get_db()
+
+    sql = """
+        SELECT
+            rowid AS seq,
+            *
+        FROM upload_requests
+        WHERE 1 = 1
+    """
+    params = []
+
+    if user_id:
+        sql += " AND created_by = ?"
+        params.append(user_id)
+
+    if cursor:
+        sql += " AND rowid < ?"
+        params.append(cursor)
+
+    sql += " ORDER BY rowid DESC LIMIT ?"
+    params.append(limit)
+
+    return db.execute(sql, params).fetchall()
+
+# ------------------------
+# ダウンロード依頼一括生成（宛先メールアドレスごとに1件）
+# ------------------------
+def create_download_requests(upload_request_id, expire_days, max_downloads, auth_type, auth_password, auth_emails):
+    created_at = datetime.now().isoformat()
+
+    db = get_db()
+    ids = []
+    for auth_email in auth_emails:
+        cur = db.execute("""
+            INSERT INTO download_requests (
+                download_token,
+                upload_request_id,
+                expire_days,
+                max_downloads,
+                auth_type,
+                auth_password,
+                auth_email,
+                created_at
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, (
+            str(uuid.uuid4()),
+            upload_request_id,
+            expire_days,
+            max_downloads,
+            auth_type,
+            auth_password,
+            auth_email,
+            created_at
+        ))
+        ids.append(cur.lastrowid)
+    commit()
+
+    return ids
+
+# ------------------------
+# ダウンロード依頼リスト取得（ID指定）
+# ------------------------
+def list_download_requests_by_ids(ids):
+    if not ids:
+        return []
+    placeholders = ",".join("?" * len(ids))
+    db = get_db()
+    return db.execute(f"""
+        SELECT *
+        FROM download_requests
+        WHERE id IN ({placeholders})
+        ORDER BY id DESC
+    """, list(ids)).fetchall()
+
+# ------------------------
+# 一括操作の対象となるアップロード依頼ID取得
+# ------------------------
+def filter_upload_request_ids(upload_ids, user_id=None):
+    """存在する（user_id 指定時は本人が作成した）アップロード依頼のIDのみ返す"""
+    if not upload_ids:
+        return []
+    placeholders = ",".join("?" * len(upload_ids))
+    sql = f"SELECT id FROM upload_requests WHERE id IN ({placeholders})"
+    params = list(upload_ids)
+
+    if user_id:
+        sql += " AND created_by = ?"
+        params.append(user_id)
+
+    db = get_db()
+    return [row["id"] for row in db.execute(sql, params)]
+
+# ------------------------
+# アップロード依頼一括削除（ファイル実体は削除キューに登録）
+# ------------------------
+def delete_upload_requests(upload_ids):
+    if not upload_ids:
+        return 0
+    placeholders = ",".join("?" * len(upload_ids))
+    now = datetime.now().isoformat()
+
+    db = get_db()
+    # フォルダ単位で削除する（file_id は NULL）
+    db.executemany("""
+        INSERT INTO file_deletions (
+            upload_request_id,
+            created_at
+        ) VALUES (?, ?)
+    """, [(upload_id, now) for upload_id in upload_ids])
+
+    # ファイル・ダウンロード依頼は ON DELETE CASCADE で削除される
+    cur = db.execute(f"""
+        DELETE FROM upload_requests WHERE id IN ({placeholders})
+    """, list(upload_ids))
+    commit()
+
+    return cur.rowcount
+
+# ------------------------
+# アップロード依頼一括期限切れ（有効期限を前日にする）
+# ------------------------
+def expire_upload_requests(upload_ids):
+    if not upload_ids:
+        return 0
+    placeholders = ",".join("?" * len(upload_ids))
+    yesterday = (datetime.now().date() - timedelta(days=1)).isoformat()
+
+    db = get_db()
+    cur = db.execute(f"""
+        UPDATE upload_requests
+        SET expires_at = ?
+        WHERE id IN ({placeholders})
+          AND (expires_at IS NULL OR date(expires_at) > date(?))
+    """, [yesterday, *upload_ids, yesterday])
+    commit()
+
+    return cur.rowcount
+
+# ------------------------
+# アップロード依頼一括期限延長
+# ------------------------
+def extend_upload_requests(upload_ids, days):
+    """
+    有効期限を days 日延長する。期限切れのものは本日から days 日後にする。
+    有効期限なし（NULL）のものは対象外。
+    """
+    if not upload_ids:
+        return 0
+    placeholders = ",".join("?" * len(upload_ids))
+    today = datetime.now().date().isoformat()
+
+    db = get_db()
+    cur = db.execute(f"""
+        UPDATE upload_requests
+        SET expires_at = date(max(date(expires_at), ?), ?)
+        WHERE id IN ({placeholders})
+          AND expires_at IS NOT NULL
+    """, [today, f"+{int(days)} days", *upload_ids])
+    commit()
+
+    return cur.rowcount
+
+# ------------------------
+# ファイル削除キュー取得
+# ------------------------
+def list_file_deletions(limit=100):
+    """削除できる時刻になったもの（未試行のものを先、失敗したものは再試行日時の順）"""
+    db = get_db()
+    return db.execute("""
+        SELECT *
+        FROM file_deletions
+        WHERE next_attempt_at IS NULL
+           OR next_attempt_at <= ?
+        ORDER BY next_attempt_at, id
+        LIMIT ?
+    """, (
+        datetime.now().isoformat(),
+        limit,
+    )).fetchall()
+
+# ------------------------
+# ファイル削除キュー再試行（削除に失敗したものを後回しにする）
+# ------------------------
+def defer_file_deletions(retries):
+    """retries: [(ID, 再試行日時), ...]"""
+    if not retries:
+        return
+    db = get_db()
+    db.executemany("""
+        UPDATE file_deletions
+        SET attempts = attempts + 1,
+            next_attempt_at = ?
+        WHERE id = ?
+    """, [(retry_at.isoformat(), deletion_id) for deletion_id, retry_at in retries])
+    commit()
+
+# ------------------------
+# ファイル削除キュー完了
+# ------------------------
+def delete_file_deletions(ids):
+    if not ids:
+        return
+    placeholders = ",".join("?" * len(ids))
+    db = get_db()
+    db.execute(f"""
+        DELETE FROM file_deletions WHERE id IN ({placeholders})
+    """, list(ids))
+    commit()
+
+# ------------------------
+# 一括ダウンロードZIP作成依頼
+# ------------------------
+def request_zip_build(upload_request_id, delay=True):
+    """
+    delay=True：ファイル構成の変更時。続けて変更された場合は最後の変更から待ち時間を数え直す
+    delay=False：キャッシュがない場合。待たずに作成する（依頼済み・作成中ならそのまま）
+    作成中（building）の依頼は作成し直さず、requested_at の更新のみ行う（作成後に再度作成待ちに戻る）
+    """
+    if not get_settings().zip.cache_enabled:
+        return
+
+    requested_at = datetime.now()
+    if not delay:
+        requested_at -= timedelta(seconds=get_settings().zip.cache_build_delay)
+
+    db = get_db()
+    db.execute(f"""
+        INSERT INTO zip_builds (
+            upload_request_id,
+            requested_at
+        ) VALUES (?, ?)
+        ON CONFLICT (upload_request_id) DO {"UPDATE SET requested_at = excluded.requested_at" if delay else "NOTHING"}
+    """, (
+        upload_request_id,
+        requested_at.isoformat(),
+    ))
+    commit()
+
+# ------------------------
+# 一括ダウンロードZIP作成依頼取得（作成中にする）
+# ------------------------
+def claim_zip_build(requested_before, stale_before):
+    """
+    作成待ちの依頼を1件取得して作成中にする。
+    複数ワーカーで同じZIPを作成しないよう、状態の確認と更新を1文で行う。
+    作成中のまま stale_before より前の依頼（作成中に停止したワーカーの分）も取得し直す。
+
+    戻り値: (アップロード依頼ID, 取得時の requested_at)。なければ None
+    """
+    db = get_db()
+    row = db.execute("""
+        UPDATE zip_builds
+        SET status = 'building',
+            claimed_at = ?
+        WHERE upload_request_id = (
+            SELECT upload_request_id
+            FROM zip_builds
+            WHERE (status = 'pending' AND requested_at <= ?)
+               OR (status = 'building' AND claimed_at <= ?)
+            ORDER BY requested_at
+            LIMIT 1
+        )
+          AND (status = 'pending' OR claimed_at <= ?)
+        RETURNING upload_request_id, requested_at
+    """, (
+        datetime.now().isoformat(),
+        requested_before.isoformat(),
+        stale_before.isoformat(),
+        stale_before.isoformat(),
+    )).fetchone()
+    commit()
+
+    return (row["upload_request_id"], row["requested_at"]) if row else None
+
+# ------------------------
+# 一括ダウンロードZIP作成依頼完了
+# ------------------------
+def finish_zip_build(upload_request_id, requested_at):
+    """作成中に再度依頼された（requested_at が変わった）場合は作成待ちに戻す"""
+    db = get_db()
+    db.execute("""
+        DELETE FROM zip_builds
+        WHERE upload_request_id = ?
+          AND requested_at = ?
+    """, (
+        upload_request_id,
+        requested_at,
+    ))
+    db.execute("""
+        UPDATE zip_builds
+        SET status = 'pending',
+            claimed_at = NULL
+        WHERE upload_request_id = ?
+    """, (
+        upload_request_id,
+    ))
+    commit()
+
+# ------------------------
+# 一括ダウンロードZIPキャッシュ取得
+# ------------------------
+def get_zip_cache(upload_request_id, version):
+    db = get_db()
+    return db.execute("""
+        SELECT *
+        FROM zip_cache
+        WHERE upload_request_id = ?
+          AND version = ?
+    """, (
+        upload_request_id,
+        version,
+    )).fetchone()
+
+# ------------------------
+# 一括ダウンロードZIPキャッシュ一覧（最終利用が古い順）
+# ------------------------
+def list_zip_cache(upload_request_id=None, orphaned=False):
+    """orphaned=True：アップロード依頼が削除済みのもののみ"""
+    sql = """
+        SELECT zc.*
+        FROM zip_cache zc
+        LEFT JOIN upload_requests ur
+            ON ur.id = zc.upload_request_id
+        WHERE 1 = 1
+    """
+    params = []
+
+    if upload_request_id:
+        sql += " AND zc.upload_request_id = ?"
+        params.append(upload_request_id)
+
+    if orphaned:
+        sql += " AND ur.id IS NULL"
+
+    sql += " ORDER BY zc.last_used_at"
+
+    db = get_db()
+    return db.execute(sql, params).fetchall()
+
+# ------------------------
+# 一括ダウンロードZIPキャッシュ登録
+# ------------------------
+def save_zip_cache(upload_request_id, version, size, stored_bytes):
+    now = datetime.now().isoformat()
+
+    db = get_db()
+    db.execute("""
+        INSERT OR REPLACE INTO zip_cache (
+            upload_request_id,
+            version,
+            size,
+            stored_bytes,
+            created_at,
+            last_used_at
+        ) VALUES (?, ?, ?, ?, ?, ?)
+    """, (
+        upload_request_id,
+        version,
+        size,
+        stored_bytes,
+        now,
+        now,
+    ))
+    commit()
+
+# ------------------------
+# 一括ダウンロードZIPキャッシュ最終利用日時更新
+# ------------------------
+def touch_zip_cache(upload_request_id, version):
+    db = get_db()
+    db.execute("""
+        UPDATE zip_cache
+        SET last_used_at = ?
+        WHERE upload_request_id = ?
+          AND version = ?
+    """, (
+        datetime.now().isoformat(),
+        upload_request_id,
+        version,
+    ))
+    commit()
+
+# ------------------------
+# 一括ダウンロードZIPキャッシュ削除
+# ------------------------
+def delete_zip_cache(upload_request_id, version):
+    db = get_db()
+    db.execute("""
+        DELETE FROM zip_cache
+        WHERE upload_request_id = ?
+          AND version = ?
+    """, (
+        upload_request_id,
+        version,
+    ))
+    commit()
@@ -0,0 +1,74 @@
+import os
+import shutil
+from datetime import datetime, timedelta
+
+from flask import current_app, g, request_finished
+
+import db
+from background import BackgroundWorker
+from paths import UPLOAD_DIR
+
+# ------------------------
+# 設定
+# ------------------------
+# キューの確認間隔（秒）
+CLEANUP_POLL_INTERVAL = 60
+# 1回に処理する件数
+CLEANUP_BATCH_SIZE = 100
+# 削除に失敗した場合の再試行間隔（秒、失敗するごとに倍にする）
+CLEANUP_RETRY_BASE = 60
+CLEANUP_RETRY_MAX = 24 * 60 * 60
+
+# ------------------------
+# 削除キュー処理（削除スレッドから呼ばれる）
+# ------------------------
+def process_file_deletions():
+    deletions = db.crud.list_file_deletions(CLEANUP_BATCH_SIZE)
+    if not deletions:
+        return 0
+
+    done = []
+    retries = []
+    for deletion in deletions:
+        upload_dir = os.path.join(UPLOAD_DIR, deletion["upload_request_id"])
+        try:
+            if deletion["file_id"]:
+                os.remove(os.path.join(upload_dir, deletion["file_id"]))
+            else:
+                shutil.rmtree(upload_dir)
+        except FileNotFoundError:
+            # 削除済み（他ワーカーが処理した場合など）
+            pass
+        except OSError as e:
+            # 削除できなかったものはキューに残し、間隔を空けて再試行する
+            # （先頭に残り続けて後続の削除を妨げないよう、再試行日時の順に後回しにする）
+            current_app.logger.warning("file deletion failed: %s", e)
+            delay = min(CLEANUP_RETRY_BASE * 2 ** deletion["attempts"], CLEANUP_RETRY_MAX)
+            retries.append((deletion["id"], datetime.now() + timedelta(seconds=delay)))
+            continue
+        done.append(deletion["id"])
+
+    db.crud.delete_file_deletions(done)
+    db.crud.defer_file_deletions(retries)
+    return len(done)
+
+_worker = BackgroundWorker("file-cleanup", process_file_deletions, CLEANUP_POLL_INTERVAL)
+
+# ------------------------
+# 削除依頼（キューへの登録は crud 側で行い、ここではリクエスト終了時に削除スレッドを起こす）
+# ------------------------
+def notify():
+    g.file_deletion_enqueued = True
+
+def _wake_if_enqueued(sender, response, **extra):
+    # コミット後（リクエスト終了時）に削除スレッドを起こす
+    if g.pop("file_deletion_enqueued", False):
+        _worker.wake()
+
+def init_app(app):
+
+    @app.before_request
+    def start_cleanup_worker():
+        _worker.start(app)
+
+    request_finished.connect(_wake_if_enqueued, app)
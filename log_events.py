@@ -0,0 +1,60 @@
+import time
+import threading
+
+import db
+from settings import get_settings
+
+# ------------------------
+# アクセスログ追加の通知（ロングポーリング用）
+# ------------------------
+# 同一プロセス内の書き込みは notify() で即時に待機を解除する。
+# 他ワーカーの書き込みは poll_interval 秒ごとのDB確認で検出する。
+_cond = threading.Condition()
+_version = 0
+# 待機中のリクエスト数（待機でワーカースレッドを使い切らないよう max_waiters までに抑える）
+_waiters = 0
+
+def notify():
+    global _version
+    with _cond:
+        _version += 1
+        _cond.notify_all()
+
+def wait_for_logs(upload_request_id, since_id, limit, timeout):
+    """
+    since_id より新しいログが追加されるまで最大 timeout 秒待つ。
+    待機中のリクエストが max_waiters 件に達している場合は待たずに返す。
+
+    戻り値: (追加されたログ（古い順、なければ空）, 待機したか（timeout が 0 の場合・上限の場合は False）)
+    """
+    global _waiters
+    settings = get_settings().log_poll
+
+    with _cond:
+        waiting = timeout > 0 and _waiters < settings.max_waiters
+        if waiting:
+            _waiters += 1
+    if not waiting:
+        return db.crud.list_access_logs_since(upload_request_id, since_id, limit), False
+
+    try:
+        return _wait(upload_request_id, since_id, limit, timeout, settings.poll_interval), True
+    finally:
+        with _cond:
+            _waiters -= 1
+
+def _wait(upload_request_id, since_id, limit, timeout, poll_interval):
+    deadline = time.monotonic() + timeout
+
+    while True:
+        with _cond:
+            version = _version
+
+        logs = db.crud.list_access_logs_since(upload_request_id, since_id, limit)
+        remaining = deadline - time.monotonic()
+        if logs or remaining <= 0:
+            return logs
+
+        with _cond:
+            if _version == version:
+                _cond.wait(min(poll_interval, remaining))
@@ -0,0 +1,149 @@
+import time
+import smtplib
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+from email.headerregistry import Address
+
+from flask import g, request_finished
+
+import db
+from background import BackgroundWorker
+from settings import get_settings
+
+# ------------------------
+# 設定
+# ------------------------
+# キューの確認間隔（秒）
+MAIL_POLL_INTERVAL = 5
+# 前回送信からこの秒数を超えたら NOOP で接続を確認する
+SMTP_NOOP_INTERVAL = 15
+# 前回送信からこの秒数を超えたら接続を閉じる
+SMTP_IDLE_TIMEOUT = 60
+
+# ------------------------
+# SMTP接続（送信スレッド専用、接続を使い回す）
+# ------------------------
+class SmtpConnection:
+
+    def __init__(self):
+        self._smtp = None
+        self._server = None
+        self._last_used = 0.0
+
+    def send(self, msg, host, port):
+        smtp = self._connect(host, port)
+        try:
+            smtp.send_message(msg)
+        except smtplib.SMTPServerDisconnected:
+            # サーバ側で切断されていた場合は1回だけ再接続
+            self.close()
+            smtp = self._connect(host, port)
+            smtp.send_message(msg)
+        self._last_used = time.monotonic()
+
+    def close_if_idle(self):
+        if self._smtp and time.monotonic() - self._last_used > SMTP_IDLE_TIMEOUT:
+            self.close()
+
+    def close(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+        self._smtp = None
+        self._server = None
+
+    def _connect(self, host, port):
+        # 接続先が変わった場合は接続し直す
+        if self._smtp and self._server != (host, port):
+            self.close()
+
+        # しばらく使っていない接続は生存確認
+        if self._smtp and time.monotonic() - self._last_used > SMTP_NOOP_INTERVAL:
+            try:
+                if self._smtp.noop()[0] != 250:
+                    self.close()
+            except (smtplib.SMTPException, OSError):
+                self.close()
+
+        if self._smtp is None:
+            self._smtp = smtplib.SMTP(host, port, timeout=30)
+            self._server = (host, port)
+            self._last_used = time.monotonic()
+
+        return self._smtp
+
+_smtp = SmtpConnection()
+
+# ------------------------
+# メッセージ作成
+# ------------------------
+def build_message(mail, config):
+    msg = EmailMessage()
+    msg["Subject"] = mail["subject"]
+    username, domain = config.from_address.split("@", 1)
+    msg["From"] = Address(
+        display_name="Secure Send",
+        username=username,
+        domain=domain,
+    )
+    msg["To"] = mail["to_address"]
+    msg.set_content(mail["body"])
+    return msg
+
+# ------------------------
+# キュー送信処理（送信スレッドから呼ばれる）
+# ------------------------
+def process_mail_queue():
+    config = get_settings().mail
+
+    mails = db.crud.claim_mails(config.batch_size)
+    if not mails:
+        _smtp.close_if_idle()
+        return 0
+
+    for mail in mails:
+        try:
+            _smtp.send(
+                build_message(mail, config),
+                config.smtp_host,
+                config.smtp_port,
+            )
+        except smtplib.SMTPRecipientsRefused as e:
+            # 宛先拒否は再送しない
+            db.crud.mark_mail_failed(mail["id"], str(e))
+        except Exception as e:
+            _smtp.close()
+            if mail["attempts"] >= config.max_attempts:
+                db.crud.mark_mail_failed(mail["id"], str(e))
+            else:
+                delay = min(config.retry_base * 2 ** (mail["attempts"] - 1), config.retry_max)
+                retry_at = datetime.now() + timedelta(seconds=delay)
+                db.crud.mark_mail_failed(mail["id"], str(e), retry_at)
+        else:
+            db.crud.mark_mail_sent(mail["id"])
+
+    return len(mails)
+
+_worker = BackgroundWorker("mail-sender", process_mail_queue, MAIL_POLL_INTERVAL)
+
+# ------------------------
+# メール送信（キューに登録するだけで、送信は送信スレッドで行う）
+# ------------------------
+def send_mail(to_address, subject, body):
+    db.crud.enqueue_mail(to_address, subject, body)
+    g.mail_enqueued = True
+
+def _wake_if_enqueued(sender, response, **extra):
+    # コミット後（リクエスト終了時）に送信スレッドを起こす
+    if g.pop("mail_enqueued", False):
+        _worker.wake()
+
+def init_app(app):
+
+    @app.before_request
+    def start_mail_worker():
+        _worker.start(app)
+
+    request_finished.connect(_wake_if_enqueued, app)
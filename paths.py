@@ -3,6 +3,8 @@ import os
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 CONFIG_PATH = os.path.join(BASE_DIR, "config", "app.ini")
 UPLOAD_DIR = os.path.join(BASE_DIR, "uploads")
+ZIP_CACHE_DIR = os.path.join(BASE_DIR, "zip_cache")
 DB_PATH = os.path.join(BASE_DIR, "app.db")
+REPORT_DB_PATH = os.path.join(BASE_DIR, "app_report.db")
 
 GS_WHOAMI_URL = "https://group.system-prostage.co.jp/gsession/api/user/whoami.do"
@@ -0,0 +1,89 @@
+import math
+import time
+
+from flask import g, request
+from werkzeug.exceptions import TooManyRequests
+
+import db
+from settings import get_settings
+
+# ------------------------
+# 設定
+# ------------------------
+# 不要になったレート制限データの削除間隔（秒）
+PURGE_INTERVAL = 300
+# 最終更新からこの秒数を過ぎたデータは削除する
+PURGE_AGE = 24 * 60 * 60
+
+_last_purged = 0.0
+
+def _ip_key():
+    # リバースプロキシ配下では ProxyFix が X-Forwarded-For の接続元IPアドレスに置き換えている
+    return f"ip:{request.remote_addr}"
+
+def _purge_if_due(now):
+    global _last_purged
+    if now - _last_purged < PURGE_INTERVAL:
+        return
+    _last_purged = now
+    db.crud.purge_rate_limits(now - PURGE_AGE)
+
+# ------------------------
+# 認証試行の受付（IP・アカウントのどちらかが上限なら 429）
+# ------------------------
+def check(account_key, label):
+    """
+    account_key: "login:<ログインID>" / "guest:<トークン>"
+    label: 制限時にアクセスログへ記録する操作名
+
+    ロック中またはトークン不足の場合は TooManyRequests を送出する。
+    """
+    settings = get_settings().rate_limit
+    if not settings.enabled:
+        return
+
+    now = time.time()
+    _purge_if_due(now)
+
+    limits = [
+        (_ip_key(), settings.ip_burst, settings.ip_per_minute),
+        (account_key, settings.account_burst, settings.account_per_minute),
+    ]
+    for key, burst, per_minute in limits:
+        wait = db.crud.consume_rate_limit(key, max(burst, 1), per_minute / 60, now)
+        if wait:
+            # アクセスログ
+            if hasattr(g, "access_log"):
+                g.access_log.update({
+                    "action": f"{label} 制限超過",
+                })
+            raise TooManyRequests(
+                "試行回数が上限を超えました。しばらくしてから再度お試しください",
+                retry_after=math.ceil(wait),
+            )
+
+# ------------------------
+# 認証失敗（アカウント単位で回数を数え、上限でロック）
+# ------------------------
+def failed(account_key):
+    """戻り値: この失敗でロックした場合 True"""
+    settings = get_settings().rate_limit
+    if not settings.enabled:
+        return False
+
+    return db.crud.record_rate_limit_failure(
+        account_key,
+        max(settings.account_burst, 1),
+        time.time(),
+        settings.max_failures,
+        settings.failure_window,
+        settings.lockout,
+    )
+
+# ------------------------
+# 認証成功（失敗回数をリセット）
+# ------------------------
+def succeeded(account_key):
+    if not get_settings().rate_limit.enabled:
+        return
+    db.crud.reset_rate_limit_failures(account_key)
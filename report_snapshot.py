@@ -0,0 +1,30 @@
+from flask import current_app
+
+import db.connection
+from background import BackgroundWorker
+from settings import get_settings
+
+# ------------------------
+# 設定
+# ------------------------
+# スナップショットの更新確認間隔（秒）
+REPORT_SNAPSHOT_POLL_INTERVAL = 10
+
+# ------------------------
+# レポート用スナップショット更新（作成スレッドから呼ばれる）
+# ------------------------
+# リクエスト中にバックアップを行うと、古いと判定したリクエストの応答が作成を待つため別スレッドで作成する
+def refresh_report_snapshot():
+    interval = get_settings().db.report_snapshot_interval
+    if interval > 0 and db.connection.refresh_report_snapshot(interval):
+        current_app.logger.debug("report snapshot refreshed")
+    # 作成した場合も続けて実行する必要はない
+    return 0
+
+_worker = BackgroundWorker("report-snapshot", refresh_report_snapshot, REPORT_SNAPSHOT_POLL_INTERVAL)
+
+def init_app(app):
+
+    @app.before_request
+    def start_report_snapshot_worker():
+        _worker.start(app)
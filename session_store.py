@@ -0,0 +1,115 @@
+import time
+import secrets
+from datetime import datetime
+
+from flask.sessions import SessionInterface, SecureCookieSession
+from flask.json.tag import TaggedJSONSerializer
+
+import db
+
+# ------------------------
+# SQLiteセッション
+# ------------------------
+class SqliteSession(SecureCookieSession):
+
+    def __init__(self, initial=None, sid=None, expires_at=None):
+        super().__init__(initial)
+        self.sid = sid
+        self.expires_at = expires_at
+
+# ------------------------
+# SQLiteセッションインターフェース
+# ------------------------
+class SqliteSessionInterface(SessionInterface):
+    """
+    セッション内容を sessions テーブルに保存する。
+    Cookie にはランダムなセッションIDのみを持たせる。
+
+    - 内容に変更がないリクエストでは書き込みを行わない
+      （有効期限の残りが半分を切った場合のみ延長のため書き込む）
+    - 期限切れセッションは gc_interval 秒ごとに gc_batch 件ずつ削除する
+    """
+
+    session_class = SqliteSession
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, gc_interval=300, gc_batch=500):
+        self.gc_interval = gc_interval
+        self.gc_batch = gc_batch
+        self._last_gc = 0.0
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            row = db.crud.get_session(sid)
+            if row is not None:
+                try:
+                    data = self.serializer.loads(row["data"])
+                except ValueError:
+                    data = None
+                if data is not None:
+                    return self.session_class(
+                        data,
+                        sid=sid,
+                        expires_at=datetime.fromisoformat(row["expires_at"]),
+                    )
+
+        return self.session_class(sid=secrets.token_urlsafe(32))
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        secure = self.get_cookie_secure(app)
+        samesite = self.get_cookie_samesite(app)
+        httponly = self.get_cookie_httponly(app)
+
+        if session.accessed:
+            response.vary.add("Cookie")
+
+        # 空になったセッションは削除
+        if not session:
+            if session.modified:
+                if session.expires_at is not None:
+                    db.crud.delete_session(session.sid)
+                response.delete_cookie(
+                    name,
+                    domain=domain,
+                    path=path,
+                    secure=secure,
+                    samesite=samesite,
+                    httponly=httponly,
+                )
+            return
+
+        lifetime = app.permanent_session_lifetime
+        now = datetime.now()
+        needs_refresh = (
+            session.expires_at is None
+            or session.expires_at - now < lifetime / 2
+        )
+        if not session.modified and not needs_refresh:
+            return
+
+        expires_at = now + lifetime
+        db.crud.save_session(session.sid, self.serializer.dumps(dict(session)), expires_at)
+        self._purge_expired()
+
+        response.set_cookie(
+            name,
+            session.sid,
+            expires=self.get_expiration_time(app, session),
+            httponly=httponly,
+            domain=domain,
+            path=path,
+            secure=secure,
+            samesite=samesite,
+        )
+
+    def _purge_expired(self):
+        # 期限切れセッションの一括削除（プロセスごとに一定間隔で実施）
+        now = time.monotonic()
+        if now - self._last_gc < self.gc_interval:
+            return
+        self._last_gc = now
+        db.crud.purge_expired_sessions(self.gc_batch)
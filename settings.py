@@ -0,0 +1,214 @@
+import os
+import time
+import signal
+import logging
+import threading
+import configparser
+from dataclasses import dataclass, field, fields
+
+from paths import CONFIG_PATH
+
+logger = logging.getLogger(__name__)
+
+# ------------------------
+# 設定項目（config/app.ini のセクションごと）
+# ------------------------
+@dataclass(frozen=True)
+class UploadSettings:
+    max_file_size_mb: int = 10          # 1ファイルの最大サイズ（MB）
+    parallel_uploads: int = 10          # 同時アップロード数（upload_multiple の場合は1リクエストのファイル数）
+    upload_multiple: bool = True        # 複数ファイルを1リクエストでまとめて送る
+    encrypt_workers: int = 0            # 暗号化の並列数（ワーカープロセスごと、0=CPU数、1=並列化しない）
+    compress: bool = False              # 圧縮できるファイル（CSV・ログなど）は圧縮してから暗号化して保存
+
+@dataclass(frozen=True)
+class ZipSettings:
+    compress_level: int = 6             # 一括ダウンロードZIPの圧縮レベル（0-9）
+    cache_enabled: bool = False         # 作成済みZIPのキャッシュ（ファイル構成ごとに事前作成）
+    cache_max_mb: int = 4096            # キャッシュの合計サイズ上限（MB、超えたら最終利用が古いものから削除）
+    cache_build_delay: int = 30         # ファイル構成の変更からZIP作成までの待ち時間（秒）
+
+@dataclass(frozen=True)
+class CompressionSettings:
+    enabled: bool = True                # HTML・JSON・CSV などのレスポンス圧縮
+    min_size: int = 1024                # これより小さいレスポンスは圧縮しない（バイト）
+    level: int = 6                      # 圧縮レベル（1-9）
+
+@dataclass(frozen=True)
+class TransferSettings:
+    # ワーカープロセスごとの上限（件数・合計MB）
+    download_max_count: int = 4         # ファイルダウンロード
+    download_max_mb: int = 1024
+    zip_max_count: int = 1              # 一括ダウンロード（ZIP）
+    zip_max_mb: int = 2048
+    # 全ワーカー合計の上限（0=制限なし）
+    global_download_max_count: int = 0
+    global_download_max_mb: int = 0
+    global_zip_max_count: int = 0
+    global_zip_max_mb: int = 0
+    queue_timeout: float = 3.0          # 空き待ち時間（秒）
+    retry_after: int = 10               # 上限時に返す Retry-After（秒）
+
+@dataclass(frozen=True)
+class DbSettings:
+    busy_timeout: float = 5.0           # ロック待ち時間（秒）
+    report_snapshot_interval: int = 0   # レポート用スナップショット更新間隔（秒、0=使わない）
+    report_cache_size_kb: int = 65536   # レポート用接続のキャッシュサイズ（KB）
+
+@dataclass(frozen=True)
+class MailSettings:
+    from_address: str = ""              # 送信元メールアドレス
+    smtp_host: str = "mail.system-prostage.co.jp"
+    smtp_port: int = 25
+    batch_size: int = 20                # 1回に送信する件数
+    max_attempts: int = 8               # 送信試行回数の上限
+    retry_base: int = 30                # 再送間隔の初期値（秒）
+    retry_max: int = 3600               # 再送間隔の上限（秒）
+
+@dataclass(frozen=True)
+class LogPollSettings:
+    max_wait: int = 25                  # ログ更新待ち（ロングポーリング）の最大待ち時間（秒）
+    poll_interval: float = 1.0          # 待機中に他ワーカーの書き込みを確認する間隔（秒）
+    max_waiters: int = 4                # 同時に待機するリクエスト数の上限（ワーカープロセスごと）
+    retry_after: int = 10               # 待機しなかった場合（上限・sync ワーカー）に、次の取得まで空けてもらう間隔（秒）
+
+@dataclass(frozen=True)
+class RateLimitSettings:
+    enabled: bool = True
+    # IPアドレス単位（1分あたりの回数・連続で許可する回数）
+    ip_per_minute: float = 30
+    ip_burst: int = 30
+    # ログインID・ゲストトークン単位
+    account_per_minute: float = 10
+    account_burst: int = 10
+    # 認証失敗がこの回数に達したらロック
+    max_failures: int = 5
+    failure_window: int = 600           # 失敗回数を数える期間（秒）
+    lockout: int = 900                  # ロック時間（秒）
+
+@dataclass(frozen=True)
+class SecuritySettings:
+    # 例: scrypt:32768:8:1、pbkdf2:sha256:600000（変更後は次回ログイン時に再ハッシュ）
+    password_hash_method: str = "scrypt:32768:8:1"
+    # 前段のリバースプロキシの段数（X-Forwarded-For から接続元IPアドレスを取得する。0=使わない、起動時のみ反映）
+    trusted_proxies: int = 1
+
+@dataclass(frozen=True)
+class AppSettings:
+    upload: UploadSettings = field(default_factory=UploadSettings)
+    zip: ZipSettings = field(default_factory=ZipSettings)
+    compression: CompressionSettings = field(default_factory=CompressionSettings)
+    transfer: TransferSettings = field(default_factory=TransferSettings)
+    db: DbSettings = field(default_factory=DbSettings)
+    mail: MailSettings = field(default_factory=MailSettings)
+    log_poll: LogPollSettings = field(default_factory=LogPollSettings)
+    rate_limit: RateLimitSettings = field(default_factory=RateLimitSettings)
+    security: SecuritySettings = field(default_factory=SecuritySettings)
+
+# 設定ファイルの更新確認間隔（秒）
+CHECK_INTERVAL = 1.0
+
+_settings = None
+_settings_mtime = None
+_last_checked = 0.0
+_reload_requested = False
+_lock = threading.Lock()
+
+# ------------------------
+# 設定読込
+# ------------------------
+def load_settings(path=CONFIG_PATH):
+    config = configparser.ConfigParser()
+    config.read(path, encoding="utf-8")
+
+    sections = {}
+    for section in fields(AppSettings):
+        cls = section.default_factory
+        values = {}
+        for f in fields(cls):
+            if not config.has_option(section.name, f.name):
+                continue
+            if f.type is bool:
+                values[f.name] = config.getboolean(section.name, f.name)
+            else:
+                values[f.name] = f.type(config.get(section.name, f.name))
+        sections[section.name] = cls(**values)
+
+    return AppSettings(**sections)
+
+def _config_mtime():
+    try:
+        return os.path.getmtime(CONFIG_PATH)
+    except FileNotFoundError:
+        return None
+
+# ------------------------
+# 設定取得
+# ------------------------
+def get_settings():
+    """
+    キャッシュ済みの設定を返す。
+    CHECK_INTERVAL 秒ごとに設定ファイルの更新日時を確認し、
+    更新されていれば（または SIGHUP 受信後は）読み込み直して丸ごと差し替える。
+    """
+    global _last_checked
+
+    now = time.monotonic()
+    if _settings is not None and not _reload_requested and now - _last_checked < CHECK_INTERVAL:
+        return _settings
+
+    _last_checked = now
+    if _settings is None or _reload_requested or _config_mtime() != _settings_mtime:
+        reload_settings()
+    return _settings
+
+def reload_settings():
+    global _settings, _settings_mtime, _reload_requested
+
+    with _lock:
+        _reload_requested = False
+        mtime = _config_mtime()
+        try:
+            settings = load_settings()
+        except (ValueError, configparser.Error):
+            # 読込に失敗した場合は以前の設定を使い続ける
+            if _settings is None:
+                raise
+            logger.exception("failed to reload %s", CONFIG_PATH)
+            settings = _settings
+        _settings = settings
+        _settings_mtime = mtime
+
+    return _settings
+
+# ------------------------
+# 設定保存（一時ファイルに書いてから置き換える）
+# ------------------------
+def save_settings(section, values):
+    with _lock:
+        config = configparser.ConfigParser()
+        config.read(CONFIG_PATH, encoding="utf-8")
+
+        if not config.has_section(section):
+            config.add_section(section)
+        for key, value in values.items():
+            config.set(section, key, str(value))
+
+        tmp_path = f"{CONFIG_PATH}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            config.write(f)
+        os.replace(tmp_path, CONFIG_PATH)
+
+    return reload_settings()
+
+# ------------------------
+# SIGHUP で再読込
+# ------------------------
+def _on_sighup(signum, frame):
+    global _reload_requested
+    _reload_requested = True
+
+def install_reload_signal():
+    # シグナルはメインスレッドでのみ登録できる（Windows には SIGHUP がない）
+    if hasattr(signal, "SIGHUP") and threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGHUP, _on_sighup)
@@ -0,0 +1,65 @@
+
+// ファイルボックス一覧の一括操作（削除・期限切れ・期限延長）
+(() => {
+  const toolbar = document.getElementById('bulkActions');
+  if (!toolbar) return;
+
+  const selectAll = document.getElementById('boxSelectAll');
+  const countEl = document.getElementById('bulkCount');
+  const daysEl = document.getElementById('bulkExtendDays');
+  const buttons = toolbar.querySelectorAll('[data-bulk-url]');
+  const checkboxes = () => [...document.querySelectorAll('.box-select')];
+  const selectedIds = () => checkboxes().filter(c => c.checked).map(c => c.value);
+
+  const refresh = () => {
+    const count = selectedIds().length;
+    countEl.textContent = count;
+    buttons.forEach(b => { b.disabled = count === 0; });
+    if (selectAll) {
+      selectAll.checked = count > 0 && count === checkboxes().length;
+    }
+  };
+
+  // チェックボックスのクリックで詳細画面に遷移しないようにする
+  document.querySelectorAll('.box-select-cell').forEach(cell => {
+    cell.addEventListener('click', e => e.stopPropagation());
+  });
+  checkboxes().forEach(c => c.addEventListener('change', refresh));
+  if (selectAll) {
+    selectAll.addEventListener('change', () => {
+      checkboxes().forEach(c => { c.checked = selectAll.checked; });
+      refresh();
+    });
+  }
+
+  buttons.forEach(button => {
+    button.addEventListener('click', async () => {
+      const ids = selectedIds();
+      if (ids.length === 0 || !confirm(button.dataset.bulkConfirm)) return;
+
+      const payload = { upload_request_ids: ids };
+      if (button.dataset.bulkExtend !== undefined) {
+        payload.days = Number(daysEl.value);
+      }
+
+      buttons.forEach(b => { b.disabled = true; });
+      try {
+        const res = await fetch(button.dataset.bulkUrl, {
+          method: 'POST',
+          headers: {
+            'Content-Type': 'application/json',
+            'X-CSRFToken': toolbar.dataset.csrfToken,
+          },
+          body: JSON.stringify(payload),
+        });
+        if (!res.ok) throw new Error();
+        window.location.reload();
+      } catch (e) {
+        alert('一括操作に失敗しました');
+        refresh();
+      }
+    });
+  });
+
+  refresh();
+})();
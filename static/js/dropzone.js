@@ -7,16 +7,70 @@ style.textContent = `
 `;
 document.head.appendChild(style);
 
+// サーバ側設定（config/app.ini の [upload]）
+const uploadSettings = window.SSEND_UPLOAD_SETTINGS || {};
+
+// 同時に追加されたファイルは順番に確認する（先に受け付けたファイルの分を差し引くため）
+let quotaCheck = Promise.resolve();
+
+// 残り容量（フォームの data-quota-url）に入らない場合のエラーメッセージ
+function quotaError(dz, file, quota) {
+  if (quota.expired) return "このアップロードURLは期限切れです";
+
+  // 同じファイル名は上書きされるため、既存ファイルの分を空きとして扱う
+  const sizes = { ...quota.files };
+  let remainingFiles = quota.remaining_files;
+  let remainingBytes = quota.remaining_bytes;
+
+  // 送信待ち・送信中のファイルの分を差し引く
+  const pending = dz.getAcceptedFiles().filter(
+    f => f !== file && (f.status === Dropzone.QUEUED || f.status === Dropzone.UPLOADING)
+  );
+  for (const f of [...pending, file]) {
+    const replaced = sizes[f.name];
+    if (replaced === undefined) remainingFiles -= 1;
+    remainingBytes -= f.size - (replaced || 0);
+    sizes[f.name] = f.size;
+  }
+
+  if (remainingFiles < 0) return "最大ファイル数に達しています";
+  if (remainingBytes < 0) return "合計ファイルサイズの上限に達しています";
+  return undefined;
+}
+
 Dropzone.options.dz = {
   autoProcessQueue: false,   // 自動アップロードしない
-  parallelUploads: 10,       // 同時アップロード数
-  maxFilesize: 10,           // ファイルサイズ
+  parallelUploads: uploadSettings.parallel_uploads || 10,  // 同時アップロード数（まとめて送る場合は1リクエストのファイル数）
+  uploadMultiple: uploadSettings.upload_multiple !== false, // 複数ファイルを1リクエストで送る（data-batch-url）
+  paramName: () => "file",   // まとめて送る場合も同じ名前（file[0] などにしない）
+  maxFilesize: uploadSettings.max_file_size_mb || 10,      // ファイルサイズ（MB）
   dictDefaultMessage: "",
   acceptedFiles: "",
   dictDefaultMessage: "",
   dictInvalidFileType: "このファイル形式はアップロードできません",
   dictFileTooBig: "ファイルサイズが大きすぎます",
 
+  // 追加時に上限・期限を確認し、アップロードを始める前にエラーを表示する
+  // （確認できない場合はサーバ側の確認に任せる）
+  accept: function (file, done) {
+    const dz = this;
+    const quotaUrl = dz.element.dataset.quotaUrl;
+    if (!quotaUrl) return done();
+
+    quotaCheck = quotaCheck.then(async () => {
+      let quota;
+      try {
+        const res = await fetch(quotaUrl, { cache: "no-store" });
+        if (res.status === 404) return done("このアップロードURLは期限切れです");
+        if (!res.ok) return done();
+        quota = await res.json();
+      } catch (e) {
+        return done();
+      }
+      done(quotaError(dz, file, quota));
+    });
+  },
+
   previewTemplate: `
     <div class="dz-preview dz-file-preview position-relative
                 fade show
@@ -60,12 +114,32 @@ Dropzone.options.dz = {
       const dz = this;
       const placeholder = document.getElementById("dz-placeholder");
 
+      // まとめて送る場合はファイルごとの結果を返すURLに送る
+      if (dz.options.uploadMultiple) {
+        if (dz.element.dataset.batchUrl) {
+          dz.options.url = dz.element.dataset.batchUrl;
+        } else {
+          dz.options.uploadMultiple = false;
+        }
+      }
+
       // アップロードボタン押下時処理
       document.getElementById("dz-upload").addEventListener("click", function () {
           // キューに溜まっているファイルを一括アップロード
+          // （同時アップロード数ずつ、キューが空になるまで続けて送る）
+          dz.options.autoProcessQueue = true;
           dz.processQueue();
       });
 
+      this.on("queuecomplete", function () {
+        dz.options.autoProcessQueue = false;
+      });
+
+      // まとめて送ったファイルの順番（レスポンスの results と対応）
+      this.on("sendingmultiple", function (files) {
+        files.forEach((file, i) => { file.batchIndex = i; });
+      });
+
       // ファイル追加時文言を隠す
       this.on("addedfile", function () {
         placeholder.style.display = "none";
@@ -87,6 +161,18 @@ Dropzone.options.dz = {
 
       // 成功時
       this.on("success", function(file, response) {
+          // まとめて送った場合はファイルごとの結果
+          if (response && response.results) {
+            const result = response.results[file.batchIndex];
+            if (result.error) {
+              // complete は Dropzone が success の後に送るため、ここでは送らない
+              file.status = Dropzone.ERROR;
+              dz.emit("error", file, result.error);
+              return;
+            }
+            response = result.file;
+          }
+
           const preview = file.previewElement;
 
           // プログレスを 100% に設定
@@ -0,0 +1,337 @@
+import io
+import os
+import zlib
+import struct
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from cryptography.fernet import InvalidToken
+
+from settings import get_settings
+
+# ------------------------
+# 保存ファイル形式
+# ------------------------
+# 分割暗号化形式：
+#   MAGIC + （平文 SEGMENT_SIZE バイトごとの Fernet トークン + 改行）の繰り返し
+#   各セグメントの平文の先頭に通し番号と最終フラグを付け、並べ替え・切り詰めを検出する
+#   MAGIC_ZLIB の場合は各セグメントの平文（通し番号・最終フラグ以降）を zlib で圧縮してある
+#   （セグメントごとの長さが一定でないため、途中からの読み込み（seek）はできない）
+# 従来形式：
+#   ファイル全体で1つの Fernet トークン（b"gAAAA" で始まる）
+MAGIC = b"SSEND-SEG1\n"
+MAGIC_ZLIB = b"SSEND-SEGZ\n"
+# 1セグメントの平文サイズ（転送中に保持するのは1セグメント分のみ）
+SEGMENT_SIZE = 256 * 1024
+
+_SEGMENT_HEADER = struct.Struct(">Q?")
+
+# 圧縮方式（files.codec に記録する）
+CODEC_ZLIB = "zlib"
+COMPRESS_LEVEL = 6
+# 先頭セグメントがこの割合以下に縮む場合のみ圧縮する（画像・ZIPなど圧縮済みの形式は圧縮しない）
+COMPRESS_MIN_RATIO = 0.9
+
+def _token_length(plain_size):
+    # Fernet トークン長（version 1 + timestamp 8 + IV 16 + 暗号文（16バイト単位にパディング）+ HMAC 32 の Base64）
+    raw = 1 + 8 + 16 + (plain_size // 16 + 1) * 16 + 32
+    return (raw + 2) // 3 * 4
+
+# 最終以外のセグメントは平文が SEGMENT_SIZE で一定のため、ファイル上の位置を計算できる
+_SEGMENT_LINE_SIZE = _token_length(_SEGMENT_HEADER.size + SEGMENT_SIZE) + 1
+
+def _read_full(src, size):
+    # ストリームは要求サイズより短く返すことがあるため、size に達するか EOF まで読む
+    chunks = []
+    remaining = size
+    while remaining > 0:
+        data = src.read(remaining)
+        if not data:
+            break
+        chunks.append(data)
+        remaining -= len(data)
+    return b"".join(chunks)
+
+def _segments(src):
+    index = 0
+    data = _read_full(src, SEGMENT_SIZE)
+    while True:
+        next_data = _read_full(src, SEGMENT_SIZE) if len(data) == SEGMENT_SIZE else b""
+        final = not next_data
+        yield index, data, final
+        if final:
+            return
+        data = next_data
+        index += 1
+
+# ------------------------
+# 並列暗号化
+# ------------------------
+# セグメントは独立して暗号化できるため、スレッドプールで並行して暗号化し、順番に書き出す
+# （暗号化処理は GIL を解放するため、大きいファイルの受信・ZIP作成が複数コアを使える）
+_executor = None
+_executor_workers = 0
+_executor_lock = threading.Lock()
+
+def _encrypt_executor():
+    """
+    暗号化用のスレッドプールと並列数（並列化しない設定・1コアの場合は (None, 1)）
+    """
+    global _executor, _executor_workers
+
+    workers = get_settings().upload.encrypt_workers or os.cpu_count() or 1
+    if workers <= 1:
+        return None, 1
+
+    with _executor_lock:
+        # 設定が変わった場合は作り直す（古いプールは受付済みの暗号化を終えてからスレッドを終了する）
+        if _executor is None or _executor_workers != workers:
+            if _executor is not None:
+                _executor.shutdown(wait=False)
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="encrypt")
+            _executor_workers = workers
+        return _executor, _executor_workers
+
+# ------------------------
+# 暗号化して書き込むファイルオブジェクト
+# ------------------------
+class EncryptedWriter(io.RawIOBase):
+    """
+    書き込まれたデータをセグメント単位で暗号化して path に保存する（ZIP作成など書き込み側で使う）。
+    一時ファイル（同じディレクトリに一意の名前で作成）に書き、close() で置き換える。例外時は abort() で一時ファイルを削除する。
+    compress=True の場合、先頭セグメントを試しに圧縮して縮むファイルは圧縮してから暗号化する（codec で分かる）。
+    """
+
+    def __init__(self, fernet, path, compress=False):
+        self._fernet = fernet
+        self._path = path
+        # 同じ path に同時に書き込む場合も一時ファイルを共有しない
+        fd, self._tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(path) or ".", prefix=f"{os.path.basename(path)}.", suffix=".tmp"
+        )
+        self._file = os.fdopen(fd, "wb")
+        self._compress = compress
+        self._buffer = bytearray()
+        self._index = 0
+        self.size = 0                   # 平文のサイズ（バイト）
+        self.codec = None               # 圧縮方式（先頭セグメントの書き出し時に決まる）
+
+        # 並列暗号化の場合、暗号化中のセグメント（書き出す順）
+        self._executor, workers = _encrypt_executor()
+        self._pending = deque()
+        # 暗号化待ちを溜めすぎない（保持する平文は並列数の2倍のセグメントまで）
+        self._max_pending = workers * 2
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._buffer += b
+        self.size += len(b)
+        # 最終セグメントかどうかは後続のデータで決まるため、SEGMENT_SIZE を超えた分だけ書き出す
+        while len(self._buffer) > SEGMENT_SIZE:
+            self._write_segment(bytes(self._buffer[:SEGMENT_SIZE]), False)
+            del self._buffer[:SEGMENT_SIZE]
+        return len(b)
+
+    def _write_segment(self, data, final):
+        encoded = self._start(data) if self._index == 0 else None
+        segment = (self._index, final, data, encoded)
+        self._index += 1
+
+        if self._executor is not None:
+            try:
+                future = self._executor.submit(self._seal, *segment)
+            except RuntimeError:
+                # 書き込み中に設定変更でプールが終了した場合は、このファイルの残りを並列化せずに暗号化する
+                self._executor = None
+
+        if self._executor is None:
+            while self._pending:
+                self._write_token(self._pending.popleft().result())
+            self._write_token(self._seal(*segment))
+            return
+
+        self._pending.append(future)
+        # 暗号化が終わった先頭から書き出す（上限に達している場合は先頭の完了を待つ）
+        while self._pending and (len(self._pending) > self._max_pending or self._pending[0].done()):
+            self._write_token(self._pending.popleft().result())
+
+    def _start(self, data):
+        """先頭セグメントの圧縮率で圧縮方式を決めてファイルの先頭を書く。戻り値: 圧縮したデータ（圧縮しない場合は None）"""
+        encoded = None
+        if self._compress:
+            sample = zlib.compress(data, COMPRESS_LEVEL)
+            if len(sample) <= len(data) * COMPRESS_MIN_RATIO:
+                self.codec = CODEC_ZLIB
+                encoded = sample
+        self._file.write(MAGIC_ZLIB if self.codec == CODEC_ZLIB else MAGIC)
+        return encoded
+
+    def _seal(self, index, final, data, encoded=None):
+        # 圧縮も暗号化と合わせてスレッドプールで行う
+        if encoded is None and self.codec == CODEC_ZLIB:
+            encoded = zlib.compress(data, COMPRESS_LEVEL)
+        return self._fernet.encrypt(_SEGMENT_HEADER.pack(index, final) + (data if encoded is None else encoded))
+
+    def _write_token(self, token):
+        self._file.write(token)
+        self._file.write(b"\n")
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            self._write_segment(bytes(self._buffer), True)
+            while self._pending:
+                self._write_token(self._pending.popleft().result())
+            self._file.close()
+            os.replace(self._tmp_path, self._path)
+        except BaseException:
+            self.abort()
+            raise
+        super().close()
+
+    def abort(self):
+        for future in self._pending:
+            future.cancel()
+        self._pending.clear()
+        self._file.close()
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+        super().close()
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
+
+# ------------------------
+# 暗号化して保存（一時ファイルに書いてから置き換える）
+# ------------------------
+def save_encrypted(fernet, src, path, compress=False):
+    """
+    src（ファイルオブジェクト）をセグメント単位で暗号化して path に保存する。
+
+    戻り値: (平文のサイズ（バイト）, 圧縮方式)
+    """
+    with EncryptedWriter(fernet, path, compress) as dst:
+        while True:
+            data = src.read(SEGMENT_SIZE)
+            if not data:
+                break
+            dst.write(data)
+
+    return dst.size, dst.codec
+
+# ------------------------
+# 復号（セグメント単位で返す）
+# ------------------------
+def iter_decrypted(fernet, path, start_segment=0):
+    """start_segment を指定した場合はそのセグメントから復号する（分割暗号化形式のみ）"""
+    with open(path, "rb") as f:
+        head = f.read(len(MAGIC))
+
+        # 従来形式
+        if head not in (MAGIC, MAGIC_ZLIB):
+            if start_segment:
+                raise io.UnsupportedOperation("legacy format is not seekable")
+            yield fernet.decrypt(head + f.read())
+            return
+
+        compressed = head == MAGIC_ZLIB
+        if compressed and start_segment:
+            raise io.UnsupportedOperation("compressed file is not seekable")
+
+        index = start_segment
+        f.seek(len(MAGIC) + start_segment * _SEGMENT_LINE_SIZE)
+        for line in f:
+            data = fernet.decrypt(line.rstrip(b"\n"))
+            segment_index, final = _SEGMENT_HEADER.unpack_from(data)
+            if segment_index != index:
+                raise InvalidToken
+            payload = data[_SEGMENT_HEADER.size:]
+            yield zlib.decompress(payload) if compressed else payload
+            if final:
+                return
+            index += 1
+
+        # 最終セグメントがない（切り詰められている）
+        raise InvalidToken
+
+def is_seekable(path):
+    # 圧縮なしの分割暗号化形式のみ、セグメントの位置を計算できる
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+def read_decrypted(fernet, path):
+    return b"".join(iter_decrypted(fernet, path))
+
+# ------------------------
+# 復号ストリーム（send_file に渡すファイルオブジェクト）
+# ------------------------
+class DecryptedReader(io.RawIOBase):
+    """
+    読み込みに合わせて1セグメントずつ復号する。
+    鍵の誤りなどはレスポンス開始前に検出できるよう、先頭セグメントは作成時に復号する。
+    分割暗号化形式（圧縮なし）のファイルは seek() できる（Range リクエストで途中から返す）。
+    """
+
+    def __init__(self, fernet, path):
+        self._fernet = fernet
+        self._path = path
+        self._seekable = is_seekable(path)
+        self._open(0)
+
+    def _open(self, segment):
+        self._segments = iter_decrypted(self._fernet, self._path, segment)
+        self._buffer = next(self._segments, b"")
+        self._pos = 0
+        # _buffer の先頭の平文上の位置
+        self._offset = segment * SEGMENT_SIZE
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return self._seekable
+
+    def tell(self):
+        return self._offset + self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if not self._seekable:
+            raise io.UnsupportedOperation("legacy format is not seekable")
+        if whence == io.SEEK_CUR:
+            offset += self.tell()
+        elif whence != io.SEEK_SET:
+            raise io.UnsupportedOperation("unsupported whence")
+
+        segment, pos = divmod(offset, SEGMENT_SIZE)
+        if segment * SEGMENT_SIZE != self._offset:
+            self._segments.close()
+            self._open(segment)
+        self._pos = pos
+        return offset
+
+    def readinto(self, b):
+        while self._pos >= len(self._buffer):
+            try:
+                next_buffer = next(self._segments)
+            except StopIteration:
+                return 0
+            self._offset += len(self._buffer)
+            self._pos -= len(self._buffer)
+            self._buffer = next_buffer
+
+        n = min(len(b), len(self._buffer) - self._pos)
+        b[:n] = memoryview(self._buffer)[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+    def close(self):
+        self._segments.close()
+        super().close()
@@ -0,0 +1,90 @@
+import os
+import sys
+import dataclasses
+import importlib
+
+import pytest
+from flask import Flask
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db
+import db.connection
+import background
+import settings
+
+
+# ------------------------
+# 一時ファイルのSQLiteで初期化したDB
+# ------------------------
+@pytest.fixture
+def db_path(tmp_path, monkeypatch):
+    path = str(tmp_path / "app.db")
+    monkeypatch.setattr(db.connection, "DB_PATH", path)
+    monkeypatch.setattr(db.connection, "REPORT_DB_PATH", str(tmp_path / "app_report.db"))
+    db.init_db()
+    return path
+
+# ------------------------
+# 設定の変更（例: use_settings("zip", cache_enabled=True)）
+# ------------------------
+@pytest.fixture
+def use_settings(monkeypatch):
+    # 設定ファイルの再読込を行わないようにして、読込済みの設定を差し替える
+    settings.get_settings()
+    monkeypatch.setattr(settings, "_last_checked", float("inf"))
+
+    def use(section, **values):
+        current = settings.get_settings()
+        changed = dataclasses.replace(getattr(current, section), **values)
+        monkeypatch.setattr(settings, "_settings", dataclasses.replace(current, **{section: changed}))
+
+    return use
+
+@pytest.fixture
+def app(db_path):
+    app = Flask(__name__)
+    app.teardown_appcontext(db.close_db)
+    return app
+
+@pytest.fixture
+def app_ctx(app):
+    with app.app_context():
+        yield app
+
+# ------------------------
+# app.py のアプリ（DB・保存先は一時ディレクトリ、バックグラウンド処理は起動しない）
+# ------------------------
+UPLOAD_DIR_MODULES = (
+    "app", "upload_stream", "file_cleanup", "zip_cache",
+    "views.internal", "views.guest", "views.admin", "api.v1",
+)
+
+@pytest.fixture
+def upload_dir(tmp_path, monkeypatch):
+    path = tmp_path / "uploads"
+    path.mkdir()
+    for name in UPLOAD_DIR_MODULES:
+        monkeypatch.setattr(importlib.import_module(name), "UPLOAD_DIR", str(path))
+    monkeypatch.setattr(importlib.import_module("zip_cache"), "ZIP_CACHE_DIR", str(tmp_path / "zip_cache"))
+    return path
+
+@pytest.fixture
+def flask_app(db_path, upload_dir, monkeypatch):
+    monkeypatch.setattr(background.BackgroundWorker, "start", lambda self, app: None)
+    app = importlib.import_module("app").app
+    monkeypatch.setitem(app.config, "SESSION_COOKIE_SECURE", False)
+    return app
+
+@pytest.fixture
+def client(flask_app):
+    return flask_app.test_client()
+
+@pytest.fixture
+def login(client):
+    # 社内ユーザ（初期管理者）でログイン済みにする
+    with client.session_transaction() as session:
+        session["user_id"] = "ssend_admin"
+        session["user_name"] = "システム管理者"
+        session["admin"] = True
+    return client
@@ -0,0 +1,46 @@
+import sqlite3
+
+import pytest
+from werkzeug.exceptions import BadRequest
+
+import db
+from api.v1 import CreateBox
+from views import schemas
+
+
+def test_token_touch_does_not_hold_write_lock(app, db_path):
+    with app.app_context():
+        token = db.crud.create_api_token("ssend_admin", "test")
+
+    with app.test_request_context():
+        # リクエスト単位トランザクション中（アップロードの受信前）に認証する
+        db.begin_request_transaction()
+        assert db.crud.get_api_token_user(token)["login_id"] == "ssend_admin"
+
+        # 受信中に他の接続から書き込める（待たずに書き込めること）
+        other = sqlite3.connect(db_path, timeout=0)
+        try:
+            other.execute("UPDATE users SET name = 'other' WHERE login_id = 'ssend_admin'")
+            other.commit()
+        finally:
+            other.close()
+
+        db.end_request_transaction(success=True)
+
+
+@pytest.mark.parametrize("body", [
+    b'{"title": "box", "max_files": -1, "max_total_size": 10}',
+    b'{"title": "box", "max_files": 0, "max_total_size": 10}',
+    b'{"title": "box", "max_files": 1, "max_total_size": -5}',
+    b'{"title": "", "max_files": 1, "max_total_size": 10}',
+])
+def test_create_box_rejects_invalid_quota(app, body):
+    with app.test_request_context():
+        with pytest.raises(BadRequest):
+            schemas.decode_request(body, CreateBox)
+
+
+def test_create_box_accepts_valid_quota(app):
+    with app.test_request_context():
+        box = schemas.decode_request(b'{"title": "box", "max_files": 1, "max_total_size": 10}', CreateBox)
+    assert (box.title, box.max_files, box.max_total_size) == ("box", 1, 10)
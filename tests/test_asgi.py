@@ -0,0 +1,114 @@
+import sys
+import types
+import asyncio
+import hashlib
+import importlib
+
+import pytest
+from flask import Flask, request, abort
+
+CHUNK = 64 * 1024
+
+
+# ------------------------
+# asgi.py（app.py の代わりに測定用アプリを読み込ませる）
+# ------------------------
+@pytest.fixture
+def asgi(monkeypatch):
+    monkeypatch.setitem(sys.modules, "app", types.SimpleNamespace(app=Flask("stub")))
+    monkeypatch.setenv("ASSETS_CDN_FALLBACK", "1")
+    monkeypatch.delitem(sys.modules, "asgi", raising=False)
+    return importlib.import_module("asgi")
+
+@pytest.fixture
+def flask_app():
+    app = Flask(__name__)
+
+    @app.route("/upload", methods=["POST"])
+    def upload():
+        # アップロードの上限確認と同じく、本文を読む前に Content-Length で拒否する
+        if (request.content_length or 0) > 10 * CHUNK:
+            abort(413)
+        digest = hashlib.sha256()
+        size = 0
+        while True:
+            data = request.stream.read(CHUNK)
+            if not data:
+                break
+            digest.update(data)
+            size += len(data)
+        return f"{size} {digest.hexdigest()}"
+
+    return app
+
+def call(bridge, chunks, headers=(), disconnect_after=None):
+    """chunks を順に送るクライアント。戻り値: (ステータス, 本文, 受信されたチャンク数)"""
+    received = 0
+    response = {"body": b""}
+
+    async def main():
+        done = asyncio.Event()
+        source = iter(chunks)
+        pending = next(source, None)
+
+        async def receive():
+            nonlocal received, pending
+            if disconnect_after is not None and received >= disconnect_after:
+                return {"type": "http.disconnect"}
+            if pending is None:
+                await done.wait()
+                return {"type": "http.disconnect"}
+            data, pending = pending, next(source, None)
+            received += 1
+            await asyncio.sleep(0)
+            return {"type": "http.request", "body": data, "more_body": pending is not None}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+            else:
+                response["body"] += message.get("body", b"")
+                if not message.get("more_body", False):
+                    done.set()
+
+        scope = {
+            "type": "http", "method": "POST", "path": "/upload", "query_string": b"",
+            "headers": [(k.encode(), v.encode()) for k, v in headers],
+        }
+        await bridge(scope, receive, send)
+
+    asyncio.run(main())
+    return response["status"], response["body"], received
+
+
+def test_body_is_streamed_to_the_app(asgi, flask_app):
+    bridge = asgi.AsyncWsgiBridge(flask_app, threads=2)
+    chunks = [bytes([i]) * CHUNK for i in range(8)]
+    expected = hashlib.sha256(b"".join(chunks)).hexdigest()
+
+    status, body, _ = call(bridge, chunks, [("content-length", str(8 * CHUNK))])
+    assert status == 200
+    assert body.decode() == f"{8 * CHUNK} {expected}"
+
+    # Content-Length なし（chunked）は終端まで読む
+    status, body, _ = call(bridge, chunks)
+    assert body.decode() == f"{8 * CHUNK} {expected}"
+
+
+def test_large_body_is_rejected_before_it_is_received(asgi, flask_app):
+    bridge = asgi.AsyncWsgiBridge(flask_app, threads=2)
+    total = 16 * 1024                                 # 1GB 分のチャンク
+    chunks = (b"x" * CHUNK for _ in range(total))
+
+    status, _, received = call(bridge, chunks, [("content-length", str(total * CHUNK))])
+    assert status == 413
+    # 受信するのはメモリに保持する上限までで、ボディ全体は受信しない
+    assert received <= asgi.BODY_BUFFER_SIZE // CHUNK + 2
+
+
+def test_disconnect_during_body(asgi, flask_app):
+    bridge = asgi.AsyncWsgiBridge(flask_app, threads=2)
+    chunks = [b"x" * CHUNK] * 8
+
+    status, _, _ = call(bridge, chunks, [("content-length", str(8 * CHUNK))], disconnect_after=3)
+    assert status == 400
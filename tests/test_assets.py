@@ -0,0 +1,88 @@
+import io
+import os
+import urllib.request
+
+import pytest
+from flask import Flask
+
+import assets
+
+
+# ------------------------
+# static/vendor を一時ディレクトリにしたアプリ
+# ------------------------
+@pytest.fixture
+def static_app(tmp_path, monkeypatch):
+    monkeypatch.delenv("ASSETS_CDN_FALLBACK", raising=False)
+    app = Flask(__name__, static_folder=str(tmp_path))
+    assets.init_app(app)
+    return app
+
+def _vendor_data(filename):
+    return f"/* {filename} */".encode()
+
+@pytest.fixture
+def pinned(monkeypatch):
+    # テスト用の内容のハッシュを登録する
+    monkeypatch.setattr(assets, "VENDOR_INTEGRITY", {
+        filename: assets.integrity(_vendor_data(filename)) for filename in assets.VENDOR_ASSETS
+    })
+
+def _build_vendor(app):
+    for filename in assets.VENDOR_ASSETS:
+        path = os.path.join(app.static_folder, filename)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(_vendor_data(filename))
+
+def test_missing_vendor_assets_stop_startup(static_app):
+    with pytest.raises(RuntimeError, match="build-assets"):
+        assets.require_vendor_assets(static_app)
+
+def test_vendor_assets_are_served_locally(static_app, pinned):
+    _build_vendor(static_app)
+    assets.require_vendor_assets(static_app)
+
+    with static_app.test_request_context():
+        url = assets.asset_url("static", filename="vendor/vue/vue.global.prod.js")
+    assert url.startswith("/assets/vendor/vue/vue.global.prod.")
+
+def test_modified_vendor_asset_stops_startup(static_app, pinned):
+    _build_vendor(static_app)
+    with open(os.path.join(static_app.static_folder, "vendor/vue/vue.global.prod.js"), "ab") as f:
+        f.write(b"alert(1)")
+
+    with pytest.raises(RuntimeError, match="vue.global.prod.js: integrity mismatch"):
+        assets.require_vendor_assets(static_app)
+
+def test_build_assets_keeps_only_verified_downloads(static_app, pinned, monkeypatch):
+    tampered = "vendor/dropzone/dropzone.min.js"
+    sources = {source: filename for filename, source in assets.VENDOR_ASSETS.items()}
+
+    def urlopen(url, timeout):
+        filename = sources[url]
+        return io.BytesIO(b"tampered" if filename == tampered else _vendor_data(filename))
+
+    monkeypatch.setattr(urllib.request, "urlopen", urlopen)
+    with static_app.app_context():
+        result = static_app.test_cli_runner().invoke(args=["build-assets"])
+
+    assert result.exit_code != 0
+    assert f"{tampered}: integrity mismatch" in result.output
+    assert not os.path.exists(os.path.join(static_app.static_folder, tampered))
+    for filename in assets.VENDOR_ASSETS:
+        if filename != tampered:
+            assert os.path.exists(os.path.join(static_app.static_folder, filename))
+
+def test_cdn_fallback_only_when_allowed(static_app, monkeypatch):
+    filename = "vendor/vue/vue.global.prod.js"
+
+    # 開発時（wsgi.py / asgi.py を経由しない）は取得元を参照する
+    with static_app.test_request_context():
+        assert assets.asset_url("static", filename=filename) == assets.VENDOR_ASSETS[filename]
+
+    # ASSETS_CDN_FALLBACK=1 の場合は未取得でも起動できる
+    monkeypatch.setenv("ASSETS_CDN_FALLBACK", "1")
+    assets.require_vendor_assets(static_app)
+    with static_app.test_request_context():
+        assert assets.asset_url("static", filename=filename) == assets.VENDOR_ASSETS[filename]
@@ -0,0 +1,83 @@
+import gzip
+import io
+import os
+import uuid
+
+import pytest
+from flask import Flask, Response, jsonify
+
+import db
+import storage
+from compression import CompressionMiddleware
+
+BODY = "ファイル名,サイズ\n" + "sample.txt,1024\n" * 200
+
+
+@pytest.fixture
+def client(use_settings):
+    use_settings("compression", enabled=True, min_size=1024, level=6)
+
+    app = Flask(__name__)
+
+    @app.route("/json")
+    def json():
+        return jsonify(items=[{"name": "sample.txt", "size": 1024}] * 100)
+
+    @app.route("/csv")
+    def csv():
+        return Response(BODY, mimetype="text/csv")
+
+    @app.route("/attachment")
+    def attachment():
+        return Response(BODY, mimetype="text/csv", headers={
+            "Content-Disposition": 'attachment; filename="logs.csv"',
+        })
+
+    @app.route("/small")
+    def small():
+        return Response("ok", mimetype="text/plain")
+
+    app.wsgi_app = CompressionMiddleware(app.wsgi_app)
+    return app.test_client()
+
+def get(client, path):
+    return client.get(path, headers={"Accept-Encoding": "gzip, deflate"})
+
+
+def test_text_responses_are_gzipped(client):
+    res = get(client, "/csv")
+    assert res.headers["Content-Encoding"] == "gzip"
+    assert "Content-Length" not in res.headers
+    assert "Accept-Encoding" in res.headers["Vary"]
+    assert gzip.decompress(res.data).decode() == BODY
+
+    res = get(client, "/json")
+    assert res.headers["Content-Encoding"] == "gzip"
+    assert gzip.decompress(res.data).startswith(b'{"items":')
+
+def test_attachments_are_not_compressed(client):
+    res = get(client, "/attachment")
+    assert "Content-Encoding" not in res.headers
+    assert res.headers["Content-Disposition"].startswith("attachment")
+    assert res.get_data(as_text=True) == BODY
+
+def test_small_or_unaccepted_responses_are_not_compressed(client):
+    assert "Content-Encoding" not in get(client, "/small").headers
+    assert "Content-Encoding" not in client.get("/csv").headers
+
+def test_guest_zip_download_is_not_compressed(flask_app, upload_dir, use_settings):
+    use_settings("compression", enabled=True, min_size=0)
+    with flask_app.app_context():
+        box = db.crud.create_upload_request("box", "2099-12-31", 10, 100, "ssend_admin")
+        os.makedirs(upload_dir / box)
+        file_id = str(uuid.uuid4())
+        size, codec = storage.save_encrypted(flask_app.fernet, io.BytesIO(BODY.encode()), str(upload_dir / box / file_id))
+        db.crud.create_file(box, file_id, "logs.csv", size, codec)
+        download_id = db.crud.create_download_request(box, 7, 5, None, None, None)
+        token = db.crud.get_download_request(download_id)["download_token"]
+        db.crud.commit(immediate=True)
+
+    with get(flask_app.test_client(), f"/guest_download/{token}/zip") as res:
+        assert res.status_code == 200
+        assert res.headers["Content-Disposition"].startswith("attachment")
+        assert "Content-Encoding" not in res.headers
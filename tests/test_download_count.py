@@ -0,0 +1,95 @@
+import multiprocessing
+import threading
+
+from flask import Flask
+
+import db
+import db.connection
+
+THREADS = 16
+PROCESSES = 4
+CALLS_PER_THREAD = 10
+
+
+def create_download_request(app, max_downloads):
+    with app.app_context():
+        upload_request_id = db.crud.create_upload_request("box", "2099-12-31", 10, 100, "user")
+        return db.crud.create_download_request(upload_request_id, 7, max_downloads, None, None, None)
+
+
+def test_concurrent_downloads_never_exceed_max_downloads(app):
+    max_downloads = 25
+    download_request_id = create_download_request(app, max_downloads)
+
+    results = []
+    results_lock = threading.Lock()
+    start = threading.Barrier(THREADS)
+
+    def download():
+        # スレッドごとに別の接続（アプリケーションコンテキスト）で同じDBファイルを更新する
+        with app.app_context():
+            start.wait()
+            for _ in range(CALLS_PER_THREAD):
+                count = db.crud.increment_file_download_count(download_request_id, "file-1", max_downloads)
+                with results_lock:
+                    results.append(count)
+
+    threads = [threading.Thread(target=download) for _ in range(THREADS)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    counted = sorted(c for c in results if c is not None)
+    assert len(results) == THREADS * CALLS_PER_THREAD
+    # ちょうど上限回数だけ回数が返り、同じ回数は返らない
+    assert counted == list(range(1, max_downloads + 1))
+
+    with app.app_context():
+        row = db.get_db().execute(
+            "SELECT download_count FROM download_counts WHERE download_request_id = ? AND file_id = ?",
+            (download_request_id, "file-1"),
+        ).fetchone()
+    assert row["download_count"] == max_downloads
+
+
+def download_in_process(db_path, download_request_id, max_downloads, start, results):
+    # 別プロセス（gunicorn の複数ワーカー相当）から同じDBファイルを更新する
+    db.connection.DB_PATH = db_path
+    app = Flask(__name__)
+    app.teardown_appcontext(db.close_db)
+    with app.app_context():
+        start.wait()
+        for _ in range(CALLS_PER_THREAD):
+            results.put(db.crud.increment_file_download_count(download_request_id, "file-1", max_downloads))
+
+
+def test_concurrent_downloads_from_processes_never_exceed_max_downloads(app, db_path):
+    max_downloads = 25
+    download_request_id = create_download_request(app, max_downloads)
+
+    ctx = multiprocessing.get_context("spawn")
+    start = ctx.Barrier(PROCESSES)
+    results = ctx.Queue()
+    processes = [
+        ctx.Process(
+            target=download_in_process,
+            args=(db.connection.DB_PATH, download_request_id, max_downloads, start, results),
+        )
+        for _ in range(PROCESSES)
+    ]
+    for p in processes:
+        p.start()
+    counts = [results.get(timeout=60) for _ in range(PROCESSES * CALLS_PER_THREAD)]
+    for p in processes:
+        p.join()
+        assert p.exitcode == 0
+
+    # ちょうど上限回数だけ回数が返り、同じ回数は返らない
+    assert sorted(c for c in counts if c is not None) == list(range(1, max_downloads + 1))
+
+
+def test_no_download_allowed_when_max_downloads_is_zero(app_ctx):
+    download_request_id = create_download_request(app_ctx, 0)
+
+    assert db.crud.increment_file_download_count(download_request_id, "file-1", 0) is None
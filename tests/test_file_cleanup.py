@@ -0,0 +1,53 @@
+import os
+import shutil
+
+import pytest
+
+import db
+import file_cleanup
+
+
+@pytest.fixture
+def boxes(app_ctx, upload_dir, monkeypatch):
+    monkeypatch.setattr(file_cleanup, "CLEANUP_BATCH_SIZE", 2)
+    ids = [db.crud.create_upload_request(f"box{i}", "2099-12-31", 10, 100, "ssend_admin") for i in range(3)]
+    for box in ids:
+        os.makedirs(upload_dir / box)
+    db.crud.delete_upload_requests(ids)
+    db.crud.commit(immediate=True)
+    return ids
+
+def queued():
+    return {r["upload_request_id"]: r for r in db.get_db().execute("SELECT * FROM file_deletions")}
+
+
+def test_failed_deletions_do_not_block_queue(boxes, upload_dir, monkeypatch):
+    poison = set(boxes[:2])
+    rmtree = shutil.rmtree
+
+    def fail_poison(path):
+        if os.path.basename(path) in poison:
+            raise PermissionError(13, "Permission denied", path)
+        rmtree(path)
+
+    monkeypatch.setattr(file_cleanup.shutil, "rmtree", fail_poison)
+
+    # 先頭の2件（1回分）が削除できなくても、次の処理では後続を削除する
+    assert file_cleanup.process_file_deletions() == 0
+    assert file_cleanup.process_file_deletions() == 1
+    assert not os.path.exists(upload_dir / boxes[2])
+
+    # 削除できなかったものは間隔を空けて再試行する
+    rows = queued()
+    assert sorted(rows) == sorted(poison)
+    for row in rows.values():
+        assert row["attempts"] == 1
+        assert row["next_attempt_at"] is not None
+    assert file_cleanup.process_file_deletions() == 0
+    assert all(r["attempts"] == 1 for r in queued().values())
+
+    # 再試行日時を過ぎたら削除する
+    poison.clear()
+    db.get_db().execute("UPDATE file_deletions SET next_attempt_at = '2000-01-01T00:00:00'")
+    assert file_cleanup.process_file_deletions() == 2
+    assert queued() == {}
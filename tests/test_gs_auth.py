@@ -0,0 +1,207 @@
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+import pytest
+import requests
+from flask import Flask
+
+from views import gs_auth
+
+WHOAMI_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<ResultSet><Result>
+  <LoginId>yamada</LoginId><NameSei>山田</NameSei><NameMei>太郎</NameMei><Mail1>yamada@example.com</Mail1>
+</Result></ResultSet>"""
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+# ------------------------
+# GroupSession の代わりのHTTPサーバ（空きポートで起動する）
+# ------------------------
+class GsServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), GsHandler)
+        self.status = 200
+        self.requests = []
+        # hold が設定されている間は応答を返さない（タイムアウト・試行中の確認用）
+        self.hold = None
+        self.received = threading.Event()
+        self.release = threading.Event()
+
+    @property
+    def url(self):
+        host, port = self.server_address
+        return f"http://{host}:{port}/gsession/api/user/whoami.do"
+
+class GsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        server.requests.append(self.headers.get("Authorization"))
+        if server.hold:
+            server.received.set()
+            server.release.wait(10)
+
+        body = WHOAMI_XML.encode("utf-8") if server.status == 200 else b""
+        self.send_response(server.status)
+        self.send_header("Content-Type", "text/xml; charset=UTF-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(gs_auth, "time", SimpleNamespace(monotonic=clock))
+    return clock
+
+@pytest.fixture
+def gs_server(monkeypatch, clock):
+    # キャッシュ・ブレーカー・接続プールの状態はテストごとに初期化する
+    monkeypatch.setattr(gs_auth, "_cache", {})
+    monkeypatch.setattr(gs_auth, "_breaker_failures", 0)
+    monkeypatch.setattr(gs_auth, "_breaker_open_until", 0.0)
+    monkeypatch.setattr(gs_auth, "_http", requests.Session())
+    monkeypatch.setattr(gs_auth, "GS_TIMEOUT", (1, 1))
+
+    server = GsServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(gs_auth, "GS_WHOAMI_URL", server.url)
+    try:
+        with Flask(__name__).app_context():
+            yield server
+    finally:
+        server.release.set()
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+@pytest.fixture
+def refused_url(monkeypatch):
+    # 待ち受けていないポート（接続拒否）
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    url = f"http://127.0.0.1:{port}/gsession/api/user/whoami.do"
+    monkeypatch.setattr(gs_auth, "GS_WHOAMI_URL", url)
+    return url
+
+def open_breaker():
+    for _ in range(gs_auth.GS_BREAKER_THRESHOLD):
+        with pytest.raises(gs_auth.GsUnavailable):
+            gs_auth.whoami("yamada", "secret")
+
+
+def test_whoami_parses_user(gs_server):
+    assert gs_auth.whoami("yamada", "secret") == {
+        "login_id": "yamada",
+        "name": "山田 太郎",
+        "mail": "yamada@example.com",
+    }
+    # Basic 認証で問い合わせる
+    assert gs_server.requests == [requests.auth._basic_auth_str("yamada", "secret")]
+
+def test_cache_hit_skips_http_call(gs_server, clock):
+    first = gs_auth.whoami("yamada", "secret")
+    assert gs_auth.whoami("yamada", "secret") == first
+    assert len(gs_server.requests) == 1
+
+    # パスワードが違えばキャッシュを使わない
+    gs_auth.whoami("yamada", "other")
+    assert len(gs_server.requests) == 2
+
+    # 期限切れ後は問い合わせ直す
+    clock.now += gs_auth.GS_CACHE_TTL + 1
+    gs_auth.whoami("yamada", "secret")
+    assert len(gs_server.requests) == 3
+
+def test_failed_login_is_not_cached(gs_server):
+    gs_server.status = 401
+
+    assert gs_auth.whoami("yamada", "wrong") is None
+    assert gs_auth.whoami("yamada", "wrong") is None
+    assert len(gs_server.requests) == 2
+
+def test_connection_refused_opens_breaker(gs_server, refused_url):
+    for _ in range(gs_auth.GS_BREAKER_THRESHOLD):
+        with pytest.raises(gs_auth.GsUnavailable, match="Connection refused|Failed to establish"):
+            gs_auth.whoami("yamada", "secret")
+
+    # 遮断中は問い合わせずに失敗する
+    with pytest.raises(gs_auth.GsUnavailable, match="circuit open"):
+        gs_auth.whoami("yamada", "secret")
+
+def test_read_timeout_counts_as_failure(gs_server):
+    gs_server.hold = True
+
+    with pytest.raises(gs_auth.GsUnavailable, match="timed out"):
+        gs_auth.whoami("yamada", "secret")
+    assert gs_auth._breaker_failures == 1
+
+def test_server_errors_count_as_failures(gs_server):
+    gs_server.status = 503
+
+    open_breaker()
+    assert len(gs_server.requests) == gs_auth.GS_BREAKER_THRESHOLD
+
+    with pytest.raises(gs_auth.GsUnavailable, match="circuit open"):
+        gs_auth.whoami("yamada", "secret")
+    assert len(gs_server.requests) == gs_auth.GS_BREAKER_THRESHOLD
+
+def test_breaker_half_opens_after_cooldown(gs_server, clock):
+    gs_server.status = 503
+    open_breaker()
+
+    # 遮断時間の経過後は試行を1回許可し、失敗すれば再び遮断する
+    clock.now += gs_auth.GS_BREAKER_RESET
+    with pytest.raises(gs_auth.GsUnavailable, match="status 503"):
+        gs_auth.whoami("yamada", "secret")
+    calls = len(gs_server.requests)
+    with pytest.raises(gs_auth.GsUnavailable, match="circuit open"):
+        gs_auth.whoami("yamada", "secret")
+    assert len(gs_server.requests) == calls
+
+    # 再度の遮断時間の経過後、試行が成功すれば遮断を解除する
+    # （試行の応答待ちの間、他のリクエストは問い合わせずに失敗する）
+    clock.now += gs_auth.GS_BREAKER_RESET
+    gs_server.status = 200
+    gs_server.hold = True
+    result = {}
+    app = Flask(__name__)
+
+    def login():
+        with app.app_context():
+            result.update(gs_auth.whoami("yamada", "secret"))
+
+    trial = threading.Thread(target=login)
+    trial.start()
+    assert gs_server.received.wait(5)
+    with pytest.raises(gs_auth.GsUnavailable, match="circuit open"):
+        gs_auth.whoami("suzuki", "secret")
+    gs_server.release.set()
+    trial.join()
+    assert result["login_id"] == "yamada"
+    assert gs_auth._breaker_failures == 0
+    assert len(gs_server.requests) == calls + 1
+
+    # 解除後は閾値まで失敗しないと遮断しない
+    gs_server.hold = False
+    gs_server.status = 503
+    with pytest.raises(gs_auth.GsUnavailable, match="status 503"):
+        gs_auth.whoami("yamada", "other")
+    with pytest.raises(gs_auth.GsUnavailable, match="status 503"):
+        gs_auth.whoami("yamada", "other2")
@@ -0,0 +1,49 @@
+import io
+import os
+import uuid
+import zipfile
+
+import db
+import storage
+
+
+def add_file(flask_app, upload_dir, box, name, data):
+    file_id = str(uuid.uuid4())
+    os.makedirs(upload_dir / box, exist_ok=True)
+    size, codec = storage.save_encrypted(flask_app.fernet, io.BytesIO(data), str(upload_dir / box / file_id))
+    db.crud.create_file(box, file_id, name, size, codec)
+    return file_id
+
+
+def test_live_zip_is_streamed(flask_app, client, upload_dir):
+    contents = {
+        "a.bin": os.urandom(3 * storage.SEGMENT_SIZE + 10),
+        "b.txt": b"hello\n" * 1000,
+    }
+    with flask_app.app_context():
+        box = db.crud.create_upload_request("box", "2099-12-31", 10, 100, "ssend_admin")
+        for name, data in contents.items():
+            add_file(flask_app, upload_dir, box, name, data)
+        # 復号できないファイルは含めない
+        broken = add_file(flask_app, upload_dir, box, "broken.bin", b"x" * 100)
+        with open(upload_dir / box / broken, "r+b") as f:
+            f.seek(20)
+            f.write(b"!!!!")
+        download_id = db.crud.create_download_request(box, 7, 5, None, None, None)
+        token = db.crud.get_download_request(download_id)["download_token"]
+        db.crud.commit(immediate=True)
+
+    res = client.get(f"/guest_download/{token}/zip", buffered=False)
+    assert res.status_code == 200
+    assert res.mimetype == "application/zip"
+    assert res.is_streamed
+
+    # 作成しながら複数回に分けて送信する（ZIP全体を1つのバッファにしない）
+    chunks = list(res.response)
+    res.close()
+    assert len(chunks) > 3
+
+    with zipfile.ZipFile(io.BytesIO(b"".join(chunks))) as zf:
+        assert sorted(zf.namelist()) == sorted(contents)
+        for name, data in contents.items():
+            assert zf.read(name) == data
@@ -0,0 +1,75 @@
+import threading
+import dataclasses
+from datetime import datetime
+
+import pytest
+
+import db
+import log_events
+import settings
+
+
+def add_log(upload_request_id, action="ファイルダウンロード"):
+    db.crud.save_access_log({
+        "accessed_at": datetime.now().isoformat(),
+        "action": action,
+        "upload_request_id": upload_request_id,
+        "result": "success",
+        "http_status": 200,
+    }, immediate=True)
+
+@pytest.fixture
+def box(app_ctx):
+    return db.crud.create_upload_request("box", "2099-12-31", 10, 100, "ssend_admin")
+
+@pytest.fixture
+def snapshot_settings(monkeypatch):
+    # レポート用スナップショットを使う設定（1時間更新しない）
+    base = settings.get_settings()
+    patched = dataclasses.replace(base, db=dataclasses.replace(base.db, report_snapshot_interval=3600))
+    monkeypatch.setattr(db.connection, "get_settings", lambda: patched)
+
+
+def test_delta_reads_live_db_when_snapshot_is_enabled(app, box, snapshot_settings):
+    # スナップショットを作成してから追加されたログも返す
+    db.connection.refresh_report_snapshot(3600)
+    add_log(box)
+
+    with app.app_context():
+        logs, waited = log_events.wait_for_logs(box, 0, 100, 0)
+    assert [l["upload_request_id"] for l in logs] == [box]
+    assert waited is False
+
+
+def test_wait_returns_when_log_is_added(app, box):
+    def writer():
+        with app.app_context():
+            add_log(box)
+        log_events.notify()
+
+    timer = threading.Timer(0.2, writer)
+    timer.start()
+    try:
+        with app.app_context():
+            logs, waited = log_events.wait_for_logs(box, 0, 100, 5)
+    finally:
+        timer.join()
+    assert len(logs) == 1
+    assert waited is True
+
+
+def test_sync_worker_does_not_wait(login, flask_app):
+    with flask_app.app_context():
+        box = db.crud.create_upload_request("box", "2099-12-31", 10, 100, "ssend_admin")
+
+    # gunicorn の sync ワーカー（wsgi.multithread=False）では待たずに retry_after を返す
+    res = login.get(
+        f"/upload_request/{box}/logs/delta?since_id=0&wait=25",
+        environ_overrides={"wsgi.multithread": False},
+    )
+    assert res.status_code == 200
+    assert res.json["items"] == []
+    assert res.json["retry_after"] == settings.get_settings().log_poll.retry_after
+
+    # 削除されたアップロード依頼は 404（画面側は取得を終える）
+    assert login.get("/upload_request/no-such-box/logs/delta?since_id=0").status_code == 404
@@ -0,0 +1,189 @@
+import socket
+import socketserver
+import threading
+from datetime import datetime, timedelta
+from email import message_from_bytes, policy
+
+import pytest
+
+import db
+import mailer
+
+
+# ------------------------
+# テスト用の SMTP サーバ（空きポートで起動する最小限の実装）
+# ------------------------
+class SmtpServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), SmtpHandler)
+        self.messages = []
+        self.connections = 0
+        # 受信を拒否する宛先
+        self.refused = set()
+        # 1通受信するごとに接続を切る（アイドル切断の再現）
+        self.close_after_message = False
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+class SmtpHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode("ascii") + b"\r\n")
+
+    def handle(self):
+        server = self.server
+        server.connections += 1
+        self.reply("220 localhost ESMTP test")
+        rcpt = []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode("ascii").strip()
+            verb = command.split(" ", 1)[0].upper()
+            if verb in ("EHLO", "HELO"):
+                self.reply("250 localhost")
+            elif verb == "MAIL":
+                rcpt = []
+                self.reply("250 OK")
+            elif verb == "RCPT":
+                address = command.split(":", 1)[1].strip().strip("<>")
+                if address in server.refused:
+                    self.reply("550 No such user")
+                else:
+                    rcpt.append(address)
+                    self.reply("250 OK")
+            elif verb == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                data = []
+                while (line := self.rfile.readline()) not in (b".\r\n", b""):
+                    data.append(line[1:] if line.startswith(b"..") else line)
+                server.messages.append((rcpt, message_from_bytes(b"".join(data), policy=policy.default)))
+                self.reply("250 OK")
+                if server.close_after_message:
+                    return
+            elif verb == "NOOP" or verb == "RSET":
+                self.reply("250 OK")
+            elif verb == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("502 Command not implemented")
+
+
+@pytest.fixture
+def smtp_server():
+    server = SmtpServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+@pytest.fixture
+def refused_port():
+    # 待ち受けていないポート（SMTP 停止中）
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+@pytest.fixture
+def mail_settings(app_ctx, use_settings, monkeypatch):
+    monkeypatch.setattr(mailer, "_smtp", mailer.SmtpConnection())
+
+    def use(port):
+        use_settings("mail", from_address="securesend@example.com", smtp_host="127.0.0.1", smtp_port=port)
+
+    yield use
+    mailer._smtp.close()
+
+def get_mail(mail_id):
+    return db.get_db().execute("SELECT * FROM mail_queue WHERE id = ?", (mail_id,)).fetchone()
+
+def make_due(mail_id):
+    # 再送間隔を待たずに送信対象にする
+    past = (datetime.now() - timedelta(seconds=1)).isoformat()
+    db.get_db().execute("UPDATE mail_queue SET next_attempt_at = ? WHERE id = ?", (past, mail_id))
+    db.get_db().commit()
+
+
+def test_queued_mail_is_delivered_after_smtp_recovers(mail_settings, smtp_server, refused_port):
+    mail_settings(refused_port)
+    mail_id = db.crud.enqueue_mail("guest@example.com", "ワンタイムパスワード", "コード: 123456")
+
+    # SMTP 停止中（接続拒否）は送信できず、再送待ちになる（本文は残す）
+    assert mailer.process_mail_queue() == 1
+    mail = get_mail(mail_id)
+    assert mail["status"] == "pending"
+    assert mail["attempts"] == 1
+    assert mail["next_attempt_at"] > datetime.now().isoformat()
+    assert mail["last_error"]
+    assert "123456" in mail["body"]
+
+    # 再送時刻前は送信しない
+    assert mailer.process_mail_queue() == 0
+
+    # 復旧後に送信される
+    mail_settings(smtp_server.port)
+    make_due(mail_id)
+    assert mailer.process_mail_queue() == 1
+
+    assert len(smtp_server.messages) == 1
+    rcpt, msg = smtp_server.messages[0]
+    assert rcpt == ["guest@example.com"]
+    assert msg["To"] == "guest@example.com"
+    assert "123456" in msg.get_content()
+
+    mail = get_mail(mail_id)
+    assert mail["status"] == "sent"
+    assert mail["attempts"] == 2
+    assert mail["last_error"] is None
+    # 送信後は本文（ワンタイムパスワード）を残さない
+    assert mail["body"] == ""
+
+def test_body_is_cleared_when_retries_are_exhausted(mail_settings, refused_port):
+    mail_settings(refused_port)
+    mail_id = db.crud.enqueue_mail("guest@example.com", "ワンタイムパスワード", "コード: 654321")
+    db.get_db().execute("UPDATE mail_queue SET attempts = ? WHERE id = ?", (mailer.get_settings().mail.max_attempts - 1, mail_id))
+    db.get_db().commit()
+
+    assert mailer.process_mail_queue() == 1
+
+    mail = get_mail(mail_id)
+    assert mail["status"] == "failed"
+    assert mail["last_error"]
+    assert mail["body"] == ""
+
+def test_refused_recipient_is_not_retried(mail_settings, smtp_server):
+    mail_settings(smtp_server.port)
+    smtp_server.refused.add("nobody@example.com")
+    refused = db.crud.enqueue_mail("nobody@example.com", "件名", "本文")
+    delivered = db.crud.enqueue_mail("guest@example.com", "件名", "本文")
+
+    assert mailer.process_mail_queue() == 2
+
+    assert get_mail(refused)["status"] == "failed"
+    assert "No such user" in get_mail(refused)["last_error"]
+    assert get_mail(delivered)["status"] == "sent"
+    assert [rcpt for rcpt, _ in smtp_server.messages] == [["guest@example.com"]]
+
+def test_reconnects_when_server_closed_connection(mail_settings, smtp_server):
+    mail_settings(smtp_server.port)
+    # サーバ側で1通ごとに接続を切る（使い回した接続は切断済み）
+    smtp_server.close_after_message = True
+    first = db.crud.enqueue_mail("guest@example.com", "件名", "1通目")
+    second = db.crud.enqueue_mail("guest@example.com", "件名", "2通目")
+
+    assert mailer.process_mail_queue() == 2
+
+    assert get_mail(first)["status"] == "sent"
+    assert get_mail(second)["status"] == "sent"
+    assert [msg.get_content().strip() for _, msg in smtp_server.messages] == ["1通目", "2通目"]
+    assert smtp_server.connections == 2
@@ -0,0 +1,54 @@
+import pytest
+
+import db
+
+TOKEN = "token"
+MAIL = "guest@example.com"
+
+
+@pytest.fixture
+def otp_ctx(app):
+    app.secret_key = "test-secret"
+    with app.app_context():
+        yield
+
+
+def test_otp_is_stored_hashed_and_usable_once(otp_ctx):
+    db.crud.create_otp(TOKEN, MAIL, "123456")
+
+    # 平文では保存しない
+    assert db.get_db().execute("SELECT otp_code FROM otps").fetchone()[0] != "123456"
+
+    # 他のトークン・メールアドレスでは使えない
+    assert not db.crud.confirm_otp("other", MAIL, "123456")
+    assert not db.crud.confirm_otp(TOKEN, "other@example.com", "123456")
+
+    assert db.crud.confirm_otp(TOKEN, MAIL, "123456")
+    # 一度使用すると無効
+    assert not db.crud.confirm_otp(TOKEN, MAIL, "123456")
+
+def test_otp_is_invalidated_after_max_attempts(otp_ctx):
+    db.crud.create_otp(TOKEN, MAIL, "123456")
+
+    for _ in range(db.crud.OTP_MAX_ATTEMPTS):
+        assert not db.crud.confirm_otp(TOKEN, MAIL, "000000")
+
+    # 上限に達した後は正しいコードでも認証できない
+    assert not db.crud.confirm_otp(TOKEN, MAIL, "123456")
+
+def test_otp_is_usable_below_max_attempts(otp_ctx):
+    db.crud.create_otp(TOKEN, MAIL, "123456")
+
+    for _ in range(db.crud.OTP_MAX_ATTEMPTS - 1):
+        assert not db.crud.confirm_otp(TOKEN, MAIL, "000000")
+
+    assert db.crud.confirm_otp(TOKEN, MAIL, "123456")
+
+def test_expired_otp_is_rejected(otp_ctx):
+    db.crud.create_otp(TOKEN, MAIL, "123456", expire_min=-1)
+
+    assert not db.crud.confirm_otp(TOKEN, MAIL, "123456")
+
+    # 再送したコードは使える
+    db.crud.create_otp(TOKEN, MAIL, "654321")
+    assert db.crud.confirm_otp(TOKEN, MAIL, "654321")
@@ -0,0 +1,55 @@
+import pytest
+
+import db
+
+
+@pytest.fixture
+def box(flask_app):
+    with flask_app.app_context():
+        box = db.crud.create_upload_request("box", "2099-12-31", 10, 100, "ssend_admin")
+        for i in range(5):
+            db.crud.create_file(box, f"file-{i}", f"{i}.txt", 10, None)
+        db.crud.commit(immediate=True)
+    return box
+
+def add_file(flask_app, box, file_id):
+    with flask_app.app_context():
+        db.crud.create_file(box, file_id, f"{file_id}.txt", 10, None)
+        db.crud.commit(immediate=True)
+
+
+def test_files_are_paged_by_cursor(login, box):
+    names = []
+    cursor = None
+    pages = 0
+    while True:
+        query = {"limit": 2} if cursor is None else {"limit": 2, "cursor": cursor}
+        res = login.get(f"/upload_request/{box}/files", query_string=query)
+        assert res.status_code == 200
+        names += [item["original_name"] for item in res.json["items"]]
+        pages += 1
+        cursor = res.json["next_cursor"]
+        if cursor is None:
+            break
+
+    # 重複・欠落なく順に返し、最終ページは next_cursor なし
+    assert names == [f"{i}.txt" for i in range(5)]
+    assert pages == 3
+
+def test_unchanged_page_returns_304(flask_app, login, box):
+    url = f"/upload_request/{box}/files"
+    res = login.get(url, query_string={"limit": 10})
+    etag = res.headers["ETag"]
+    assert "no-cache" in res.headers["Cache-Control"]
+    assert "private" in res.headers["Cache-Control"]
+
+    res = login.get(url, query_string={"limit": 10}, headers={"If-None-Match": etag})
+    assert res.status_code == 304
+    assert res.data == b""
+
+    # 内容が変わったら新しい内容を返す
+    add_file(flask_app, box, "file-new")
+    res = login.get(url, query_string={"limit": 10}, headers={"If-None-Match": etag})
+    assert res.status_code == 200
+    assert res.headers["ETag"] != etag
+    assert res.json["items"][-1]["original_name"] == "file-new.txt"
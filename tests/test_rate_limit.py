@@ -0,0 +1,75 @@
+from types import SimpleNamespace
+
+import pytest
+
+import rate_limit
+from views import internal
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rate_limit, "time", SimpleNamespace(time=clock))
+    return clock
+
+@pytest.fixture
+def login_attempt(client, clock, use_settings, monkeypatch):
+    # GroupSession には問い合わせない（社内ユーザ以外は認証失敗）
+    monkeypatch.setattr(internal, "authenticate_with_gs", lambda username, password: None)
+    use_settings(
+        "rate_limit",
+        enabled=True,
+        ip_burst=100,
+        ip_per_minute=6000,
+        account_burst=3,
+        account_per_minute=60,
+        max_failures=100,
+    )
+
+    def attempt(username="yamada"):
+        return client.post("/login", data={"username": username, "password": "wrong"})
+
+    return attempt
+
+
+def test_burst_then_429_and_refill(login_attempt, clock):
+    for _ in range(3):
+        assert login_attempt().status_code == 200
+
+    res = login_attempt()
+    assert res.status_code == 429
+    assert res.headers["Retry-After"] == "1"
+
+    # 他のログインIDは制限しない
+    assert login_attempt("suzuki").status_code == 200
+
+    # 1秒あたり1回分補充される
+    clock.now += 1
+    assert login_attempt().status_code == 200
+    assert login_attempt().status_code == 429
+
+    # 上限（account_burst）までしか貯まらない
+    clock.now += 60
+    assert [login_attempt().status_code for _ in range(4)] == [200, 200, 200, 429]
+
+def test_lockout_after_failures(login_attempt, clock, use_settings):
+    use_settings("rate_limit", account_burst=100, account_per_minute=6000, max_failures=3, lockout=900)
+
+    for _ in range(3):
+        assert login_attempt().status_code == 200
+
+    # ロック中はトークンが残っていても 429
+    res = login_attempt()
+    assert res.status_code == 429
+    assert int(res.headers["Retry-After"]) == 900
+
+    clock.now += 900
+    assert login_attempt().status_code == 200
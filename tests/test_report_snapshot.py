@@ -0,0 +1,57 @@
+import os
+import sqlite3
+import threading
+
+import pytest
+
+import db
+import db.connection
+import report_snapshot
+
+
+@pytest.fixture
+def snapshot_enabled(use_settings):
+    use_settings("db", report_snapshot_interval=3600)
+
+
+def test_request_does_not_build_snapshot(app_ctx, snapshot_enabled):
+    # 未作成の間は DB を直接参照し、リクエスト中には作成しない
+    assert db.get_report_db().execute("SELECT COUNT(*) FROM users").fetchone()[0] == 1
+    assert not os.path.exists(db.connection.REPORT_DB_PATH)
+
+
+def test_worker_builds_snapshot(app_ctx, snapshot_enabled):
+    report_snapshot.refresh_report_snapshot()
+    assert os.path.exists(db.connection.REPORT_DB_PATH)
+
+    db.close_db()
+    row = db.get_report_db().execute("PRAGMA database_list").fetchone()
+    assert row["file"] == db.connection.REPORT_DB_PATH
+
+
+def test_concurrent_refresh(db_path, tmp_path):
+    start = threading.Barrier(8)
+    errors = []
+
+    def refresh():
+        start.wait()
+        try:
+            # interval=0 は毎回作り直す
+            db.connection.refresh_report_snapshot(0)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=refresh) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert errors == []
+    conn = sqlite3.connect(db.connection.REPORT_DB_PATH)
+    try:
+        assert conn.execute("PRAGMA integrity_check").fetchone()[0] == "ok"
+    finally:
+        conn.close()
+    # 一時ファイルは残らない
+    assert not [p for p in os.listdir(tmp_path) if p.endswith(".tmp")]
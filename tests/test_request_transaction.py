@@ -0,0 +1,52 @@
+import db
+from views import internal
+
+
+def create_box(flask_app):
+    with flask_app.app_context():
+        box = db.crud.create_upload_request("box", "2099-12-31", 10, 100, "ssend_admin")
+        db.crud.commit(immediate=True)
+    return box
+
+def box_exists(flask_app, box):
+    with flask_app.app_context():
+        return db.crud.get_upload_request(box) is not None
+
+def access_logs(flask_app, box):
+    with flask_app.app_context():
+        return [dict(r) for r in db.get_db().execute(
+            "SELECT action, result, http_status FROM access_logs WHERE upload_request_id = ?", (box,)
+        )]
+
+
+def test_writes_are_committed_with_access_log(flask_app, login):
+    box = create_box(flask_app)
+
+    res = login.post("/delete_upload_requests", json={"upload_request_ids": [box]})
+    assert res.status_code == 200
+    assert not box_exists(flask_app, box)
+    assert access_logs(flask_app, box) == [
+        {"action": "ファイルボックス削除", "result": "success", "http_status": 200},
+    ]
+
+
+def test_writes_are_rolled_back_on_server_error(flask_app, login, monkeypatch):
+    box = create_box(flask_app)
+
+    def fail(action, targets):
+        # 削除した後にビューで例外が発生した
+        internal.g.access_log.update(targets[-1])
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(internal, "log_each", fail)
+
+    res = login.post("/delete_upload_requests", json={"upload_request_ids": [box]})
+    assert res.status_code == 500
+
+    # 業務データ（削除・削除キュー）はロールバックされ、アクセスログのみ残る
+    assert box_exists(flask_app, box)
+    with flask_app.app_context():
+        assert db.get_db().execute("SELECT COUNT(*) FROM file_deletions").fetchone()[0] == 0
+    assert access_logs(flask_app, box) == [
+        {"action": None, "result": "error", "http_status": 500},
+    ]
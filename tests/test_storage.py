@@ -0,0 +1,78 @@
+import io
+import os
+
+import pytest
+from cryptography.fernet import Fernet
+
+import storage
+
+# 圧縮できる内容（CSV・ログなど）と圧縮できない内容（画像・ZIPなど）
+TEXT = b"2026-10-19T10:00:00,guest@example.com,download,ok\n" * 30000
+RANDOM = os.urandom(3 * storage.SEGMENT_SIZE + 123)
+
+
+@pytest.fixture
+def fernet():
+    return Fernet(Fernet.generate_key())
+
+def save(fernet, path, data, compress):
+    return storage.save_encrypted(fernet, io.BytesIO(data), str(path), compress)
+
+def head(path):
+    with open(path, "rb") as f:
+        return f.read(len(storage.MAGIC))
+
+
+def test_compressible_file_round_trips_with_zlib(fernet, tmp_path):
+    path = tmp_path / "text"
+    size, codec = save(fernet, path, TEXT, compress=True)
+
+    assert (size, codec) == (len(TEXT), storage.CODEC_ZLIB)
+    assert head(path) == storage.MAGIC_ZLIB
+    assert os.path.getsize(path) < len(TEXT) / 4
+    assert storage.read_decrypted(fernet, str(path)) == TEXT
+
+    # 圧縮したファイルは途中から読めないが、先頭から順に読める
+    with storage.DecryptedReader(fernet, str(path)) as reader:
+        assert not reader.seekable()
+        assert reader.read() == TEXT
+    with pytest.raises(io.UnsupportedOperation):
+        next(storage.iter_decrypted(fernet, str(path), start_segment=1))
+
+def test_incompressible_file_is_stored_as_seg1(fernet, tmp_path):
+    path = tmp_path / "random"
+    size, codec = save(fernet, path, RANDOM, compress=True)
+
+    assert (size, codec) == (len(RANDOM), None)
+    assert head(path) == storage.MAGIC
+    with storage.DecryptedReader(fernet, str(path)) as reader:
+        assert reader.seekable()
+        reader.seek(2 * storage.SEGMENT_SIZE + 5)
+        assert reader.read() == RANDOM[2 * storage.SEGMENT_SIZE + 5:]
+
+def test_existing_seg1_and_legacy_files_are_readable(fernet, tmp_path):
+    # 圧縮対応前に保存された分割暗号化形式（SEG1）
+    seg1 = tmp_path / "seg1"
+    segments = [RANDOM[i:i + storage.SEGMENT_SIZE] for i in range(0, len(RANDOM), storage.SEGMENT_SIZE)]
+    with open(seg1, "wb") as f:
+        f.write(storage.MAGIC)
+        for index, data in enumerate(segments):
+            final = index == len(segments) - 1
+            f.write(fernet.encrypt(storage._SEGMENT_HEADER.pack(index, final) + data) + b"\n")
+
+    assert storage.read_decrypted(fernet, str(seg1)) == RANDOM
+    with storage.DecryptedReader(fernet, str(seg1)) as reader:
+        assert reader.seekable()
+        reader.seek(storage.SEGMENT_SIZE + 1)
+        assert reader.read(10) == RANDOM[storage.SEGMENT_SIZE + 1:storage.SEGMENT_SIZE + 11]
+
+    # ファイル全体で1つのトークンの従来形式
+    legacy = tmp_path / "legacy"
+    legacy.write_bytes(fernet.encrypt(TEXT))
+    assert storage.read_decrypted(fernet, str(legacy)) == TEXT
+
+def test_compress_setting_off_keeps_seg1(fernet, tmp_path):
+    path = tmp_path / "text"
+    assert save(fernet, path, TEXT, compress=False) == (len(TEXT), None)
+    assert head(path) == storage.MAGIC
+    assert storage.read_decrypted(fernet, str(path)) == TEXT
@@ -0,0 +1,150 @@
+import io
+import os
+
+import pytest
+from werkzeug.test import EnvironBuilder
+
+import db
+import storage
+
+KB = 1024
+
+
+class CountingStream(io.BytesIO):
+    """読み込まれたバイト数を数える本文"""
+
+    def __init__(self, data):
+        super().__init__(data)
+        self.read_bytes = 0
+
+    def read(self, size=-1):
+        data = super().read(size)
+        self.read_bytes += len(data)
+        return data
+
+    def readline(self, size=-1):
+        data = super().readline(size)
+        self.read_bytes += len(data)
+        return data
+
+
+@pytest.fixture
+def box(flask_app):
+    # 最大3ファイル・合計1MB
+    with flask_app.app_context():
+        box = db.crud.create_upload_request("box", "2099-12-31", 3, 1, "ssend_admin")
+        db.crud.commit(immediate=True)
+    return box
+
+def upload(client, box, name, data):
+    return client.post(f"/upload/{box}", data={"file": (io.BytesIO(data), name)})
+
+def stored_files(flask_app, upload_dir, box):
+    # 保存先フォルダの中身と、登録されているファイル
+    with flask_app.app_context():
+        rows = {f["file_id"]: f for f in db.crud.list_files(box)}
+    names = sorted(os.listdir(upload_dir / box)) if os.path.isdir(upload_dir / box) else []
+    return names, rows
+
+
+def test_upload_is_encrypted_into_box_folder(flask_app, login, upload_dir, box):
+    data = os.urandom(300 * KB)
+
+    res = upload(login, box, "a.bin", data)
+    assert res.status_code == 200
+    file_id = res.json["file_id"]
+
+    # 一時ファイルを残さず、暗号化した実体だけを保存する
+    names, rows = stored_files(flask_app, upload_dir, box)
+    assert names == [file_id]
+    assert rows[file_id]["original_name"] == "a.bin"
+    assert rows[file_id]["file_size"] == len(data)
+    with open(upload_dir / box / file_id, "rb") as f:
+        assert data[:64] not in f.read()
+    assert storage.read_decrypted(flask_app.fernet, str(upload_dir / box / file_id)) == data
+
+def test_quota_overflow_while_receiving_returns_413(flask_app, login, upload_dir, box):
+    first = upload(login, box, "a.bin", os.urandom(600 * KB)).json["file_id"]
+
+    # Content-Length では判定できない（上書きで空く分を見込むと入り得る）ため、受信中に打ち切る
+    res = upload(login, box, "b.bin", os.urandom(500 * KB))
+    assert res.status_code == 413
+
+    # 受信途中の実体・一時ファイルは残らない
+    names, rows = stored_files(flask_app, upload_dir, box)
+    assert names == [first]
+    assert list(rows) == [first]
+
+def test_oversize_upload_is_rejected_before_receiving(flask_app, login, upload_dir, box):
+    environ = EnvironBuilder(method="POST", data={"file": (io.BytesIO(os.urandom(2 * KB * KB)), "big.bin")}).get_environ()
+    body = CountingStream(environ["wsgi.input"].read())
+
+    res = login.post(
+        f"/upload/{box}",
+        input_stream=body,
+        content_type=environ["CONTENT_TYPE"],
+        content_length=len(body.getvalue()),
+    )
+    assert res.status_code == 413
+    # 本文は受信しない
+    assert body.read_bytes == 0
+    assert stored_files(flask_app, upload_dir, box) == ([], {})
+
+def test_same_name_upload_reuses_its_space(flask_app, login, upload_dir, box):
+    upload(login, box, "a.bin", os.urandom(800 * KB))
+
+    # 上書きする場合は既存ファイルの分も使える
+    data = os.urandom(900 * KB)
+    res = upload(login, box, "a.bin", data)
+    assert res.status_code == 200
+
+    names, rows = stored_files(flask_app, upload_dir, box)
+    assert names == [res.json["file_id"]]
+    assert storage.read_decrypted(flask_app.fernet, str(upload_dir / box / names[0])) == data
+
+def test_file_count_limit_returns_403(flask_app, login, upload_dir, box):
+    for name in ("a.txt", "b.txt", "c.txt"):
+        assert upload(login, box, name, b"x").status_code == 200
+
+    res = upload(login, box, "d.txt", b"x")
+    assert res.status_code == 403
+    assert len(stored_files(flask_app, upload_dir, box)[0]) == 3
+
+    quota = login.get(f"/upload/{box}/quota").json
+    assert quota["remaining_files"] == 0
+    assert quota["remaining_bytes"] == KB * KB - 3
+    assert quota["files"] == {"a.txt": 1, "b.txt": 1, "c.txt": 1}
+
+def test_batch_upload_returns_result_per_file(flask_app, login, upload_dir, box):
+    data = {
+        "a.txt": b"a" * 100,
+        "big.bin": os.urandom(1100 * KB),
+        "b.txt": b"b" * 100,
+        "c.txt": b"c" * 100,
+        "d.txt": b"d" * 100,
+    }
+    res = login.post(f"/upload/{box}/batch", data={
+        "file": [(io.BytesIO(content), name) for name, content in data.items()],
+    })
+    assert res.status_code == 200
+
+    # 入りきらないファイルだけをエラーにして、残りは登録する
+    results = {r["name"]: r for r in res.json["results"]}
+    assert list(results) == list(data)
+    assert results["big.bin"]["error"] == "合計ファイルサイズの上限に達しています"
+    assert results["d.txt"]["error"] == "最大ファイル数に達しています"
+    saved = {name: r["file"]["file_id"] for name, r in results.items() if r.get("error") is None}
+    assert list(saved) == ["a.txt", "b.txt", "c.txt"]
+
+    names, rows = stored_files(flask_app, upload_dir, box)
+    assert names == sorted(saved.values())
+    for name, file_id in saved.items():
+        assert rows[file_id]["original_name"] == name
+        assert storage.read_decrypted(flask_app.fernet, str(upload_dir / box / file_id)) == data[name]
+
+    # アクセスログは登録したファイルごとに残す
+    with flask_app.app_context():
+        logged = [r["file_id"] for r in db.get_db().execute(
+            "SELECT file_id FROM access_logs WHERE upload_request_id = ? ORDER BY id", (box,)
+        )]
+    assert logged == list(saved.values())
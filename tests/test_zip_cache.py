@@ -0,0 +1,89 @@
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+from cryptography.fernet import Fernet
+
+import db
+import storage
+import zip_cache
+
+
+@pytest.fixture
+def box(app_ctx, use_settings):
+    use_settings("zip", cache_enabled=True, cache_build_delay=0)
+    return db.crud.create_upload_request("box", "2099-12-31", 10, 100, "ssend_admin")
+
+def claim():
+    now = datetime.now() + timedelta(seconds=1)
+    return db.crud.claim_zip_build(now, now - timedelta(seconds=zip_cache.ZIP_BUILD_TIMEOUT))
+
+def builds():
+    return [dict(r) for r in db.get_db().execute("SELECT upload_request_id, status FROM zip_builds")]
+
+
+def test_claimed_build_is_not_claimed_or_requeued_twice(box):
+    db.crud.request_zip_build(box)
+    upload_request_id, requested_at = claim()
+    assert upload_request_id == box
+
+    # 作成中は他のワーカーが取得しない
+    assert claim() is None
+    # キャッシュがない場合の依頼（lookup）は作成中の依頼を作り直さない
+    db.crud.request_zip_build(box, delay=False)
+    assert builds() == [{"upload_request_id": box, "status": "building"}]
+    assert claim() is None
+
+    db.crud.finish_zip_build(box, requested_at)
+    assert builds() == []
+
+
+def test_change_during_build_is_requeued(box):
+    db.crud.request_zip_build(box)
+    _, requested_at = claim()
+
+    # 作成中にファイル構成が変わった
+    db.crud.request_zip_build(box)
+    assert claim() is None
+
+    db.crud.finish_zip_build(box, requested_at)
+    assert builds() == [{"upload_request_id": box, "status": "pending"}]
+    assert claim()[0] == box
+
+
+def test_stale_build_is_claimed_again(box):
+    db.crud.request_zip_build(box)
+    claim()
+
+    # 作成中のまま ZIP_BUILD_TIMEOUT を過ぎた依頼は取得し直す
+    later = datetime.now() + timedelta(seconds=zip_cache.ZIP_BUILD_TIMEOUT + 1)
+    assert db.crud.claim_zip_build(later, later - timedelta(seconds=zip_cache.ZIP_BUILD_TIMEOUT))[0] == box
+
+
+def test_no_request_when_cache_disabled(box, use_settings):
+    use_settings("zip", cache_enabled=False)
+    db.crud.request_zip_build(box)
+    assert builds() == []
+
+
+def test_concurrent_writers_do_not_share_temp_file(tmp_path):
+    fernet = Fernet(Fernet.generate_key())
+    path = str(tmp_path / "box-version")
+    contents = [bytes([i]) * (3 * storage.SEGMENT_SIZE + 123) for i in (1, 2)]
+    start = threading.Barrier(len(contents))
+
+    def write(data):
+        with storage.EncryptedWriter(fernet, path) as dst:
+            start.wait()
+            for i in range(0, len(data), 4096):
+                dst.write(data[i:i + 4096])
+
+    threads = [threading.Thread(target=write, args=(data,)) for data in contents]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    # どちらか一方の内容がそのまま残り、一時ファイルは残らない
+    assert storage.read_decrypted(fernet, path) in contents
+    assert [p.name for p in tmp_path.iterdir()] == ["box-version"]
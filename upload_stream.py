@@ -0,0 +1,275 @@
+import io
+import os
+import uuid
+import threading
+
+from flask import Request, Response, abort, current_app, g, request
+
+import db
+import storage
+from paths import UPLOAD_DIR
+from settings import get_settings
+
+# ------------------------
+# 設定
+# ------------------------
+# multipart の境界・ヘッダ・CSRFトークンなど、ファイル以外の分として許容するサイズ
+MULTIPART_OVERHEAD = 64 * 1024
+
+# ファイル数・合計サイズの確認とファイル登録（コミットまで）をまとめて行うためのロック
+# （画面・ゲスト・API のアップロードで共通）
+upload_lock = threading.Lock()
+
+def reject(message, status):
+    # Dropzone にそのまま表示されるようテキストで返す
+    abort(Response(message, status, mimetype="text/plain"))
+
+# ------------------------
+# ファイルボックスの残り容量
+# ------------------------
+class UploadQuota:
+    """
+    ファイルボックスの残り（ファイル数・合計サイズ）。
+    同じ名前のファイルは上書きされるため、そのファイルの分は空きとして扱う。
+    """
+
+    def __init__(self, upload_request, files):
+        self.max_files = upload_request["max_files"]
+        self.max_bytes = upload_request["max_total_size"] * 1024 * 1024
+        self.sizes = {f["original_name"]: f["file_size"] for f in files}
+        self.file_count = len(files)
+        self.used_bytes = sum(f["file_size"] for f in files)
+
+    @classmethod
+    def of(cls, upload_request):
+        return cls(upload_request, db.crud.list_files(upload_request["id"]))
+
+    @property
+    def remaining_files(self):
+        return self.max_files - self.file_count
+
+    @property
+    def remaining_bytes(self):
+        return self.max_bytes - self.used_bytes
+
+    def check_content_length(self, content_length):
+        """本文を受信する前の確認（上書きで空く分を最大限見込んでも入らない場合のみ拒否）"""
+        if content_length is None:
+            return
+        if content_length > self.remaining_bytes + max(self.sizes.values(), default=0) + MULTIPART_OVERHEAD:
+            reject("合計ファイルサイズの上限に達しています", 413)
+
+    def limit_for(self, filename):
+        """filename のファイルに使えるサイズ（ファイル数の上限に達している場合は None）"""
+        replaced = self.sizes.get(filename)
+        if replaced is None and self.remaining_files <= 0:
+            return None
+        return self.remaining_bytes + (replaced or 0)
+
+    def add(self, filename, size):
+        replaced = self.sizes.get(filename)
+        if replaced is None:
+            self.file_count += 1
+        self.used_bytes += size - (replaced or 0)
+        self.sizes[filename] = size
+
+# ------------------------
+# 受信中のアップロードファイル
+# ------------------------
+class IncomingFile(storage.EncryptedWriter):
+    """
+    multipart のファイル部分1件分。受信したデータをそのまま暗号化して保存先に書き込む
+    （一時ファイルへの退避・メモリへの読み込みをしない）。
+    受信量が limit を超えた時点で受信を打ち切る（partial の場合はこのファイルだけ捨てて error に理由を残す）。
+    """
+
+    def __init__(self, fernet, upload_dir, filename, limit, on_complete, partial=False):
+        self.file_id = str(uuid.uuid4())
+        self.path = os.path.join(upload_dir, self.file_id)
+        self.filename = filename
+        self.error = None
+        self._limit = limit
+        self._on_complete = on_complete
+        self._partial = partial
+        super().__init__(fernet, self.path, compress=get_settings().upload.compress)
+
+    def reject(self, message, status):
+        if not self._partial:
+            reject(message, status)
+        # 残りのデータは読み捨てる
+        self.error = message
+        self.abort()
+
+    def write(self, b):
+        if self.error:
+            return len(b)
+        if self.size + len(b) > self._limit:
+            self.reject("合計ファイルサイズの上限に達しています", 413)
+            return len(b)
+        return super().write(b)
+
+    def seekable(self):
+        return False
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        # フォームパーサはファイル部分の受信完了時に seek(0) を呼ぶので、ここで保存を確定する
+        if offset != 0 or whence != io.SEEK_SET:
+            raise io.UnsupportedOperation("incoming file is not seekable")
+        if not self.closed and not self.error:
+            self.close()
+            self._on_complete(self)
+        return 0
+
+# ------------------------
+# 保存先（リクエストごと）
+# ------------------------
+class UploadTarget:
+    """
+    受信したファイルをファイルボックスのフォルダに保存する。
+    keep() されなかったファイル（上限超過・エラー時など）はリクエスト終了時に削除する。
+    partial の場合、上限を超えたファイルがあってもリクエストは拒否しない（ファイルごとに結果を返す場合）。
+    """
+
+    def __init__(self, fernet, upload_request, partial=False):
+        self.fernet = fernet
+        self.partial = partial
+        self.upload_dir = os.path.join(UPLOAD_DIR, upload_request["id"])
+        self.quota = UploadQuota.of(upload_request)
+        self.files = []
+        self._kept = set()
+
+    def open(self, filename):
+        os.makedirs(self.upload_dir, exist_ok=True)
+        limit = self.quota.limit_for(filename)
+        incoming = IncomingFile(self.fernet, self.upload_dir, filename, limit or 0, self._completed, self.partial)
+        self.files.append(incoming)
+        if limit is None:
+            incoming.reject("最大ファイル数に達しています", 403)
+        return incoming
+
+    def _completed(self, incoming):
+        # 同じリクエストの後続ファイルの上限に反映する
+        self.quota.add(incoming.filename, incoming.size)
+
+    def keep(self, incoming):
+        self._kept.add(incoming.file_id)
+
+    def discard(self):
+        for incoming in self.files:
+            if incoming.file_id in self._kept:
+                continue
+            if not incoming.closed:
+                incoming.abort()
+            if os.path.exists(incoming.path):
+                os.remove(incoming.path)
+
+def streaming_upload(get_upload_request, partial=False):
+    """
+    ビューのデコレータ。request.files のファイルを get_upload_request(URL変数) が返す
+    ファイルボックスのフォルダに暗号化しながら保存する（None を返した場合は保存しない）。
+    CSRF チェックなどビューより前にフォームが読み込まれる場合も同じ保存先を使う。
+    各ファイルの stream は IncomingFile（file_id・size で保存先と平文サイズが分かる）。
+    partial=True の場合は上限を超えたファイルだけを捨て、stream.error に理由を残す。
+    """
+    def decorator(view):
+        view.get_upload_request = get_upload_request
+        view.partial_upload = partial
+        return view
+    return decorator
+
+def current_target():
+    """
+    保存先を返す。初回呼び出し時（本文の受信前）に Content-Length と残り容量を比較し、
+    入りきらない場合は受信せずに 413 を返す（partial の場合は入るファイルがあり得るため比較しない）。
+    """
+    if "upload_target" not in g:
+        view = current_app.view_functions.get(request.endpoint)
+        get_upload_request = getattr(view, "get_upload_request", None)
+        upload_request = get_upload_request(*request.view_args.values()) if get_upload_request else None
+
+        g.upload_target = None
+        if upload_request is not None:
+            partial = getattr(view, "partial_upload", False)
+            g.upload_target = UploadTarget(current_app.fernet, upload_request, partial)
+            if not partial:
+                g.upload_target.quota.check_content_length(request.content_length)
+    return g.upload_target
+
+# ------------------------
+# 受信したファイルの登録
+# ------------------------
+def save_files(upload_request, target, files):
+    """
+    受信したファイル（request.files の FileStorage）をファイルボックスに登録する（呼び出し側で upload_lock を取得する）。
+    ファイル数・合計サイズはまとめて1回確認して先頭から順に割り当て、入りきらないファイルはエラーにする。
+    登録は1トランザクションでロック内で即時コミットする（後続のアップロードの確認に反映するため）。
+    戻り値: ファイルごとの {"name", "file"（files の行）, "error"} のリスト
+    """
+    upload_id = upload_request["id"]
+    uploaded_files = db.crud.list_files(upload_id)
+    quota = UploadQuota(upload_request, uploaded_files)
+    existing = {f["original_name"]: f["file_id"] for f in uploaded_files}
+
+    results = []
+    for file in files:
+        incoming = file.stream
+        result = {"name": file.filename, "file": None, "error": None}
+        results.append(result)
+
+        # 受信中に上限を超えたファイル
+        if incoming.error:
+            result["error"] = incoming.error
+            continue
+
+        # アップロードファイル数チェック・アップロード可能ファイルサイズチェック
+        replaced = quota.sizes.get(file.filename)
+        if replaced is None and quota.remaining_files <= 0:
+            result["error"] = "最大ファイル数に達しています"
+            continue
+        if incoming.size - (replaced or 0) > quota.remaining_bytes:
+            result["error"] = "合計ファイルサイズの上限に達しています"
+            continue
+        quota.add(file.filename, incoming.size)
+
+        # 受信したファイルを残す（エラーのファイルはリクエスト終了時に削除される）
+        target.keep(incoming)
+
+        # 同一ファイル名は上書き（既存ファイルの実体とレコードを削除）
+        old_file_id = existing.get(file.filename)
+        if old_file_id:
+            old_path = os.path.join(target.upload_dir, old_file_id)
+            if os.path.exists(old_path):
+                os.remove(old_path)
+            db.crud.delete_file(old_file_id)
+
+        db.crud.create_file(upload_id, incoming.file_id, file.filename, incoming.size, incoming.codec)
+        existing[file.filename] = incoming.file_id
+
+    db.crud.commit(immediate=True)
+
+    # 同じ名前のファイルが複数ある場合は最後のファイルが残る
+    rows = {f["original_name"]: f for f in db.crud.list_files(upload_id)}
+    for result in results:
+        if result["error"] is None:
+            result["file"] = rows.get(result["name"])
+    return results
+
+# ------------------------
+# リクエストクラス
+# ------------------------
+class StreamingUploadRequest(Request):
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        target = current_target()
+        if target is None:
+            return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+        return target.open(filename)
+
+def _discard_unused(exc):
+    target = g.pop("upload_target", None)
+    if target is not None:
+        target.discard()
+
+def init_app(app):
+    app.request_class = StreamingUploadRequest
+    app.teardown_request(_discard_unused)
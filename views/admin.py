@@ -36,6 +36,7 @@ from flask_session import Session
 from paths import CONFIG_PATH, UPLOAD_DIR, DB_PATH
 from views.filters import format_datetime, format_filesize, format_mask_email
 import db
+import settings as app_settings
 
 # ------------------------
 # 設定
@@ -112,7 +113,7 @@ def file_boxes():
 
     # アップロード依頼リスト取得
     user_id = session["user_id"]
-    upload_requests, total = db.crud.list_upload_requests(per_page=per_page, offset=offset)
+    upload_requests, total = db.crud.list_upload_requests(per_page=per_page, offset=offset, report=True)
     total_pages = max(1, math.ceil(total / per_page))
 
     return render_template(
@@ -137,12 +138,8 @@ def access_logs():
     offset = (page - 1) * per_page
 
     # 総件数
-    with sqlite3.connect(DB_PATH) as conn:
-        conn.row_factory = sqlite3.Row
-        cur = conn.cursor()
-        cur.execute("SELECT COUNT(*) FROM access_logs")
-        total = cur.fetchone()[0]
-        total_pages = max(1, math.ceil(total / per_page))
+    total = db.crud.count_access_logs()
+    total_pages = max(1, math.ceil(total / per_page))
 
     # ログ取得
     logs = db.crud.list_access_logs(per_page, offset)
@@ -162,28 +159,21 @@ def access_logs():
 @admin_required
 def settings():
 
-    config = configparser.ConfigParser()
-    config.read(CONFIG_PATH, encoding="utf-8")
-
     if request.method == "POST":
         from_address = request.form.get("from_address", "").strip()
 
         # 最低限のバリデーション
         if not re.match(r"^[^@]+@[^@]+\.[^@]+$", from_address):
             flash("メールアドレスの形式が正しくありません", "danger")
-            return redirect(url_for("settings_mail"))
-
-        if not config.has_section("mail"):
-            config.add_section("mail")
+            return redirect(url_for("admin.settings"))
 
-        config.set("mail", "from_address", from_address)
-        with open(CONFIG_PATH, "w", encoding="utf-8") as f:
-            config.write(f)
+        # 設定ファイル保存（他ワーカーはファイル更新日時の変化で再読込する）
+        app_settings.save_settings("mail", {"from_address": from_address})
 
         flash("設定を保存しました", "success")
         return redirect(url_for("admin.settings"))
 
-    from_address = config.get("mail", "from_address", fallback="")
+    from_address = app_settings.get_settings().mail.from_address
 
     return render_template(
         "admin_settings.html",
@@ -0,0 +1,159 @@
+# gs_auth.py
+import hmac
+import hashlib
+import secrets
+import threading
+import time
+import xml.etree.ElementTree as ET
+
+import requests
+from requests.adapters import HTTPAdapter
+from flask import current_app
+
+from paths import GS_WHOAMI_URL
+
+# ------------------------
+# 設定
+# ------------------------
+# タイムアウト（接続, 読み込み）秒
+GS_TIMEOUT = (2, 5)
+# 認証成功結果のキャッシュ時間（秒）
+GS_CACHE_TTL = 60
+# キャッシュの最大件数
+GS_CACHE_MAX_ENTRIES = 1000
+# 連続エラーがこの回数に達したら遮断する
+GS_BREAKER_THRESHOLD = 5
+# 遮断時間（秒）
+GS_BREAKER_RESET = 30
+
+class GsUnavailable(Exception):
+    """GroupSession に接続できない（または遮断中）"""
+
+# ------------------------
+# HTTP接続プール（Keep-Alive）
+# ------------------------
+_http = requests.Session()
+_http.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=10, max_retries=0))
+_http.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=10, max_retries=0))
+
+# ------------------------
+# 認証結果キャッシュ
+# ------------------------
+# キーは ID/パスワードのソルト付きハッシュ（平文は保持しない）
+_cache_salt = secrets.token_bytes(32)
+_cache = {}
+_cache_lock = threading.Lock()
+
+def _cache_key(username, password):
+    message = f"{username}\0{password}".encode("utf-8")
+    return hmac.new(_cache_salt, message, hashlib.sha256).digest()
+
+def _cache_get(key):
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry is None:
+            return None
+        expires_at, user = entry
+        if expires_at < time.monotonic():
+            del _cache[key]
+            return None
+        return user
+
+def _cache_put(key, user):
+    now = time.monotonic()
+    with _cache_lock:
+        if len(_cache) >= GS_CACHE_MAX_ENTRIES:
+            # 期限切れを削除しても空かなければ古いものから削除
+            for k in [k for k, (exp, _) in _cache.items() if exp < now]:
+                del _cache[k]
+            while len(_cache) >= GS_CACHE_MAX_ENTRIES:
+                del _cache[next(iter(_cache))]
+        _cache[key] = (now + GS_CACHE_TTL, user)
+
+# ------------------------
+# サーキットブレーカー
+# ------------------------
+_breaker_lock = threading.Lock()
+_breaker_failures = 0
+_breaker_open_until = 0.0
+
+def _breaker_allow():
+    # 遮断中は即失敗。遮断時間経過後は1件だけ試行を許可し（半開）、結果が出るまで他は即失敗
+    global _breaker_open_until
+    with _breaker_lock:
+        now = time.monotonic()
+        if now < _breaker_open_until:
+            return False
+        if _breaker_failures >= GS_BREAKER_THRESHOLD:
+            # 試行がタイムアウトするまでの間だけ遮断を延長する
+            _breaker_open_until = now + sum(GS_TIMEOUT)
+        return True
+
+def _breaker_success():
+    global _breaker_failures, _breaker_open_until
+    with _breaker_lock:
+        _breaker_failures = 0
+        _breaker_open_until = 0.0
+
+def _breaker_failure():
+    global _breaker_failures, _breaker_open_until
+    with _breaker_lock:
+        _breaker_failures += 1
+        if _breaker_failures >= GS_BREAKER_THRESHOLD:
+            _breaker_open_until = time.monotonic() + GS_BREAKER_RESET
+
+# ------------------------
+# GSユーザ情報取得
+# ------------------------
+def whoami(username, password):
+    """
+    GroupSession で認証してユーザ情報を返す。
+
+    戻り値: {"login_id", "name", "mail"}（認証失敗時は None）
+    例外: GsUnavailable（接続エラー・サーバエラー・遮断中）
+    """
+    key = _cache_key(username, password)
+    user = _cache_get(key)
+    if user is not None:
+        return user
+
+    if not _breaker_allow():
+        raise GsUnavailable("circuit open")
+
+    try:
+        response = _http.get(
+            GS_WHOAMI_URL,
+            auth=(username, password),
+            timeout=GS_TIMEOUT
+        )
+    except requests.RequestException as e:
+        _breaker_failure()
+        raise GsUnavailable(str(e)) from e
+
+    if response.status_code >= 500:
+        _breaker_failure()
+        raise GsUnavailable(f"status {response.status_code}")
+
+    _breaker_success()
+
+    # ユーザ情報が取得できなければ認証失敗
+    if response.status_code != 200:
+        return None
+
+    current_app.logger.info(response.text)
+
+    # ユーザー情報から名前とメールアドレスを取得
+    root = ET.fromstring(response.text)
+    result = root.find("Result")
+    if result is None:
+        return None
+    name_sei = result.findtext("NameSei") or ""
+    name_mei = result.findtext("NameMei") or ""
+    user = {
+        "login_id": result.findtext("LoginId"),
+        "name": f"{name_sei} {name_mei}".strip(),
+        "mail": result.findtext("Mail1") or "",
+    }
+
+    _cache_put(key, user)
+    return user
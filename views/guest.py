@@ -1,12 +1,9 @@
 import os
 import uuid
-import io
 import math
-import zipfile
 from datetime import date, datetime, timedelta
 from functools import wraps
 import requests
-import threading
 import json
 import configparser
 import re
@@ -33,13 +30,25 @@ from flask_session import Session
 
 from paths import CONFIG_PATH, UPLOAD_DIR, DB_PATH
 from views.filters import format_datetime, format_filesize, format_mask_email
+from views import schemas
+from views.internal import log_each
 import db
+import mailer
+import admission
+import storage
+import upload_stream
+import rate_limit
+import zip_cache
+from settings import get_settings
 
 # ------------------------
 # 設定
 # ------------------------
 guest_bp = Blueprint("guest", __name__)
 
+# セッションに保持する認証済みトークン数の上限
+MAX_AUTHENTICATED_TOKENS = 20
+
 # ------------------------
 # ゲスト認証必須デコレータ
 # ------------------------
@@ -87,6 +96,30 @@ def guestauth_required(view):
         return view(*args, **kwargs)
     return wrapped
 
+# ------------------------
+# 認証済みトークンをセッションに記録
+# ------------------------
+def remember_authenticated_token(token, user_id=None):
+    # 古いものから捨てて上限件数までに抑える
+    authenticated_tokens = [
+        t for t in session.get("authenticated_tokens", []) if t != token
+    ]
+    authenticated_tokens.append(token)
+    authenticated_tokens = authenticated_tokens[-MAX_AUTHENTICATED_TOKENS:]
+
+    guest_auth = {
+        t: info for t, info in session.get("guest_auth", {}).items()
+        if t in authenticated_tokens
+    }
+    if user_id:
+        guest_auth[token] = {
+            "user_id": user_id
+        }
+
+    session.permanent = True
+    session["authenticated_tokens"] = authenticated_tokens
+    session["guest_auth"] = guest_auth
+
 # ------------------------
 # ゲスト認証画面
 # ------------------------
@@ -107,17 +140,18 @@ def guest_auth(token):
         })
 
     auth_type = auth["auth_type"]
-    authenticated_tokens = session.get("authenticated_tokens", [])
 
     if request.method == "POST":
+        # 試行回数制限（IP・トークン単位）
+        rate_key = f"guest:{token}"
+        rate_limit.check(rate_key, "ゲスト認証")
+
         # パスワード認証
         if auth_type == "pass":
             input_password = request.form.get("password", "")
             if input_password == auth["auth_password"]:
-                if token not in authenticated_tokens:
-                    authenticated_tokens.append(token)                
-                session.permanent = True
-                session["authenticated_tokens"] = authenticated_tokens
+                remember_authenticated_token(token)
+                rate_limit.succeeded(rate_key)
 
                 # アクセスログ
                 if hasattr(g, "access_log"):
@@ -127,10 +161,12 @@ def guest_auth(token):
 
                 return redirect(url_for("guest.guest_download", token=token))
             else:
+                locked = rate_limit.failed(rate_key)
+
                 # アクセスログ
                 if hasattr(g, "access_log"):
                     g.access_log.update({
-                        "action": "ゲスト認証 NG",
+                        "action": "ゲスト認証 NG（ロック）" if locked else "ゲスト認証 NG",
                     })
 
                 error = "パスワードが違います"
@@ -178,16 +214,8 @@ def guest_auth(token):
                 otpcode = request.form.get("otpcode", "")
                 
                 if db.crud.confirm_otp(token, mail_address, otpcode):
-                    if token not in authenticated_tokens:
-                        authenticated_tokens.append(token)
-                    session.permanent = True
-                    session["authenticated_tokens"] = authenticated_tokens
-
-                    guest_auth = session.get("guest_auth", {})
-                    guest_auth[token] = {
-                        "user_id": mail_address
-                    }
-                    session["guest_auth"] = guest_auth
+                    remember_authenticated_token(token, mail_address)
+                    rate_limit.succeeded(rate_key)
 
                     # アクセスログ
                     if hasattr(g, "access_log"):
@@ -198,11 +226,13 @@ def guest_auth(token):
 
                     return redirect(url_for("guest.guest_download", token=token))
                 else:
+                    locked = rate_limit.failed(rate_key)
+
                     # アクセスログ
                     if hasattr(g, "access_log"):
                         g.access_log.update({
                             "user_id": mail_address,
-                            "action": "ゲスト認証 NG",
+                            "action": "ゲスト認証 NG（ロック）" if locked else "ゲスト認証 NG",
                         })
 
                     error = "ワンタイムパスワードが正しくありません"
@@ -223,30 +253,17 @@ def extract_emails(text):
     # findallで全ての一致をリストで取得
     return re.findall(pattern, text)
 
-import random
+import secrets
 def generate_otp(length=6):
-    return f"{random.randint(0, 10**length - 1):0{length}d}"
+    return f"{secrets.randbelow(10**length):0{length}d}"
 
-import smtplib
-from email.message import EmailMessage
-from email.headerregistry import Address
 def send_otp_email(to_email, otp_code):
 
-    # コンフィグから送信元メールアドレス取得
-    config = configparser.ConfigParser()
-    config.read(CONFIG_PATH, encoding="utf-8")
-    from_address = config.get("mail", "from_address", fallback="")
-
-    msg = EmailMessage()
-    msg["Subject"] = "ファイルダウンロード用ワンタイムパスワード"
-    username, domain = from_address.split("@", 1)
-    msg["From"] = Address(
-        display_name="Secure Send",
-        username=username,
-        domain=domain,
-    )
-    msg["To"] = to_email
-    msg.set_content(f"""
+    # 送信キューに登録（送信元アドレスの設定・SMTP送信は送信スレッドで行う）
+    mailer.send_mail(
+        to_email,
+        "ファイルダウンロード用ワンタイムパスワード",
+        f"""
 本人確認のため、以下の認証コードを認証画面で入力してください。
 
 ----------------------------------------------------------------------------------------
@@ -264,10 +281,8 @@ def send_otp_email(to_email, otp_code):
 
 ※ このメールは配信専用のアドレスから送信されています。
 　本メールへの返信はできません。
-    """.strip())
-
-    with smtplib.SMTP("mail.system-prostage.co.jp", 25) as smtp:
-        smtp.send_message(msg)
+    """.strip(),
+    )
 
 # ------------------------
 # ゲスト向けダウンロード一覧画面
@@ -356,26 +371,26 @@ def guest_download_file(token, file_id):
     if not os.path.exists(file_path):
         abort(404)
 
-    # ダウンロード回数チェック
-    current_count = db.crud.get_file_download_count(download_request["id"], file_id)
-    if current_count >= download_request["max_downloads"]:
-        abort(403, description="ダウンロード回数の上限に達しました")
+    # 同時転送数・転送量の制限（上限時は 503）
+    admission.acquire("download", file_row["file_size"])
 
-    # ダウンロード回数更新
-    db.crud.increment_file_download_count(download_request["id"], file_id)
-
-    # 暗号化ファイルを読み込み
-    with open(file_path, "rb") as f:
-        encrypted_data = f.read()
-
-    # 複合化
-    decrypted_data = current_app.fernet.decrypt(encrypted_data)
+    # ダウンロード回数チェック・更新（同時リクエスト対策で1文で実施）
+    download_count = db.crud.increment_file_download_count(
+        download_request["id"],
+        file_id,
+        download_request["max_downloads"]
+    )
+    if download_count is None:
+        abort(403, description="ダウンロード回数の上限に達しました")
 
-    return send_file(
-        io.BytesIO(decrypted_data),
+    # 復号しながら送信（セグメント単位で復号し、ファイル全体をメモリに載せない）
+    response = send_file(
+        storage.DecryptedReader(current_app.fernet, file_path),
         as_attachment=True,
         download_name=file_row["original_name"]
     )
+    response.content_length = file_row["file_size"]
+    return response
 
 # ------------------------
 # ゲスト向けファイル一括ダウンロード
@@ -406,52 +421,45 @@ def guest_download_zip(token):
     if not files:
         abort(404)
 
-    # ダウンロード回数チェック
+    # 同時転送数・転送量の制限（上限時は 503）
+    admission.acquire("zip", sum(f["file_size"] for f in files))
+
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    zip_name = f"ssend_download_{timestamp}.zip"
+
+    # 作成済みZIP（ファイル構成が同じもの）
+    cached_zip = zip_cache.lookup(download_request["upload_request_id"], files)
+
+    # 中断したダウンロードの再開は回数に数えない
+    if cached_zip and zip_cache.is_resume(download_request, cached_zip):
+        response = zip_cache.send(cached_zip, zip_name)
+        if response is not None:
+            return response
+
+    # ダウンロード回数チェック・更新（上限に達していないファイルのみ対象）
     available_files = []
     for f in files:
-        current_count = db.crud.get_file_download_count(download_request["id"], f["file_id"])
-        if current_count < download_request["max_downloads"]:
+        download_count = db.crud.increment_file_download_count(
+            download_request["id"],
+            f["file_id"],
+            download_request["max_downloads"]
+        )
+        if download_count is not None:
             available_files.append(f)
 
     if not available_files:
         abort(403, description="すべてのファイルがダウンロード上限に達しました")
 
-    # ZIPファイル作成
-    def generate():
-        buffer = io.BytesIO()
-        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zf:
-            for f in available_files:
-                # 実ファイルパス作成
-                file_path = os.path.join(
-                    UPLOAD_DIR,
-                    download_request["upload_request_id"],
-                    f["file_id"]
-                )
-
-                with open(file_path, "rb") as fp:
-                    encrypted_data = fp.read()
-
-                # 複合化
-                try:
-                    decrypted_data = current_app.fernet.decrypt(encrypted_data)
-                except Exception as e:
-                    # 複合化失敗はスキップ
-                    continue
-
-                zf.writestr(f["original_name"], decrypted_data)
-
-        buffer.seek(0)
-        yield from buffer
-    
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    zip_name = f"ssend_download_{timestamp}.zip"
-
-    # ダウンロード回数更新
-    for f in available_files:
-        db.crud.increment_file_download_count(download_request["id"], f["file_id"])
+    # 全ファイルが対象の場合は作成済みZIPを返す（上限に達したファイルを除く場合はその場で作成）
+    if cached_zip and len(available_files) == len(files):
+        response = zip_cache.send(cached_zip, zip_name)
+        if response is not None:
+            zip_cache.grant_resume(download_request, cached_zip)
+            return response
 
+    # その場で作成しながら送信（ZIP全体をメモリに載せない）
     return Response(
-        stream_with_context(generate()),
+        stream_with_context(zip_cache.stream(download_request["upload_request_id"], available_files)),
         mimetype="application/zip",
         headers={
             "Content-Disposition": f'attachment; filename="{zip_name}"'
@@ -487,37 +495,33 @@ def guest_upload(token):
     files = db.crud.list_files(upload_request["id"])
 
     # テーブルがVueなのでJSONに変換
-    upload_files_json = [{
-        "file_id": f["file_id"],
-        "original_name": f["original_name"],
-        "file_size": format_filesize(f["file_size"]),
-        "uploaded_at": format_datetime(f["uploaded_at"]),
-        "download_url": url_for(
-            "internal.download_file",
-            upload_id=upload_request["id"],
-            file_id=f["file_id"]
-        ),
-        "delete_url": url_for("internal.delete_file", file_id=f["file_id"]),
-    } for f in files]
+    upload_files = [schemas.file_item(f, upload_request["id"]) for f in files]
 
     return render_template(
         "guest_upload.html",
         upload_request=upload_request,
-        files_json=json.dumps(upload_files_json),
+        files_json=schemas.inline_json(upload_files),
     )
 
 # ------------------------
 # ゲスト向けファイルアップロード
 # ------------------------
-sigleSemaphore = threading.Semaphore(1)
+@guest_bp.route("/guest_upload/<token>/quota", methods=["GET"])
+@guestauth_required
+def guest_upload_quota(token):
+    # アップロード前の確認用（期限切れのURLは guestauth_required で 404 になる）
+    upload_request = db.crud.get_upload_request_by_token(token)
+    if upload_request is None:
+        abort(404)
+
+    return schemas.json_response(schemas.upload_quota(upload_stream.UploadQuota.of(upload_request)))
+
 
 @guest_bp.route("/guest_upload/<token>", methods=["POST"])
 @guestauth_required
+@upload_stream.streaming_upload(db.crud.get_upload_request_by_token)
 def guest_upload_file(token):
 
-    if "file" not in request.files or len(request.files.getlist("file")) < 1:
-        return "ファイルが選択されていません", 400
-
     # アクセスログ
     if hasattr(g, "access_log"):
         g.access_log.update({
@@ -536,81 +540,67 @@ def guest_upload_file(token):
             "upload_request_id": upload_id,
         })
 
+    # 受信したファイル（受信しながら暗号化して保存済み）
+    upload_target = upload_stream.current_target()
+
+    if "file" not in request.files or len(request.files.getlist("file")) < 1:
+        return "ファイルが選択されていません", 400
+
+    # ファイルアップロード（Dropzoneなので1件のみ）
+    file = request.files.getlist("file")[0]
+
     # １件ずつ処理
-    with sigleSemaphore:
+    with upload_stream.upload_lock:
+        (result,) = upload_stream.save_files(upload_request, upload_target, [file])
 
-        # ファイルアップロード（Dropzoneなので1件のみ）
-        file = request.files.getlist("file")[0]
+    if result["error"]:
+        return result["error"], 403
+    file = result["file"]
 
-        # アップロード済みファイル情報取得
-        uploaded_files = db.crud.list_files(upload_id)
+    # アクセスログ
+    if hasattr(g, "access_log"):
+        g.access_log.update({
+            "file_id": file["file_id"],
+        })
 
-        # 同一ファイル名チェック
-        existing_file = next(
-            (f for f in uploaded_files if f["original_name"] == file.filename),
-            None
-        )
+    return schemas.json_response(schemas.file_item(file))
 
-        if existing_file:
-            # 既存ファイルの実体パス
-            old_path = os.path.join(
-                UPLOAD_DIR,
-                upload_request["id"],
-                existing_file["file_id"]
-            )
-
-            # 実ファイル削除
-            if os.path.exists(old_path):
-                os.remove(old_path)
-
-            # DBレコード削除
-            db.crud.delete_file(existing_file["file_id"])
-
-            # uploaded_files から除外（サイズ再計算のため）
-            uploaded_files = [
-                f for f in uploaded_files
-                if f["file_id"] != existing_file["file_id"]
-            ]
-
-        # 現在のファイルサイズ合計を取得
-        total_size = sum(f["file_size"] for f in uploaded_files)
-
-        # アップロードファイル数チェック
-        if upload_request["max_files"] <= len(uploaded_files):
-            return "最大ファイル数に達しています", 403
-
-        # 元ファイルサイズ（暗号化前）
-        original_data = file.read()
-        file_size = len(original_data)
-
-        # アップロード可能ファイルサイズチェック
-        if total_size + file_size > upload_request["max_total_size"] * 1024 * 1024:
-            return "合計ファイルサイズの上限に達しています", 403
-
-        # 格納先フォルダ作成
-        upload_dir = os.path.join(UPLOAD_DIR, upload_request["id"])
-        os.makedirs(upload_dir, exist_ok=True)
-            
-        # 暗号化してファイル保存
-        file_id = str(uuid.uuid4())
-        save_path = os.path.join(upload_dir, file_id)
-        encrypted_data = current_app.fernet.encrypt(original_data)
-        with open(save_path, "wb") as f:
-            f.write(encrypted_data)
-
-        # ファイルテーブル挿入
-        db.crud.create_file(upload_request["id"], file_id, file.filename, file_size)
-        file = db.crud.get_file(file_id)
+@guest_bp.route("/guest_upload/<token>/batch", methods=["POST"])
+@guestauth_required
+@upload_stream.streaming_upload(db.crud.get_upload_request_by_token, partial=True)
+def guest_upload_files(token):
+    # 複数ファイルを1リクエストでアップロード（Dropzone の uploadMultiple）
 
-        # アクセスログ
-        if hasattr(g, "access_log"):
-            g.access_log.update({
-                "file_id": file_id,
-            })
+    # アップロード依頼情報取得
+    upload_request = db.crud.get_upload_request_by_token(token)
+    if upload_request is None:
+        abort(404)
+    upload_id = upload_request["id"]
+
+    # アクセスログ
+    if hasattr(g, "access_log"):
+        g.access_log.update({
+            "action": "ゲストファイルアップロード",
+            "upload_request_id": upload_id,
+        })
+
+    # 受信したファイル（受信しながら暗号化して保存済み）
+    upload_target = upload_stream.current_target()
+
+    files = request.files.getlist("file")
+    if not files:
+        return "ファイルが選択されていません", 400
+    if len(files) > schemas.BULK_MAX:
+        return "一度にアップロードできるファイル数を超えています", 400
+
+    # 上限の確認・登録はまとめて1回で行い、ファイルごとの結果を返す
+    with upload_stream.upload_lock:
+        results = upload_stream.save_files(upload_request, upload_target, files)
+
+    # アクセスログ（登録したファイルごと）
+    saved = [r["file"] for r in results if r["error"] is None]
+    log_each("ゲストファイルアップロード", [
+        {"upload_request_id": upload_id, "file_id": f["file_id"]} for f in saved
+    ] or [{"upload_request_id": upload_id}])
 
-    return jsonify({
-        "file_id": file_id,
-        "original_name": file["original_name"],
-        "file_size": format_filesize(file_size),
-        "uploaded_at": format_datetime(file["uploaded_at"]),
-    })
+    return schemas.json_response(schemas.upload_results(results))
@@ -2,7 +2,6 @@ import os
 import io
 import uuid
 import math
-import threading
 import json
 from datetime import datetime, date, timedelta
 from functools import wraps
@@ -24,8 +23,16 @@ from flask import (
     current_app,
 )
 from views.filters import format_datetime, format_filesize, format_mask_email
+from views import gs_auth, schemas
 import db
+import admission
+import file_cleanup
+import log_events
+import storage
+import upload_stream
+import rate_limit
 from paths import UPLOAD_DIR, GS_WHOAMI_URL
+from settings import get_settings
 
 # current_app.logger.info("request.files: %s", request.files)
 
@@ -62,6 +69,10 @@ def login():
         username = request.form.get("username")
         password = request.form.get("password")
 
+        # 試行回数制限（IP・ログインID単位）
+        rate_key = f"login:{username}"
+        rate_limit.check(rate_key, "ログイン")
+
         if db.crud.confirm_password(username, password) or authenticate_with_gs(username, password):
             # ユーザ情報取得
             user = db.crud.get_user(username)
@@ -72,6 +83,8 @@ def login():
             session["user_name"] = user["name"]
             session["admin"] = db.crud.is_admin_user(username)
 
+            rate_limit.succeeded(rate_key)
+
             # アクセスログ
             if hasattr(g, "access_log"):
                 g.access_log.update({
@@ -81,11 +94,13 @@ def login():
             return redirect(url_for("internal.menu"))
 
         else:
+            locked = rate_limit.failed(rate_key)
+
             # アクセスログ
             if hasattr(g, "access_log"):
                 g.access_log.update({
                     "user_id": username,
-                    "action": "ログイン NG",
+                    "action": "ログイン NG（ロック）" if locked else "ログイン NG",
                 })
             error = "ユーザー名またはパスワードが正しくありません"
 
@@ -96,37 +111,22 @@ def login():
 # ------------------------
 def authenticate_with_gs(username, password):
     try:
-        # GSからユーザ情報取得
-        response = requests.get(
-            GS_WHOAMI_URL,
-            auth=(username, password),
-            timeout=5
-        )
-
-        # ユーザ情報が取得できなければエラー
-        if response.status_code != 200:
-            return False
-        
-        current_app.logger.info(response.text)
-
-        # ユーザー情報から名前とメールアドレスを取得
-        root = ET.fromstring(response.text)
-        result = root.find("Result")
-        if result is None:
-            return False
-        login_id = result.findtext("LoginId")
-        name_sei = result.findtext("NameSei") or ""
-        name_mei = result.findtext("NameMei") or ""
-        name = f"{name_sei} {name_mei}".strip()
-        mail = result.findtext("Mail1") or ""
-
-        # ユーザー情報をテーブルに保存
-        db.crud.save_login_user(login_id, name, mail, external='GroupSession')
-        return True
-
+        # GSからユーザ情報取得（接続プール・キャッシュ・遮断制御は gs_auth 側）
+        user = gs_auth.whoami(username, password)
+    except gs_auth.GsUnavailable as e:
+        current_app.logger.warning("GroupSession unavailable: %s", e)
+        return False
     except Exception:
         return False
 
+    # ユーザ情報が取得できなければエラー
+    if user is None:
+        return False
+
+    # ユーザー情報をテーブルに保存
+    db.crud.save_login_user(user["login_id"], user["name"], user["mail"], external='GroupSession')
+    return True
+
 # ------------------------
 # ログアウト
 # ------------------------
@@ -236,176 +236,191 @@ def detail_upload_request(upload_id):
     if upload_request is None:
         abort(404)
 
-    # アップロード済ファイルリスト取得
-    files = db.crud.list_files(upload_id)
+    # ファイル・ダウンロードURL・ログは画面表示後に一覧APIから取得する
+    return render_template(
+        "upload_request_detail.html",
+        upload_request=upload_request,
+        page_size=DETAIL_PAGE_SIZE,
+    )
 
-    # ダウンロード依頼リスト取得
-    download_requests = db.crud.list_download_requests(upload_id)
+# ------------------------
+# アップロード依頼詳細画面－一覧（JSON）
+# ------------------------
+# 1回に返す件数（既定・上限）
+DETAIL_PAGE_SIZE = 50
+DETAIL_PAGE_SIZE_MAX = 200
 
-    # ログ取得
-    logs = db.crud.list_access_logs(upload_request_id=upload_id)
+def page_args():
+    # cursor: 前ページ最後の行のID（先頭ページは指定なし）
+    cursor = request.args.get("cursor", type=int)
+    limit = request.args.get("limit", DETAIL_PAGE_SIZE, type=int)
+    return cursor, max(1, min(limit, DETAIL_PAGE_SIZE_MAX))
 
-    # テーブルがVueなのでJSONに変換
-    upload_files_json = [{
-        "file_id": f["file_id"],
-        "original_name": f["original_name"],
-        "file_size": format_filesize(f["file_size"]),
-        "uploaded_at": format_datetime(f["uploaded_at"]),
-        "download_url": url_for(
-            "internal.download_file",
-            upload_id=upload_id,
-            file_id=f["file_id"]
-        ),
-        "delete_url": url_for("internal.delete_file", file_id=f["file_id"]),
-    } for f in files]
+def page_response(items, limit):
+    # 1件多く取得して次ページの有無を判定する
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_cursor = items[-1].id
 
-    # テーブルがVueなのでJSONに変換
-    download_urls_json = [{
-        "id": d["id"],
-        "download_token": d["download_token"],
-        "expire_days" : d["expire_days"],
-        "expires_at": format_datetime(d["expires_at"]),
-        "max_downloads" : d["max_downloads"],
-        "auth_type" : d["auth_type"],
-        "auth_password" : d["auth_password"],
-        "auth_email" : d["auth_email"],
-        "created_at" : format_datetime(d["created_at"]),
-        "delete_url": url_for("internal.delete_download_request", download_id=d["id"]),
-    } for d in download_requests]
+    response = schemas.json_response(schemas.Page(items=items, next_cursor=next_cursor))
 
-    # テーブルがVueなのでJSONに変換
-    logs_json = [{
-        "id": l["id"],
-        "accessed_at": format_datetime(l["accessed_at"]),
-        "user_id": l["user_id"],
-        "action": l["action"],
-        "download_request": l["download_request"],
-        "download_request_id": l["download_request_id"],
-        "file": l["file"],
-        "file_id": l["file_id"],
-        "result": l["result"],
-        "http_status": l["http_status"],
-        "ip_address": l["ip_address"],
-        "user_agent": l["user_agent"],
-    } for l in logs]
+    # 内容が変わっていなければ 304（ブラウザは毎回 If-None-Match で確認する）
+    response.add_etag()
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
 
-    return render_template(
-        "upload_request_detail.html",
-        upload_request=upload_request,
-        files_json=json.dumps(upload_files_json),
-        download_urls_json=json.dumps(download_urls_json),
-        logs_json=json.dumps(logs_json),
-    )
+@internal_bp.route("/upload_request/<upload_id>/files", methods=["GET"])
+@login_required
+def list_upload_request_files(upload_id):
+    cursor, limit = page_args()
+    files = db.crud.list_files_page(upload_id, cursor, limit + 1)
+    items = []
+    for f in files:
+        item = schemas.file_item(f, upload_id)
+        item.id = f["id"]
+        items.append(item)
+    return page_response(items, limit)
+
+@internal_bp.route("/upload_request/<upload_id>/download_urls", methods=["GET"])
+@login_required
+def list_upload_request_download_urls(upload_id):
+    cursor, limit = page_args()
+    download_requests = db.crud.list_download_requests_page(upload_id, cursor, limit + 1)
+    return page_response([schemas.download_url_item(d) for d in download_requests], limit)
+
+@internal_bp.route("/upload_request/<upload_id>/logs", methods=["GET"])
+@login_required
+def list_upload_request_logs(upload_id):
+    cursor, limit = page_args()
+    logs = db.crud.list_access_logs_page(upload_id, cursor, limit + 1)
+    return page_response([schemas.log_item(l) for l in logs], limit)
+
+@internal_bp.route("/upload_request/<upload_id>/logs/delta", methods=["GET"])
+@login_required
+def list_upload_request_logs_delta(upload_id):
+    # since_id より新しいログのみ返す。wait（秒）を指定した場合は追加されるまで待つ
+    if db.crud.get_upload_request(upload_id) is None:
+        abort(404)
+
+    settings = get_settings().log_poll
+    since_id = request.args.get("since_id", 0, type=int)
+    wait = request.args.get("wait", 0, type=float)
+    wait = max(0, min(wait, settings.max_wait))
+
+    # 1リクエストでワーカー全体を占有するサーバ（gunicorn の sync ワーカーなど）では待たない
+    # （スレッド・ASGI で動かしている場合のみサーバ側で待つ）
+    can_wait = request.environ.get("wsgi.multithread", False)
+    logs, waited = log_events.wait_for_logs(upload_id, since_id, DETAIL_PAGE_SIZE_MAX, wait if can_wait else 0)
+    has_more = len(logs) >= DETAIL_PAGE_SIZE_MAX
+
+    return schemas.json_response(schemas.LogDelta(
+        # 新しい順（画面の並び順）
+        items=[schemas.log_item(l) for l in reversed(logs)],
+        last_id=logs[-1]["id"] if logs else since_id,
+        has_more=has_more,
+        # 待機を求められたのに待たずに返した場合は、間隔を空けて取得してもらう
+        retry_after=settings.retry_after if wait and not waited and not has_more else 0,
+    ))
 
 # ------------------------
 # アップロード依頼詳細画面（ファイルアップロード）
 # ------------------------
-sigleSemaphore = threading.Semaphore(1)
+def is_expired(upload_request):
+    if not upload_request["expires_at"]:
+        return False
+    return datetime.fromisoformat(upload_request["expires_at"]).date() < date.today()
+
+@internal_bp.route("/upload/<upload_id>/quota", methods=["GET"])
+@login_required
+def get_upload_quota(upload_id):
+    # アップロード前の確認用（Dropzone が送信前に上限超過・期限切れを表示する）
+    upload_request = db.crud.get_upload_request(upload_id)
+    if upload_request is None:
+        abort(404)
+
+    return schemas.json_response(schemas.upload_quota(
+        upload_stream.UploadQuota.of(upload_request), is_expired(upload_request)
+    ))
+
 
 @internal_bp.route("/upload/<upload_id>", methods=["POST"])
 @login_required
+@upload_stream.streaming_upload(db.crud.get_upload_request)
 def upload_file(upload_id):
 
+    # アップロード依頼情報取得
+    upload_request = db.crud.get_upload_request(upload_id)
+    if upload_request is None:
+        abort(404)
+
+    # 有効期限チェック
+    if is_expired(upload_request):
+        return "このアップロードURLは期限切れです", 403
+
+    # 受信したファイル（受信しながら暗号化して保存済み）
+    upload_target = upload_stream.current_target()
+
     if "file" not in request.files or len(request.files.getlist("file")) < 1:
         return "ファイルが選択されていません", 400
 
+    # ファイルアップロード（Dropzoneなので1件のみ）
+    file = request.files.getlist("file")[0]
+
+    # １件ずつ処理
+    with upload_stream.upload_lock:
+        (result,) = upload_stream.save_files(upload_request, upload_target, [file])
+
+    if result["error"]:
+        return result["error"], 403
+    file = result["file"]
+
+    # アクセスログ
+    if hasattr(g, "access_log"):
+        g.access_log.update({
+            "action": "ファイルアップロード",
+            "upload_request_id": upload_id,
+            "file_id": file["file_id"],
+        })
+
+    return schemas.json_response(schemas.file_item(file, upload_request["id"]))
+
+@internal_bp.route("/upload/<upload_id>/batch", methods=["POST"])
+@login_required
+@upload_stream.streaming_upload(db.crud.get_upload_request, partial=True)
+def upload_files(upload_id):
+    # 複数ファイルを1リクエストでアップロード（Dropzone の uploadMultiple）
+
     # アップロード依頼情報取得
     upload_request = db.crud.get_upload_request(upload_id)
     if upload_request is None:
         abort(404)
 
     # 有効期限チェック
-    if upload_request["expires_at"]:
-        expires_at = datetime.fromisoformat(upload_request["expires_at"]).date()
-        if expires_at < date.today():
-            return "このアップロードURLは期限切れです", 403
-    
-    # １件ずつ処理
-    with sigleSemaphore:
+    if is_expired(upload_request):
+        return "このアップロードURLは期限切れです", 403
 
-        # ファイルアップロード（Dropzoneなので1件のみ）
-        file = request.files.getlist("file")[0]
+    # 受信したファイル（受信しながら暗号化して保存済み）
+    upload_target = upload_stream.current_target()
 
-        # アップロード済みファイル情報取得
-        uploaded_files = db.crud.list_files(upload_id)
+    files = request.files.getlist("file")
+    if not files:
+        return "ファイルが選択されていません", 400
+    if len(files) > schemas.BULK_MAX:
+        return "一度にアップロードできるファイル数を超えています", 400
 
-        # 同一ファイル名チェック
-        existing_file = next(
-            (f for f in uploaded_files if f["original_name"] == file.filename),
-            None
-        )
+    # 上限の確認・登録はまとめて1回で行い、ファイルごとの結果を返す
+    with upload_stream.upload_lock:
+        results = upload_stream.save_files(upload_request, upload_target, files)
 
-        if existing_file:
-            # 既存ファイルの実体パス
-            old_path = os.path.join(
-                UPLOAD_DIR,
-                upload_request["id"],
-                existing_file["file_id"]
-            )
-
-            # 実ファイル削除
-            if os.path.exists(old_path):
-                os.remove(old_path)
-
-            # DBレコード削除
-            db.crud.delete_file(existing_file["file_id"])
-
-            # uploaded_files から除外（サイズ再計算のため）
-            uploaded_files = [
-                f for f in uploaded_files
-                if f["file_id"] != existing_file["file_id"]
-            ]
-
-        # 現在のファイルサイズ合計を取得
-        total_size = sum(f["file_size"] for f in uploaded_files)
-
-        # アップロードファイル数チェック
-        if upload_request["max_files"] <= len(uploaded_files):
-            return "最大ファイル数に達しています", 403
-
-        # 元ファイルサイズ（暗号化前）
-        original_data = file.read()
-        file_size = len(original_data)
-
-        # アップロード可能ファイルサイズチェック
-        if total_size + file_size > upload_request["max_total_size"] * 1024 * 1024:
-            return "合計ファイルサイズの上限に達しています", 403
-
-        # 格納先フォルダ作成
-        upload_dir = os.path.join(UPLOAD_DIR, upload_request["id"])
-        os.makedirs(upload_dir, exist_ok=True)
-            
-        # 暗号化してファイル保存
-        file_id = str(uuid.uuid4())
-        save_path = os.path.join(upload_dir, file_id)
-        encrypted_data = current_app.fernet.encrypt(original_data)
-        with open(save_path, "wb") as f:
-            f.write(encrypted_data)
-
-        # ファイルテーブル挿入
-        db.crud.create_file(upload_request["id"], file_id, file.filename, file_size)
-        file = db.crud.get_file(file_id)
+    # アクセスログ（登録したファイルごと）
+    saved = [r["file"] for r in results if r["error"] is None]
+    log_each("ファイルアップロード", [
+        {"upload_request_id": upload_id, "file_id": f["file_id"]} for f in saved
+    ] or [{"upload_request_id": upload_id}])
 
-        # アクセスログ
-        if hasattr(g, "access_log"):
-            g.access_log.update({
-                "action": "ファイルアップロード",
-                "upload_request_id": upload_id,
-                "file_id": file_id,
-            })
-
-    return jsonify({
-        "file_id": file_id,
-        "original_name": file["original_name"],
-        "file_size": format_filesize(file_size),
-        "uploaded_at": format_datetime(file["uploaded_at"]),
-        "download_url": url_for(
-            "internal.download_file",
-            upload_id=upload_request["id"],
-            file_id=file_id
-        ),
-        "delete_url": url_for("internal.delete_file", file_id=file_id)
-    })
+    return schemas.json_response(schemas.upload_results(results, upload_request["id"]))
 
 # ------------------------
 # アップロードURL詳細画面－ファイルダウンロード
@@ -432,6 +447,9 @@ def download_file(upload_id, file_id):
     if not os.path.exists(file_path):
         abort(404)
 
+    # 同時転送数・転送量の制限（上限時は 503）
+    admission.acquire("download", file_row["file_size"])
+
     # アクセスログ
     if hasattr(g, "access_log"):
         g.access_log.update({
@@ -440,18 +458,14 @@ def download_file(upload_id, file_id):
             "file_id": file_id,
         })
     
-    # 暗号化ファイルを読み込み
-    with open(file_path, "rb") as f:
-        encrypted_data = f.read()
-
-    # 複合化
-    decrypted_data = current_app.fernet.decrypt(encrypted_data)
-
-    return send_file(
-        io.BytesIO(decrypted_data),
+    # 復号しながら送信（セグメント単位で復号し、ファイル全体をメモリに載せない）
+    response = send_file(
+        storage.DecryptedReader(current_app.fernet, file_path),
         as_attachment=True,
         download_name=file_row["original_name"]
     )
+    response.content_length = file_row["file_size"]
+    return response
 
 # ------------------------
 # アップロードURL詳細画面－ファイル削除
@@ -490,14 +504,14 @@ def delete_file(file_id):
 @login_required
 def generate_download_request():
 
-    # パラメータ取得（VueJSからの依頼なのでJSON形式）
-    payload = request.get_json()
-    upload_request_id = payload["upload_request_id"]
-    expire_days = payload["expire_days"]
-    max_downloads = payload["max_downloads"]
-    auth_type = payload["auth_type"]
-    auth_password = payload.get("auth_password")
-    auth_email = payload.get("auth_email")
+    # パラメータ取得（VueJSからの依頼なのでJSON形式、不正な場合は 400）
+    payload = schemas.decode_request(request.get_data(), schemas.GenerateDownloadRequest)
+    upload_request_id = payload.upload_request_id
+    expire_days = payload.expire_days
+    max_downloads = payload.max_downloads
+    auth_type = payload.auth_type
+    auth_password = payload.auth_password
+    auth_email = payload.auth_email
 
     # ダウンロードURL発行
     download_id = db.crud.create_download_request(
@@ -519,18 +533,43 @@ def generate_download_request():
             "download_request_id": download_id,
         })
 
-    return jsonify({
-        "id": download_row["id"],
-        "download_token": download_row["download_token"],
-        "expire_days" : download_row["expire_days"],
-        "expires_at": format_datetime(download_row["expires_at"]),
-        "max_downloads" : download_row["max_downloads"],
-        "auth_type" : download_row["auth_type"],
-        "auth_password" : download_row["auth_password"],
-        "auth_email" : download_row["auth_email"],
-        "created_at" : format_datetime(download_row["created_at"]),
-        "delete_url": url_for("internal.delete_download_request", download_id=download_row["id"]),
-    })
+    return schemas.json_response(schemas.download_url_item(download_row))
+
+# ------------------------
+# アップロード依頼詳細画面－ダウンロードURL一括発行（宛先ごと）
+# ------------------------
+@internal_bp.route("/generate_download_requests", methods=["POST"])
+@login_required
+def generate_download_requests():
+
+    # パラメータ取得（不正な場合は 400）
+    payload = schemas.decode_request(request.get_data(), schemas.GenerateDownloadRequests)
+
+    # 宛先（空白除去・重複除外）
+    auth_emails = list(dict.fromkeys(e.strip() for e in payload.auth_emails if e.strip()))
+    if not auth_emails or any("@" not in e for e in auth_emails):
+        abort(400, description="メールアドレスの形式が正しくありません")
+
+    if db.crud.get_upload_request(payload.upload_request_id) is None:
+        abort(404)
+
+    # 全宛先分を1トランザクションで発行
+    download_ids = db.crud.create_download_requests(
+        payload.upload_request_id,
+        payload.expire_days,
+        payload.max_downloads,
+        payload.auth_type,
+        payload.auth_password,
+        auth_emails)
+
+    # アクセスログ（URLごと）
+    log_each("ダウンロードURL作成", [
+        {"upload_request_id": payload.upload_request_id, "download_request_id": download_id}
+        for download_id in download_ids
+    ])
+
+    download_rows = db.crud.list_download_requests_by_ids(download_ids)
+    return schemas.json_response([schemas.download_url_item(d) for d in download_rows])
 
 # ------------------------
 # アップロード依頼詳細画面－ダウンロードURL削除
@@ -568,22 +607,7 @@ def get_access_logs(upload_id):
     logs = db.crud.list_access_logs(upload_request_id=upload_id)
 
     # テーブルがVueなのでJSONに変換
-    logs_json = [{
-        "id": l["id"],
-        "accessed_at": format_datetime(l["accessed_at"]),
-        "user_id": l["user_id"],
-        "action": l["action"],
-        "download_request": l["download_request"],
-        "download_request_id": l["download_request_id"],
-        "file": l["file"],
-        "file_id": l["file_id"],
-        "result": l["result"],
-        "http_status": l["http_status"],
-        "ip_address": l["ip_address"],
-        "user_agent": l["user_agent"],
-    } for l in logs]
-
-    return json.dumps(logs_json)
+    return schemas.json_response([schemas.log_item(l) for l in logs])
 
 # ------------------------
 # アップロードURL詳細画面－アップロード依頼削除
@@ -622,6 +646,72 @@ def delete_upload_request(upload_id):
 
     return "", 200
 
+# ------------------------
+# ファイルボックス一括操作（削除・期限切れ・期限延長）
+# ------------------------
+def bulk_target_ids(payload):
+    # 管理者は全ファイルボックス、それ以外は自分が作成したもののみ対象
+    user_id = None if session.get("admin") else session["user_id"]
+    return db.crud.filter_upload_request_ids(list(dict.fromkeys(payload.upload_request_ids)), user_id)
+
+def log_each(action, targets):
+    """
+    一括操作のアクセスログを対象ごとに残す。
+    最後の1件はリクエストのアクセスログとして after_request で保存する
+    （コミット後にログ更新待ちを起こすため）。
+    """
+    log = getattr(g, "access_log", None)
+    if log is None:
+        return
+
+    for target in targets[:-1]:
+        db.crud.save_access_log(dict(log, action=action, result="success", http_status=200, **target))
+
+    log["action"] = action
+    if targets:
+        log.update(targets[-1])
+
+@internal_bp.route("/delete_upload_requests", methods=["POST"])
+@login_required
+def delete_upload_requests():
+
+    payload = schemas.decode_request(request.get_data(), schemas.UploadRequestIds)
+    upload_ids = bulk_target_ids(payload)
+
+    # レコードは1トランザクションで削除し、ファイル実体は削除スレッドで削除する
+    count = db.crud.delete_upload_requests(upload_ids)
+    file_cleanup.notify()
+
+    log_each("ファイルボックス削除", [{"upload_request_id": u} for u in upload_ids])
+
+    return schemas.json_response(schemas.BulkResult(count=count))
+
+@internal_bp.route("/expire_upload_requests", methods=["POST"])
+@login_required
+def expire_upload_requests():
+
+    payload = schemas.decode_request(request.get_data(), schemas.UploadRequestIds)
+    upload_ids = bulk_target_ids(payload)
+
+    count = db.crud.expire_upload_requests(upload_ids)
+
+    log_each("ファイルボックス期限切れ", [{"upload_request_id": u} for u in upload_ids])
+
+    return schemas.json_response(schemas.BulkResult(count=count))
+
+@internal_bp.route("/extend_upload_requests", methods=["POST"])
+@login_required
+def extend_upload_requests():
+
+    payload = schemas.decode_request(request.get_data(), schemas.ExtendUploadRequests)
+    upload_ids = bulk_target_ids(payload)
+
+    count = db.crud.extend_upload_requests(upload_ids, payload.days)
+
+    log_each(f"ファイルボックス期限延長（{payload.days}日）", [{"upload_request_id": u} for u in upload_ids])
+
+    return schemas.json_response(schemas.BulkResult(count=count))
+
 # ------------------------
 # アドレス帳画面
 # ------------------------
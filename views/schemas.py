@@ -0,0 +1,191 @@
+from typing import Annotated, Generic, Literal, TypeVar
+
+import msgspec
+from flask import Response, abort, url_for
+from markupsafe import Markup
+
+from views.filters import format_datetime, format_filesize
+
+T = TypeVar("T")
+
+# 一括操作1回あたりの上限件数
+BULK_MAX = 500
+
+# ------------------------
+# レスポンスモデル
+# ------------------------
+class FileItem(msgspec.Struct, omit_defaults=True):
+    file_id: str
+    original_name: str
+    file_size: str
+    uploaded_at: str
+    download_url: str | None = None
+    delete_url: str | None = None
+    id: int | None = None               # ページングのカーソル
+
+class DownloadUrlItem(msgspec.Struct):
+    id: int
+    download_token: str
+    expire_days: int | None
+    expires_at: str
+    max_downloads: int | None
+    auth_type: str | None
+    auth_password: str | None
+    auth_email: str | None
+    created_at: str
+    delete_url: str
+
+class LogItem(msgspec.Struct):
+    id: int
+    accessed_at: str
+    user_id: str | None
+    action: str | None
+    download_request: str | None
+    download_request_id: int | str | None
+    file: str | None
+    file_id: str | None
+    result: str | None
+    http_status: int | None
+    ip_address: str | None
+    user_agent: str | None
+
+class Page(msgspec.Struct, Generic[T]):
+    items: list[T]
+    next_cursor: int | None
+
+class LogDelta(msgspec.Struct):
+    items: list[LogItem]
+    last_id: int
+    has_more: bool
+    retry_after: int = 0                # 次の取得まで空ける間隔（秒、サーバ側で待機しなかった場合）
+
+class BulkResult(msgspec.Struct):
+    count: int                          # 処理した件数
+
+class UploadResult(msgspec.Struct, omit_defaults=True):
+    name: str
+    file: FileItem | None = None        # 登録したファイル（エラーの場合は None）
+    error: str | None = None
+
+class UploadResults(msgspec.Struct):
+    results: list[UploadResult]         # 送信した順
+
+class UploadQuota(msgspec.Struct):
+    expired: bool
+    remaining_files: int
+    remaining_bytes: int
+    files: dict[str, int]               # アップロード済みファイル名 → サイズ（上書き判定用）
+
+# ------------------------
+# リクエストモデル
+# ------------------------
+class GenerateDownloadRequest(msgspec.Struct):
+    upload_request_id: str
+    expire_days: int
+    max_downloads: int
+    auth_type: Literal["none", "pass", "mail"]
+    auth_password: str | None = None
+    auth_email: str | None = None
+
+class GenerateDownloadRequests(msgspec.Struct):
+    """宛先メールアドレスごとにダウンロードURLを発行する"""
+    upload_request_id: str
+    expire_days: int
+    max_downloads: int
+    auth_type: Literal["none", "pass", "mail"]
+    auth_emails: Annotated[list[str], msgspec.Meta(min_length=1, max_length=BULK_MAX)]
+    auth_password: str | None = None
+
+class UploadRequestIds(msgspec.Struct):
+    upload_request_ids: Annotated[list[str], msgspec.Meta(min_length=1, max_length=BULK_MAX)]
+
+class ExtendUploadRequests(UploadRequestIds):
+    days: Annotated[int, msgspec.Meta(ge=1, le=365)]
+
+# ------------------------
+# 行 → モデル変換
+# ------------------------
+def file_item(row, upload_id=None):
+    """upload_id を指定した場合は社内向けのダウンロード・削除URLを付ける"""
+    item = FileItem(
+        file_id=row["file_id"],
+        original_name=row["original_name"],
+        file_size=format_filesize(row["file_size"]),
+        uploaded_at=format_datetime(row["uploaded_at"]),
+    )
+    if upload_id is not None:
+        item.download_url = url_for("internal.download_file", upload_id=upload_id, file_id=row["file_id"])
+        item.delete_url = url_for("internal.delete_file", file_id=row["file_id"])
+    return item
+
+def upload_results(results, upload_id=None):
+    return UploadResults(results=[
+        UploadResult(
+            name=r["name"],
+            file=file_item(r["file"], upload_id) if r["file"] else None,
+            error=r["error"],
+        )
+        for r in results
+    ])
+
+def upload_quota(quota, expired=False):
+    return UploadQuota(
+        expired=expired,
+        remaining_files=quota.remaining_files,
+        remaining_bytes=quota.remaining_bytes,
+        files=quota.sizes,
+    )
+
+def download_url_item(row):
+    return DownloadUrlItem(
+        id=row["id"],
+        download_token=row["download_token"],
+        expire_days=row["expire_days"],
+        expires_at=format_datetime(row["expires_at"]),
+        max_downloads=row["max_downloads"],
+        auth_type=row["auth_type"],
+        auth_password=row["auth_password"],
+        auth_email=row["auth_email"],
+        created_at=format_datetime(row["created_at"]),
+        delete_url=url_for("internal.delete_download_request", download_id=row["id"]),
+    )
+
+def log_item(row):
+    return LogItem(
+        id=row["id"],
+        accessed_at=format_datetime(row["accessed_at"]),
+        user_id=row["user_id"],
+        action=row["action"],
+        download_request=row["download_request"],
+        download_request_id=row["download_request_id"],
+        file=row["file"],
+        file_id=row["file_id"],
+        result=row["result"],
+        http_status=row["http_status"],
+        ip_address=row["ip_address"],
+        user_agent=row["user_agent"],
+    )
+
+# ------------------------
+# エンコード・デコード
+# ------------------------
+_encoder = msgspec.json.Encoder()
+
+def json_response(obj, status=200):
+    return Response(_encoder.encode(obj), status=status, mimetype="application/json")
+
+def inline_json(obj):
+    """テンプレートの <script> 内に埋め込む JSON（</script> などで抜けられないよう < > & をエスケープ）"""
+    text = _encoder.encode(obj).decode("utf-8")
+    text = text.replace("<", "\\u003c").replace(">", "\\u003e").replace("&", "\\u0026")
+    return Markup(text)
+
+def decode_request(data, model):
+    """リクエストボディを検証してモデルに変換する（不正な場合は 400）"""
+    try:
+        # 画面の入力値は文字列で送られるため数値への変換を許可する
+        return msgspec.json.decode(data, type=model, strict=False)
+    except msgspec.ValidationError as e:
+        abort(400, description=str(e))
+    except msgspec.DecodeError:
+        abort(400, description="JSONの形式が正しくありません")
@@ -1,3 +1,7 @@
+import assets
 from app import app
 
+# 同梱ライブラリ（static/vendor）が未取得の場合は起動しない
+assets.require_vendor_assets(app)
+
 application = app
@@ -0,0 +1,252 @@
+import io
+import os
+import time
+import hashlib
+import zipfile
+from datetime import datetime, timedelta
+
+from flask import current_app, request, send_file, session
+
+import db
+import storage
+from background import BackgroundWorker
+from paths import UPLOAD_DIR, ZIP_CACHE_DIR
+from settings import get_settings
+
+# ------------------------
+# 設定
+# ------------------------
+# 作成待ちの確認間隔（秒）
+ZIP_CACHE_POLL_INTERVAL = 10
+# 作成中のまま残った依頼（作成中にワーカーが停止した場合）を作成し直すまでの時間（秒）
+ZIP_BUILD_TIMEOUT = 3600
+# ダウンロード回数を数えた後、同じZIPへの Range リクエスト（中断したダウンロードの再開）を
+# 回数に数えない期間（秒）
+RESUME_WINDOW = 3600
+
+# ------------------------
+# キャッシュのキー
+# ------------------------
+def version_of(files):
+    """ファイル構成（ファイル・名前・サイズ・並び順）と圧縮レベルのハッシュ"""
+    h = hashlib.sha256(str(get_settings().zip.compress_level).encode())
+    for f in files:
+        h.update(f"\n{f['file_id']}\t{f['original_name']}\t{f['file_size']}".encode("utf-8"))
+    return h.hexdigest()[:32]
+
+def cache_path(upload_request_id, version):
+    return os.path.join(ZIP_CACHE_DIR, f"{upload_request_id}-{version}")
+
+# ------------------------
+# キャッシュ取得（ない場合は作成を依頼して None を返す）
+# ------------------------
+def lookup(upload_request_id, files):
+    if not get_settings().zip.cache_enabled:
+        return None
+
+    entry = db.crud.get_zip_cache(upload_request_id, version_of(files))
+    if entry is None or not os.path.exists(cache_path(upload_request_id, entry["version"])):
+        db.crud.request_zip_build(upload_request_id, delay=False)
+        return None
+    return entry
+
+# ------------------------
+# ダウンロード再開の判定
+# ------------------------
+def is_resume(download_request, entry):
+    """同じセッションで回数を数えた同じZIPへの Range リクエストか"""
+    if request.range is None:
+        return False
+    grant = session.get("zip_resume", {}).get(str(download_request["id"]))
+    return grant is not None and grant[0] == entry["version"] and grant[1] > time.time()
+
+def grant_resume(download_request, entry):
+    now = time.time()
+    grants = {k: v for k, v in session.get("zip_resume", {}).items() if v[1] > now}
+    grants[str(download_request["id"])] = [entry["version"], now + RESUME_WINDOW]
+    session["zip_resume"] = grants
+
+# ------------------------
+# キャッシュ送信（Range リクエスト対応）
+# ------------------------
+def send(entry, download_name):
+    """キャッシュが削除されていた場合は None を返す（呼び出し側でその場で作成する）"""
+    path = cache_path(entry["upload_request_id"], entry["version"])
+    try:
+        reader = storage.DecryptedReader(current_app.fernet, path)
+    except FileNotFoundError:
+        return None
+
+    db.crud.touch_zip_cache(entry["upload_request_id"], entry["version"])
+
+    response = send_file(
+        reader,
+        mimetype="application/zip",
+        as_attachment=True,
+        download_name=download_name,
+        conditional=False,
+    )
+    response.content_length = entry["size"]
+    # 同じ版のZIPは同じ内容のため、版をETagにして途中からの再開（If-Range）を受け付ける
+    response.set_etag(entry["version"])
+    response.last_modified = datetime.fromisoformat(entry["created_at"])
+    response.cache_control.private = True
+    response.accept_ranges = "bytes"
+    return response.make_conditional(request, accept_ranges=True, complete_length=entry["size"])
+
+# ------------------------
+# キャッシュ作成
+# ------------------------
+def build(upload_request_id):
+    upload_request = db.crud.get_upload_request(upload_request_id)
+    files = db.crud.list_files(upload_request_id) if upload_request else []
+
+    # 共有されていない（ダウンロードURLがない）ファイルボックスは作成しない
+    if not files or not db.crud.list_download_requests(upload_request_id):
+        remove_versions(upload_request_id)
+        return
+
+    version = version_of(files)
+    path = cache_path(upload_request_id, version)
+    if db.crud.get_zip_cache(upload_request_id, version) and os.path.exists(path):
+        return
+
+    os.makedirs(ZIP_CACHE_DIR, exist_ok=True)
+    with storage.EncryptedWriter(current_app.fernet, path) as dst:
+        for _ in write_zip(dst, upload_request_id, files):
+            pass
+
+    db.crud.save_zip_cache(upload_request_id, version, dst.size, os.path.getsize(path))
+
+    # 古い版は使われないため削除
+    remove_versions(upload_request_id, keep=version)
+
+# ------------------------
+# ZIP作成（キャッシュ作成・その場での作成で共通）
+# ------------------------
+def write_zip(dst, upload_request_id, files, skip_unreadable=False):
+    """
+    files を復号しながら ZIP 形式で dst に書き込む（ファイル全体をメモリに載せない）。
+    書き込むごとに yield する（呼び出し側で書き込まれた分を送信できる）。
+    skip_unreadable=True の場合、復号できないファイルは含めない（先頭セグメントで判定する）。
+    """
+    with zipfile.ZipFile(
+        dst,
+        "w",
+        zipfile.ZIP_DEFLATED,
+        compresslevel=get_settings().zip.compress_level
+    ) as zf:
+        for f in files:
+            src = os.path.join(UPLOAD_DIR, upload_request_id, f["file_id"])
+            segments = storage.iter_decrypted(current_app.fernet, src)
+            try:
+                first = next(segments, b"")
+            except Exception:
+                if not skip_unreadable:
+                    raise
+                current_app.logger.warning("skip unreadable file in zip: %s", f["file_id"])
+                continue
+
+            # 書き込み前にサイズが分からないため、大きいファイルは ZIP64 形式にする
+            zip64 = f["file_size"] * 1.05 > zipfile.ZIP64_LIMIT
+            with zf.open(f["original_name"], "w", force_zip64=zip64) as out:
+                out.write(first)
+                yield
+                for data in segments:
+                    out.write(data)
+                    yield
+
+class _ChunkWriter(io.RawIOBase):
+    """書き込まれたデータを送信用に溜める（seek できないため zipfile はデータディスクリプタ形式で書く）"""
+
+    def __init__(self):
+        self._chunks = []
+        self._pos = 0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._chunks.append(bytes(b))
+        self._pos += len(b)
+        return len(b)
+
+    def tell(self):
+        return self._pos
+
+    def drain(self):
+        chunks, self._chunks = self._chunks, []
+        return chunks
+
+def stream(upload_request_id, files):
+    """その場で ZIP を作成しながら返す（レスポンスの本文。ZIP 全体をメモリに載せない）"""
+    out = _ChunkWriter()
+    for _ in write_zip(out, upload_request_id, files, skip_unreadable=True):
+        yield from out.drain()
+    yield from out.drain()
+
+def remove_versions(upload_request_id, keep=None):
+    for entry in db.crud.list_zip_cache(upload_request_id):
+        if entry["version"] != keep:
+            remove(entry)
+
+def remove(entry):
+    db.crud.delete_zip_cache(entry["upload_request_id"], entry["version"])
+    try:
+        os.remove(cache_path(entry["upload_request_id"], entry["version"]))
+    except FileNotFoundError:
+        pass
+
+# ------------------------
+# 容量超過分の削除（最終利用が古いものから）
+# ------------------------
+def evict(max_bytes):
+    # 削除済みのファイルボックスのキャッシュ
+    for entry in db.crud.list_zip_cache(orphaned=True):
+        remove(entry)
+
+    entries = db.crud.list_zip_cache()
+    total = sum(e["stored_bytes"] for e in entries)
+    for entry in entries:
+        if total <= max_bytes:
+            break
+        remove(entry)
+        total -= entry["stored_bytes"]
+
+# ------------------------
+# 作成待ち処理（作成スレッドから呼ばれる）
+# ------------------------
+def process_zip_builds():
+    settings = get_settings().zip
+
+    # 変更が続いている間は作成しない（最後の変更から cache_build_delay 秒待つ）
+    now = datetime.now()
+    claimed = db.crud.claim_zip_build(
+        now - timedelta(seconds=settings.cache_build_delay),
+        now - timedelta(seconds=ZIP_BUILD_TIMEOUT),
+    )
+    if claimed is None:
+        if settings.cache_enabled:
+            evict(settings.cache_max_mb * 1024 * 1024)
+        return 0
+
+    upload_request_id, requested_at = claimed
+    try:
+        # キャッシュを使わない設定の場合は依頼を破棄するだけ
+        if settings.cache_enabled:
+            try:
+                build(upload_request_id)
+            except Exception:
+                current_app.logger.exception("zip cache build failed: %s", upload_request_id)
+            evict(settings.cache_max_mb * 1024 * 1024)
+    finally:
+        db.crud.finish_zip_build(upload_request_id, requested_at)
+    return 1
+
+_worker = BackgroundWorker("zip-cache", process_zip_builds, ZIP_CACHE_POLL_INTERVAL)
+
+def init_app(app):
+
+    @app.before_request
+    def start_zip_cache_worker():
+        _worker.start(app)